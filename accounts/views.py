@@ -3,7 +3,10 @@ from django.contrib.auth import get_user_model
 from rest_framework import viewsets
 
 from core.models import NetworkRating
-from core.serializers import NetworkRatingSerializer
+from core.pagination import KeysetPagination
+from core.querysets import prefetch_ratings, prepare_ratings_queryset, ratings_serializer_context
+from core.fastserializers import FastSerializer
+from core.utils import get_user_rating_summary
 from .serializers import LoginSerializer, UserSerializer
 from rest_framework.viewsets import ViewSet
 from rest_framework.response import Response
@@ -63,8 +66,25 @@ class LoginViewSet(ViewSet):
 class ProfileApiView(APIView):
     authentication_classes = (JWTAuthentication,)
     permission_classes = (IsAuthenticated,)
+    pagination_class = KeysetPagination
 
     def get(self, request, *args, **kwargs):
         user = request.user
-        ratings = NetworkRating.objects.filter(user=user)
-        return Response({'user': {"username": user.username, "email": user.email, "first_name": user.first_name, "last_name": user.last_name}, "ratings": NetworkRatingSerializer(ratings, many=True).data})
\ No newline at end of file
+        with_comments = request.GET.get('comments', 'false').lower() == 'true'
+
+        paginator = self.pagination_class()
+        ratings = paginator.paginate_queryset(
+            prepare_ratings_queryset(NetworkRating.objects.filter(user=user)), request, view=self
+        )
+        if with_comments:
+            ratings = prefetch_ratings(ratings)
+            data = FastSerializer(ratings_serializer_context(request, ratings)).ratings(ratings)
+        else:
+            data = FastSerializer({'request': request}).ratings(ratings, comments=False)
+
+        return Response({
+            'user': {"username": user.username, "email": user.email, "first_name": user.first_name, "last_name": user.last_name},
+            'summary': get_user_rating_summary(user.id),
+            'ratings': data,
+            'next': paginator.get_next_link(),
+        })
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Network, NetworkDevice, NetworkRating, Comment
+from .models import Network, NetworkDevice, NetworkRating, NetworkRatingStats, UserRatingStats, Comment
 
 @admin.register(Network)
 class NetworkAdmin(admin.ModelAdmin):
@@ -24,3 +24,15 @@ class CommentAdmin(admin.ModelAdmin):
     list_display = ('user', 'content', 'created_at', 'is_reply')
     search_fields = ('user__username', 'content')
     list_filter = ('created_at', 'user')
+
+@admin.register(NetworkRatingStats)
+class NetworkRatingStatsAdmin(admin.ModelAdmin):
+    list_display = ('network', 'rating_count', 'average_rating', 'comment_count', 'last_rated_at')
+    search_fields = ('network__name',)
+    readonly_fields = [field.name for field in NetworkRatingStats._meta.fields]
+
+@admin.register(UserRatingStats)
+class UserRatingStatsAdmin(admin.ModelAdmin):
+    list_display = ('user', 'rating_count', 'average_rating', 'networks_rated', 'last_rated_at')
+    search_fields = ('user__username',)
+    readonly_fields = [field.name for field in UserRatingStats._meta.fields]
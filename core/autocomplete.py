@@ -0,0 +1,179 @@
+"""
+In-process autocomplete index over network names and slugs.
+
+The ISP picker asks for matches on every keystroke. There are few networks
+and they rarely change, so each worker keeps them all in memory with two
+lookup structures and answers without touching the database:
+
+    prefixes  sorted (word, position) pairs, one per word of a name or
+              slug, searched with bisect for words starting with the query
+    trigrams  trigram -> positions, for matches inside words and typos
+
+The index is built when a worker starts (see radarr/wsgi.py), or else on
+first use, and thrown away when a network is saved or deleted in this
+process. Other workers notice the change through the
+'networks' data version of the response cache, which is checked at most
+every `refresh_interval` seconds.
+"""
+import bisect
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+from core.models import Network
+from core.response_cache import response_cache
+from core.fastserializers import FastSerializer, network_rows
+
+MIN_SIMILARITY = 0.3
+
+_WORD = re.compile(r'[^\W_]+')
+
+
+def normalize(text: str) -> str:
+    """Lowercase `text` and strip accents"""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).lower()
+
+
+def trigrams(text: str) -> set:
+    """Trigrams of the words of `text`, padded like pg_trgm (two spaces before, one after)"""
+    grams = set()
+    for word in _WORD.findall(normalize(text)):
+        padded = f'  {word} '
+        grams.update(padded[index:index + 3] for index in range(len(padded) - 2))
+    return grams
+
+
+class NetworkIndex:
+    """
+    Immutable snapshot of every network, with prefix and trigram lookups.
+    """
+
+    def __init__(self, networks: List[Dict], version):
+        self.version = version
+        self.networks = networks
+        self.names = [normalize(network['name']) for network in networks]
+        self.grams = [trigrams(f"{network['name']} {network['slug']}") for network in networks]
+
+        prefixes = set()
+        self.trigrams: Dict[str, set] = {}
+        for position, network in enumerate(networks):
+            words = _WORD.findall(normalize(f"{network['name']} {network['slug']}"))
+            prefixes.update((word, position) for word in words)
+            for gram in self.grams[position]:
+                self.trigrams.setdefault(gram, set()).add(position)
+        self.prefixes = sorted(prefixes)
+
+    def _prefix_matches(self, word: str) -> set:
+        start = bisect.bisect_left(self.prefixes, (word,))
+        matches = set()
+        for indexed, position in self.prefixes[start:]:
+            if not indexed.startswith(word):
+                break
+            matches.add(position)
+        return matches
+
+    def _score(self, position: int, query: str, prefix_hits: set, query_grams: int, shared: int) -> Optional[float]:
+        """Match quality of one network, higher is better; None if it doesn't match"""
+        name = self.names[position]
+        if name == query:
+            return 4.0
+        if name.startswith(query):
+            return 3.0
+        if position in prefix_hits:
+            return 2.0
+        # Jaccard similarity of the trigram sets
+        similarity = shared / (query_grams + len(self.grams[position]) - shared)
+        return similarity if similarity >= MIN_SIMILARITY else None
+
+    def search(self, query: str, limit: int = 10) -> List[Dict]:
+        """
+        Best matches for `query`, active networks first.
+
+        A network matches if every word of the query starts one of the words
+        of its name or slug, or failing that if their trigrams are similar
+        enough. Without a query, every network matches.
+
+        Args:
+            query: Text typed so far
+            limit: Maximum number of matches
+
+        Returns:
+            Networks as serialized by NetworkSerializer (image URLs relative)
+        """
+        query = normalize(query).strip()
+        words = _WORD.findall(query)
+        if not words:
+            candidates = {position: 0.0 for position in range(len(self.networks))}
+        else:
+            query_grams = trigrams(query)
+            prefix_hits = set.intersection(*(self._prefix_matches(word) for word in words))
+            shared = Counter()
+            for gram in query_grams:
+                shared.update(self.trigrams.get(gram, ()))
+            candidates = {}
+            for position in prefix_hits | shared.keys():
+                score = self._score(position, query, prefix_hits, len(query_grams), shared[position])
+                if score is not None:
+                    candidates[position] = score
+
+        ranked = sorted(
+            candidates,
+            key=lambda position: (
+                not self.networks[position]['status'], -candidates[position], self.names[position], position,
+            ),
+        )
+        return [self.networks[position] for position in ranked[:limit]]
+
+
+class NetworkAutocomplete:
+    """
+    Holder of the current index of this process, rebuilt when it goes stale.
+    """
+
+    def __init__(self, refresh_interval: float):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._index: Optional[NetworkIndex] = None
+        self._checked_at = 0.0
+
+    def index(self) -> NetworkIndex:
+        index = self._index
+        now = time.monotonic()
+        if index is not None and now - self._checked_at < self.refresh_interval:
+            return index
+
+        with self._lock:
+            version = response_cache.versions(('networks',))
+            if self._index is None or self._index.version != version:
+                networks = FastSerializer().networks(network_rows(Network.objects.order_by('name', 'id')))
+                self._index = NetworkIndex(networks, version)
+            self._checked_at = time.monotonic()
+            return self._index
+
+    def warm(self):
+        """Build the index ahead of the first search, if the database is ready"""
+        try:
+            self.index()
+        except DatabaseError:
+            pass
+
+    def invalidate(self):
+        """Drop the index of this process; the next search rebuilds it"""
+        with self._lock:
+            self._index = None
+
+    def invalidate_on_commit(self):
+        transaction.on_commit(self.invalidate)
+
+    def search(self, query: str, limit: int = 10) -> List[Dict]:
+        return self.index().search(query, limit)
+
+
+network_autocomplete = NetworkAutocomplete(refresh_interval=settings.NETWORK_AUTOCOMPLETE_REFRESH_INTERVAL)
@@ -0,0 +1,182 @@
+"""
+Background location enrichment for newly created ratings.
+
+Ratings are saved straight away with `location_pending=True`; the IP lookup
+and the latitude/longitude/address fill-in run afterwards on a small thread
+pool, so write latency never depends on the geolocation provider.
+
+The queue lives in the worker process. Lookups lost with it (a restart, a
+killed worker) leave their ratings pending; `sweep_stale_locations` (the
+`enrich_pending_locations` command) runs them again from the client IP kept
+on the rating.
+"""
+import ipaddress
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+from django.utils import timezone
+
+from core.models import NetworkRating
+from core.response_cache import response_cache
+from core.utils import get_location_from_ip, location_from_payload
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = set()
+
+logger = logging.getLogger(__name__)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.LOCATION_ENRICHMENT_WORKERS,
+                    thread_name_prefix='location-enrichment',
+                )
+    return _executor
+
+
+def _coordinate(value) -> Decimal:
+    return Decimal(str(round(float(value), 6)))
+
+
+def storable_ip(ip):
+    """`ip` if it is an IP address that can be kept on the rating, else None"""
+    try:
+        return str(ipaddress.ip_address(str(ip).strip()))
+    except ValueError:
+        return None
+
+
+def enrich_rating_location(rating_id: int, ip: str, address=None) -> bool:
+    """
+    Look up the location of `ip` and store it on the rating.
+
+    Lookups that fail are retried with exponential backoff; retries bypass the
+    location cache, whose negative entry for `ip` would otherwise answer them.
+    Once attempts are exhausted the rating is left without coordinates. The
+    pending marker and the kept client IP are cleared either way.
+
+    Args:
+        rating_id: ID of the rating to enrich
+        ip: Client IP address the rating was posted from
+        address: Address supplied by the user, if any, prefixed to the
+            looked-up one
+
+    Returns:
+        True if coordinates were stored
+    """
+    max_attempts = settings.LOCATION_ENRICHMENT_MAX_ATTEMPTS
+    location = None
+    for attempt in range(max_attempts):
+        location = location_from_payload(get_location_from_ip(ip, refresh=attempt > 0))
+        if location or settings.IP_GEOLOCATION_BACKEND == 'local':
+            # The offline database gives the same answer every time
+            break
+        if attempt + 1 < max_attempts:
+            time.sleep(settings.LOCATION_ENRICHMENT_RETRY_BACKOFF * (2 ** attempt))
+
+    if not location:
+        NetworkRating.objects.filter(pk=rating_id).update(location_pending=False, client_ip=None)
+        response_cache.bump_on_commit('ratings')
+        return False
+
+    addy, longitude, latitude = location
+    rating = NetworkRating(latitude=_coordinate(latitude), longitude=_coordinate(longitude))
+    NetworkRating.objects.filter(pk=rating_id).update(
+        latitude=rating.latitude,
+        longitude=rating.longitude,
+        geohash=rating.compute_geohash(),
+        address=", ".join(part for part in (address, addy) if part),
+        location_pending=False,
+        client_ip=None,
+    )
+    response_cache.bump_on_commit('ratings')
+    return True
+
+
+def _run(rating_id: int, ip: str, address):
+    close_old_connections()
+    try:
+        enrich_rating_location(rating_id, ip, address)
+    except Exception:
+        logger.exception("Error enriching location of rating %s", rating_id)
+    finally:
+        connections.close_all()
+
+
+def _submit(rating_id: int, ip: str, address):
+    future = _get_executor().submit(_run, rating_id, ip, address)
+    with _executor_lock:
+        _pending.add(future)
+    future.add_done_callback(_discard)
+
+
+def _discard(future):
+    with _executor_lock:
+        _pending.discard(future)
+
+
+def enqueue_location_enrichment(rating_id: int, ip: str, address=None):
+    """
+    Schedule enrichment of a rating once the current transaction commits.
+
+    With LOCATION_ENRICHMENT_SYNC enabled the enrichment runs inline instead.
+    """
+    if settings.LOCATION_ENRICHMENT_SYNC:
+        enrich_rating_location(rating_id, ip, address)
+    else:
+        transaction.on_commit(lambda: _submit(rating_id, ip, address))
+
+
+def flush_location_enrichment(timeout=None) -> bool:
+    """
+    Block until every queued enrichment has finished.
+
+    Returns:
+        True if the queue drained within `timeout` seconds
+    """
+    with _executor_lock:
+        pending = list(_pending)
+    if not pending:
+        return True
+    _, not_done = wait(pending, timeout=timeout)
+    return not not_done
+
+
+def sweep_stale_locations(older_than: float) -> tuple:
+    """
+    Run again the lookups of ratings still pending `older_than` seconds
+    after they were created, whose queued lookup was lost. Ratings without
+    a kept client IP (created before it was kept) just stop pending.
+
+    Runs the lookups inline, one rating at a time.
+
+    Returns:
+        Number of ratings enriched, and of ratings left without a location
+    """
+    stale = (
+        NetworkRating.objects
+        .filter(location_pending=True, created_at__lt=timezone.now() - timedelta(seconds=older_than))
+        .order_by('created_at')
+        .values_list('id', 'client_ip', 'address')
+    )
+    enriched = failed = 0
+    for rating_id, ip, address in stale.iterator():
+        if ip and enrich_rating_location(rating_id, ip, address):
+            enriched += 1
+        else:
+            if not ip:
+                NetworkRating.objects.filter(pk=rating_id).update(location_pending=False)
+                response_cache.bump_on_commit('ratings')
+            failed += 1
+    return enriched, failed
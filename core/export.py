@@ -0,0 +1,153 @@
+"""
+Streaming export of ratings as NDJSON or CSV.
+
+Rows are read as plain `values()` dicts through a chunked iterator (a
+server-side cursor on PostgreSQL) and encoded one at a time as the response
+is sent, so memory use doesn't depend on the number of ratings exported.
+
+Rows come in ID order. An interrupted export is resumed by passing the ID of
+the last row received as the cursor: rows created meanwhile have higher IDs
+and are picked up at the end.
+"""
+import csv
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, Iterable, Iterator, Optional
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from core.models import NetworkRating
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+EXPORT_FIELDS = {
+    'id': 'id',
+    'user_id': 'user_id',
+    'username': 'user__username',
+    'network_id': 'network_id',
+    'network': 'network__name',
+    'device_id': 'device_id',
+    'device': 'device__name',
+    'rating': 'rating',
+    'review': 'review',
+    'address': 'address',
+    'latitude': 'latitude',
+    'longitude': 'longitude',
+    'created_at': 'created_at',
+    'location_pending': 'location_pending',
+}
+
+LINES_PER_WRITE = 100
+
+
+def export_queryset(since: datetime = None, network_id: int = None, cursor: int = None, limit: int = None):
+    """
+    Ratings to export, as `values()` rows keyed by the lookups of
+    EXPORT_FIELDS.
+
+    Args:
+        since: Only ratings created at or after this time
+        network_id: Only ratings of this network
+        cursor: Only ratings after this ID (the last one received)
+        limit: Maximum number of ratings
+    """
+    ratings = NetworkRating.objects.all()
+    if since is not None:
+        ratings = ratings.filter(created_at__gte=since)
+    if network_id is not None:
+        ratings = ratings.filter(network_id=network_id)
+    if cursor is not None:
+        ratings = ratings.filter(id__gt=cursor)
+    ratings = ratings.order_by('id').values(*EXPORT_FIELDS.values())
+    if limit is not None:
+        ratings = ratings[:limit]
+    return ratings
+
+
+def _plain(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _ordered(row: Dict) -> Dict:
+    return {name: _plain(row[lookup]) for name, lookup in EXPORT_FIELDS.items()}
+
+
+def ndjson_lines(rows: Iterable[Dict]) -> Iterator[str]:
+    """One JSON object per line"""
+    for row in rows:
+        yield json.dumps(_ordered(row), ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+class _Echo:
+    """File-like object handing back whatever csv.writer writes to it"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows: Iterable[Dict]) -> Iterator[str]:
+    """A header line, then one line per row"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(list(EXPORT_FIELDS))
+    for row in rows:
+        yield writer.writerow(['' if value is None else value for value in _ordered(row).values()])
+
+
+def export_lines(output: str, since: datetime = None, network_id: int = None, cursor: int = None,
+                 limit: int = None, chunk_size: int = 2000) -> Iterator[str]:
+    """
+    Encoded export, in groups of LINES_PER_WRITE lines.
+
+    Args:
+        output: 'ndjson' or 'csv'
+        chunk_size: Rows fetched from the database at a time
+
+    Raises:
+        ValueError: For an unknown output format
+    """
+    if output not in FORMATS:
+        raise ValueError(f"output must be one of {', '.join(FORMATS)}")
+    rows = export_queryset(since, network_id, cursor, limit).iterator(chunk_size=chunk_size)
+    return _grouped(ndjson_lines(rows) if output == 'ndjson' else csv_lines(rows))
+
+
+def _grouped(lines: Iterator[str], size: int = LINES_PER_WRITE) -> Iterator[str]:
+    """Join lines `size` at a time, so the server isn't handed one write per row"""
+    group = []
+    for line in lines:
+        group.append(line)
+        if len(group) >= size:
+            yield ''.join(group)
+            group = []
+    if group:
+        yield ''.join(group)
+
+
+def parse_since(value: Optional[str]) -> Optional[datetime]:
+    """
+    `since` parameter as an aware datetime; a date means midnight in the
+    current time zone.
+
+    Raises:
+        ValueError: If the value is neither an ISO date nor an ISO datetime
+    """
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid since: {value}")
+        parsed = datetime(day.year, day.month, day.day)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
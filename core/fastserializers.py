@@ -0,0 +1,209 @@
+"""
+Read-only fast path for serializing ratings, comments, networks and devices.
+
+DRF serializers are built for both directions: every row goes through field
+binding, `get_attribute` lookups and one nested serializer instance per
+`SerializerMethodField` (`NetworkRatingSerializer.get_network` builds a
+`NetworkSerializer` per rating). On list responses that dominates CPU time
+even when every query is already batched.
+
+`FastSerializer` produces the same output as those serializers from rows
+prepared by core/querysets.py (or from `values()` rows for networks and
+devices), with everything that doesn't depend on the row worked out once:
+the time zone, the decimal quantization context, the media URL prefix and
+the liked-comment set. Networks and devices are rendered once per response
+and copied for each rating that refers to them.
+
+The DRF serializers remain the reference (and handle writes); `bench_serializers`
+compares the two paths and checks that their output is identical.
+"""
+import datetime as dt
+from decimal import Context, Decimal
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.utils.urls import replace_query_param
+
+from core.models import Network
+from core.pagination import CommentPagination, ReplyPagination
+
+NETWORK_FIELDS = ('id', 'name', 'image', 'status', 'slug')
+DEVICE_FIELDS = ('id', 'name', 'slug')
+
+# Same quantization as the `rating` DecimalField of NetworkRatingSerializer
+_RATING_PLACES = Decimal('.1')
+_RATING_CONTEXT = Context(prec=3)
+
+
+def _rating(value) -> str:
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value).strip())
+    return '{:f}'.format(value.quantize(_RATING_PLACES, context=_RATING_CONTEXT))
+
+
+class FastSerializer:
+    """
+    Renders rows as plain dicts, sharing per-response work between rows.
+
+    Args:
+        context: Serializer context as built by core/querysets.py: the
+            `request` (for absolute image URLs, `more_replies` links and
+            the `liked` flag) and `liked_comment_ids`
+    """
+
+    def __init__(self, context: Optional[Dict] = None):
+        context = context or {}
+        self.request = context.get('request')
+        self.liked_ids = context.get('liked_comment_ids')
+        user = getattr(self.request, 'user', None) if self.request is not None else None
+        self.user = user if user is not None and user.is_authenticated else None
+        self.timezone = timezone.get_current_timezone() if settings.USE_TZ else None
+        self.storage = Network._meta.get_field('image').storage
+        self._networks: Dict[int, Dict] = {}
+        self._devices: Dict[int, Dict] = {}
+
+    def datetime(self, value) -> Optional[str]:
+        """ISO 8601 in the current time zone, like DRF's DateTimeField"""
+        if not value:
+            return None
+        if self.timezone is not None:
+            value = value.astimezone(self.timezone) if timezone.is_aware(value) else timezone.make_aware(value, self.timezone)
+        elif timezone.is_aware(value):
+            value = timezone.make_naive(value, dt.timezone.utc)
+        value = value.isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+    def image_url(self, name) -> Optional[str]:
+        name = getattr(name, 'name', name)
+        if not name:
+            return None
+        url = self.storage.url(name)
+        return self.request.build_absolute_uri(url) if self.request is not None else url
+
+    def network(self, network) -> Optional[Dict]:
+        """A Network (or its `values()` row) as NetworkSerializer renders it"""
+        if network is None:
+            return None
+        row = network if isinstance(network, dict) else network.__dict__
+        cached = self._networks.get(row['id'])
+        if cached is None:
+            cached = self._networks[row['id']] = {
+                'id': row['id'],
+                'name': row['name'],
+                'image': self.image_url(row['image']),
+                'status': row['status'],
+                'slug': row['slug'],
+            }
+        return dict(cached)
+
+    def networks(self, networks: Iterable) -> List[Dict]:
+        return [self.network(network) for network in networks]
+
+    def device(self, device) -> Optional[Dict]:
+        """A NetworkDevice (or its `values()` row) as NetworkDeviceSerializer renders it"""
+        if device is None:
+            return None
+        row = device if isinstance(device, dict) else device.__dict__
+        cached = self._devices.get(row['id'])
+        if cached is None:
+            cached = self._devices[row['id']] = {'id': row['id'], 'name': row['name'], 'slug': row['slug']}
+        return dict(cached)
+
+    def devices(self, devices: Iterable) -> List[Dict]:
+        return [self.device(device) for device in devices]
+
+    def liked(self, comment) -> bool:
+        if self.liked_ids is not None:
+            return comment.id in self.liked_ids
+        if self.user is not None:
+            return comment.likes.filter(id=self.user.id).exists()
+        return False
+
+    def more_replies(self, comment) -> Optional[str]:
+        if not getattr(comment, 'has_more_replies', False):
+            return None
+        last_reply = comment.prefetched_replies[-1]
+        cursor = ReplyPagination.encode_position([getattr(last_reply, field) for field in ReplyPagination.ordering])
+        url = replace_query_param(
+            reverse('comment_replies', kwargs={'comment_id': comment.id}), ReplyPagination.cursor_query_param, cursor
+        )
+        return self.request.build_absolute_uri(url) if self.request is not None else url
+
+    def more_comments(self, rating) -> Optional[str]:
+        if not getattr(rating, 'has_more_comments', False):
+            return None
+        last_comment = rating.top_level_comments[-1]
+        cursor = CommentPagination.encode_position(
+            [getattr(last_comment, field.lstrip('-')) for field in CommentPagination.ordering]
+        )
+        url = replace_query_param(
+            reverse('rating_comments', kwargs={'pk': rating.id}), CommentPagination.cursor_query_param, cursor
+        )
+        return self.request.build_absolute_uri(url) if self.request is not None else url
+
+    def comment(self, comment) -> Dict:
+        """A Comment (with its user loaded) as CommentSerializer renders it"""
+        if comment.parent_id is None:
+            replies = getattr(comment, 'prefetched_replies', None)
+            if replies is None:
+                replies = comment.replies.all().order_by('created_at')
+            replies = [self.comment(reply) for reply in replies]
+        else:
+            replies = []
+        return {
+            'id': comment.id,
+            'user': comment.user_id,
+            'username': comment.user.username,
+            'content': comment.content,
+            'network_rating': comment.network_rating_id,
+            'created_at': self.datetime(comment.created_at),
+            'updated_at': self.datetime(comment.updated_at),
+            'parent': comment.parent_id,
+            'num_likes': comment.like_count,
+            'liked': self.liked(comment),
+            'replies': replies,
+            'more_replies': self.more_replies(comment),
+        }
+
+    def comments(self, comments: Iterable) -> List[Dict]:
+        return [self.comment(comment) for comment in comments]
+
+    def rating(self, rating, comments: bool = True) -> Dict:
+        """
+        A NetworkRating as NetworkRatingSerializer renders it (or as
+        NetworkRatingListSerializer does, without `comments` and
+        `more_comments`).
+        """
+        data = {
+            'id': rating.id,
+            'user': rating.user_id,
+            'network': self.network(rating.network) if rating.network_id is not None else None,
+            'device': self.device(rating.device) if rating.device_id is not None else None,
+            'rating': _rating(rating.rating),
+            'address': rating.address,
+            'created_at': self.datetime(rating.created_at),
+            'review': rating.review,
+            'location_pending': rating.location_pending,
+        }
+        if comments:
+            thread = getattr(rating, 'top_level_comments', None)
+            if thread is None:
+                thread = rating.comments.filter(parent=None).order_by('-created_at')
+            data['comments'] = self.comments(thread)
+            data['more_comments'] = self.more_comments(rating)
+        return data
+
+    def ratings(self, ratings: Iterable, comments: bool = True) -> List[Dict]:
+        return [self.rating(rating, comments) for rating in ratings]
+
+
+def network_rows(networks):
+    """`values()` rows of a Network queryset, with the fields NetworkSerializer renders"""
+    return networks.values(*NETWORK_FIELDS)
+
+
+def device_rows(devices):
+    """`values()` rows of a NetworkDevice queryset, with the fields NetworkDeviceSerializer renders"""
+    return devices.values(*DEVICE_FIELDS)
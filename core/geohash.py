@@ -0,0 +1,206 @@
+"""
+Geohash encoding and radius-cover helpers used to prefilter nearby ratings.
+
+A geohash interleaves longitude/latitude bisection bits into a base32 string,
+so every prefix names a rectangular cell and all points inside that cell share
+the prefix. Range lookups on an indexed geohash column therefore select a cell
+with a plain B-tree scan on any database backend.
+"""
+import math
+from typing import List, Optional, Tuple
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+MAX_PRECISION = 12
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+
+
+def encode(latitude: float, longitude: float, precision: int = MAX_PRECISION) -> str:
+    """
+    Encode a coordinate pair as a geohash string.
+
+    Args:
+        latitude: Latitude in degrees (-90 to 90)
+        longitude: Longitude in degrees (-180 to 180)
+        precision: Number of base32 characters to produce
+
+    Returns:
+        Geohash string of length `precision`
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+
+    while len(geohash) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if longitude >= mid:
+                bits = (bits << 1) | 1
+                lon_range[0] = mid
+            else:
+                bits <<= 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if latitude >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits <<= 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return ''.join(geohash)
+
+
+def cell_size(precision: int) -> Tuple[float, float]:
+    """
+    Size of a geohash cell at the given precision.
+
+    Returns:
+        Tuple of (latitude span, longitude span) in degrees
+    """
+    total_bits = precision * 5
+    lon_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lon_bits)
+
+
+def decode_cell(geohash: str) -> Tuple[float, float, float, float]:
+    """
+    Decode a geohash into the bounds of its cell.
+
+    Returns:
+        Tuple of (min_lat, max_lat, min_lon, max_lon)
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = BASE32.index(char)
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            target = lon_range if even else lat_range
+            mid = (target[0] + target[1]) / 2
+            if bit:
+                target[0] = mid
+            else:
+                target[1] = mid
+            even = not even
+    return lat_range[0], lat_range[1], lon_range[0], lon_range[1]
+
+
+def _clamp_latitude(latitude: float) -> float:
+    return max(-90.0, min(90.0, latitude))
+
+
+def _wrap_longitude(longitude: float) -> float:
+    return ((longitude + 180.0) % 360.0) - 180.0
+
+
+def neighbours(geohash: str) -> List[str]:
+    """
+    Return the cell itself plus its (up to) eight neighbours.
+
+    Neighbours wrap around the antimeridian and are clipped at the poles, so
+    fewer than nine distinct cells may be returned.
+    """
+    precision = len(geohash)
+    min_lat, max_lat, min_lon, max_lon = decode_cell(geohash)
+    lat_step = max_lat - min_lat
+    lon_step = max_lon - min_lon
+    centre_lat = (min_lat + max_lat) / 2
+    centre_lon = (min_lon + max_lon) / 2
+
+    cells = []
+    for d_lat in (-1, 0, 1):
+        lat = centre_lat + d_lat * lat_step
+        if lat < -90.0 or lat > 90.0:
+            continue
+        for d_lon in (-1, 0, 1):
+            lon = _wrap_longitude(centre_lon + d_lon * lon_step)
+            cell = encode(lat, lon, precision)
+            if cell not in cells:
+                cells.append(cell)
+    return cells
+
+
+def precision_for_radius(latitude: float, radius_km: float) -> Optional[int]:
+    """
+    Pick the finest precision whose cells are at least `radius_km` wide.
+
+    With cells at least as large as the search radius, the circle around any
+    point is fully contained in that point's cell plus its eight neighbours.
+
+    Returns:
+        Geohash precision, or None if even a single-character cell is too small
+    """
+    # Longitude cells shrink towards the poles; measure at the worst latitude
+    # the circle can reach.
+    worst_lat = min(abs(latitude) + radius_km / KM_PER_DEGREE_LAT, 89.9)
+    lon_km_per_degree = KM_PER_DEGREE_LAT * math.cos(math.radians(worst_lat))
+
+    for precision in range(MAX_PRECISION, 0, -1):
+        lat_span, lon_span = cell_size(precision)
+        if lat_span * KM_PER_DEGREE_LAT >= radius_km and lon_span * lon_km_per_degree >= radius_km:
+            return precision
+    return None
+
+
+def covering_cells(latitude: float, longitude: float, radius_km: float) -> Optional[List[str]]:
+    """
+    Geohash prefixes whose union covers the circle of `radius_km` around a point.
+
+    Returns:
+        List of geohash prefixes, or None if the radius is too large for a
+        geohash prefilter to be selective
+    """
+    precision = precision_for_radius(latitude, radius_km)
+    if precision is None:
+        return None
+    return neighbours(encode(latitude, longitude, precision))
+
+
+def prefix_upper_bound(prefix: str) -> str:
+    """
+    Smallest string greater than every geohash starting with `prefix`.
+
+    Lets a prefix match be written as `prefix <= geohash < upper_bound`, which
+    any B-tree index can serve regardless of collation or LIKE support.
+    """
+    # '~' sorts after every base32 character in both ASCII and UTF-8.
+    return prefix + '~'
+
+
+def bounding_box(latitude: float, longitude: float, radius_km: float) -> Tuple[float, float, Optional[Tuple[float, float]]]:
+    """
+    Latitude/longitude bounding box of the circle of `radius_km` around a point.
+
+    Returns:
+        Tuple of (min_lat, max_lat, lon_range) where lon_range is None when the
+        box touches a pole or crosses the antimeridian and longitude can't be
+        bounded by a single range
+    """
+    lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat = _clamp_latitude(latitude - lat_delta)
+    max_lat = _clamp_latitude(latitude + lat_delta)
+
+    if min_lat <= -90.0 or max_lat >= 90.0:
+        return min_lat, max_lat, None
+
+    # Widest longitude spread of the circle, reached at its extreme latitude.
+    extreme_lat = max(abs(min_lat), abs(max_lat))
+    lon_delta = math.degrees(radius_km / (EARTH_RADIUS_KM * math.cos(math.radians(extreme_lat))))
+    min_lon = longitude - lon_delta
+    max_lon = longitude + lon_delta
+    if min_lon < -180.0 or max_lon > 180.0:
+        return min_lat, max_lat, None
+    return min_lat, max_lat, (min_lon, max_lon)
@@ -0,0 +1,255 @@
+"""
+Caching and transport for IP geolocation lookups.
+
+Lookups go through two tiers keyed by IP address: a small in-process LRU that
+answers repeat visitors without any I/O, and the shared Django cache so that
+every worker benefits from a lookup made by any other. Failed lookups are
+cached too (for a shorter time) so an unknown or unreachable IP doesn't hit
+the geolocation provider on every request.
+
+Calls that do reach the provider share one pooled keep-alive session with
+connect/read timeouts and bounded retries, behind a circuit breaker that
+stops calling the provider for a while after repeated failures.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+import requests
+from django.conf import settings
+from django.core.cache import caches
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+MISSING = object()
+
+
+class GeolocationUnavailable(Exception):
+    """Raised when the provider is not called at all, e.g. while the circuit is open"""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    After `failure_threshold` consecutive failures the circuit opens and
+    `allow_request()` returns False for `reset_timeout` seconds. After that a
+    single trial call is let through (half-open); its outcome closes the
+    circuit again or re-opens it for another `reset_timeout`.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.reset()
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+    """
+    Process-wide pooled session used for geolocation calls.
+
+    Connections are kept alive between requests; connection errors and 5xx
+    responses are retried a bounded number of times with exponential backoff.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                retry = Retry(
+                    total=settings.IPSTACK_MAX_RETRIES,
+                    backoff_factor=settings.IPSTACK_RETRY_BACKOFF,
+                    status_forcelist=(500, 502, 503, 504),
+                    allowed_methods=('GET',),
+                    raise_on_status=False,
+                )
+                adapter = HTTPAdapter(
+                    pool_connections=4,
+                    pool_maxsize=settings.IPSTACK_POOL_SIZE,
+                    max_retries=retry,
+                )
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _session = session
+    return _session
+
+
+def get_request_timeout():
+    return settings.IPSTACK_CONNECT_TIMEOUT, settings.IPSTACK_READ_TIMEOUT
+
+
+ipstack_breaker = CircuitBreaker(
+    failure_threshold=settings.IPSTACK_BREAKER_THRESHOLD,
+    reset_timeout=settings.IPSTACK_BREAKER_RESET_TIMEOUT,
+)
+
+
+class LocationCache:
+    """
+    Two-tier TTL cache mapping IP addresses to geolocation payloads.
+
+    A cached value of None records a failed lookup (negative caching).
+    """
+    key_prefix = 'ip-location:'
+
+    def __init__(self, ttl: int, negative_ttl: int, max_entries: int, cache_alias: str = 'default'):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.cache_alias = cache_alias
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {'local_hits': 0, 'shared_hits': 0, 'negative_hits': 0, 'misses': 0}
+
+    @property
+    def shared(self):
+        return caches[self.cache_alias]
+
+    def _count(self, counter: str):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def _ttl_for(self, value) -> int:
+        return self.negative_ttl if value is None else self.ttl
+
+    def _get_local(self, ip: str):
+        with self._lock:
+            entry = self._local.get(ip)
+            if entry is None:
+                return MISSING
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._local[ip]
+                return MISSING
+            self._local.move_to_end(ip)
+            return value
+
+    def _set_local(self, ip: str, value, ttl: int):
+        with self._lock:
+            self._local[ip] = (time.monotonic() + ttl, value)
+            self._local.move_to_end(ip)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
+
+    def get(self, ip: str):
+        """
+        Look up a cached location.
+
+        Returns:
+            The cached payload, None for a cached failure, or MISSING
+        """
+        value = self._get_local(ip)
+        if value is not MISSING:
+            self._count('local_hits' if value is not None else 'negative_hits')
+            return value
+
+        entry = self.shared.get(self.key_prefix + ip)
+        if entry is not None:
+            value = entry['location']
+            # Only the remaining lifetime is unknown here; the local copy is
+            # kept briefly so it never outlives the shared entry by much.
+            self._set_local(ip, value, min(self._ttl_for(value), self.negative_ttl))
+            self._count('shared_hits' if value is not None else 'negative_hits')
+            return value
+
+        self._count('misses')
+        return MISSING
+
+    def set(self, ip: str, value):
+        ttl = self._ttl_for(value)
+        self._set_local(ip, value, ttl)
+        self.shared.set(self.key_prefix + ip, {'location': value}, ttl)
+
+    def get_or_fetch(self, ip: str, fetch: Callable[[str], Optional[Dict]]) -> Optional[Dict]:
+        value = self.get(ip)
+        if value is MISSING:
+            try:
+                value = fetch(ip)
+            except GeolocationUnavailable:
+                # Nothing was learned about this IP; don't cache the outcome.
+                return None
+            self.set(ip, value)
+        return value
+
+    def refresh(self, ip: str, fetch: Callable[[str], Optional[Dict]]) -> Optional[Dict]:
+        """
+        Fetch a location regardless of what is cached, replacing the cached
+        outcome (including a negative entry) with the new one.
+        """
+        try:
+            value = fetch(ip)
+        except GeolocationUnavailable:
+            return None
+        self.set(ip, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+            for counter in self._counters:
+                self._counters[counter] = 0
+
+    def stats(self) -> Dict:
+        """
+        Hit/miss counters for this process.
+
+        Every hit (including negative hits) is a provider call saved.
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            counters['local_entries'] = len(self._local)
+        hits = counters['local_hits'] + counters['shared_hits'] + counters['negative_hits']
+        lookups = hits + counters['misses']
+        counters['lookups'] = lookups
+        counters['hit_ratio'] = round(hits / lookups, 4) if lookups else 0.0
+        return counters
+
+
+location_cache = LocationCache(
+    ttl=settings.IP_LOCATION_CACHE_TTL,
+    negative_ttl=settings.IP_LOCATION_NEGATIVE_CACHE_TTL,
+    max_entries=settings.IP_LOCATION_LOCAL_CACHE_SIZE,
+)
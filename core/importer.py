@@ -0,0 +1,323 @@
+"""
+Bulk import of historical ratings and their comments.
+
+Records are streamed from a JSONL or CSV file, shaped like the rows of the
+rating export (see core/export.py): networks, devices and users may be given
+by ID (`network_id`, `device_id`, `user_id`) or by name (`network`,
+`device`, `username`). JSONL records may also carry their `comments`, each
+with its own `replies`.
+
+Records are handled in chunks. A chunk is validated column by column
+against the model's field rules, with the networks and devices resolved
+from maps loaded once and the users and existing (user, network) pairs
+looked up with one query each. Valid ratings are then inserted with
+`bulk_create`, along with their comments and rollups, in one transaction
+per chunk. Imported ratings and comments keep their `created_at` when it
+is given.
+
+Unlike API writes, ratings of networks that have since been deactivated are
+accepted: they are history.
+"""
+import csv
+import json
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterator, List, Tuple
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.settings import api_settings
+
+from core import rollups
+from core.ingest import bulk_create_with_timestamps, insert_rating_batch
+from core.models import Comment, Network, NetworkDevice, NetworkRating
+from core.serializers import DUPLICATE_RATING_MESSAGE
+
+User = get_user_model()
+
+FORMATS = ('jsonl', 'csv')
+
+COMMENT_TIMESTAMPS = ('created_at', 'updated_at')
+
+# Columns validated with the model field of the same name
+RATING_FIELDS = ('rating', 'review', 'address', 'latitude', 'longitude')
+
+
+def detect_format(path: str) -> str:
+    """'csv' for a .csv file, 'jsonl' otherwise"""
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def read_records(path: str, fmt: str, skip: int = 0) -> Iterator[Tuple[int, Dict]]:
+    """
+    Records of a file, one at a time, with their 1-based record number.
+
+    Args:
+        path: JSONL or CSV file (CSV needs a header line)
+        fmt: 'jsonl' or 'csv'
+        skip: Number of records to skip, e.g. those already imported
+
+    A JSONL line that doesn't hold a JSON object is yielded as `None`, so
+    that it is reported rather than silently dropped. Blank lines are
+    ignored.
+    """
+    with open(path, newline='' if fmt == 'csv' else None, encoding='utf-8') as source:
+        if fmt == 'csv':
+            records = ({name: value for name, value in row.items() if value != ''} for row in csv.DictReader(source))
+        else:
+            records = (_json_record(line) for line in source if line.strip())
+        for number, record in enumerate(records, start=1):
+            if number > skip:
+                yield number, record
+
+
+def _json_record(line: str):
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    return record if isinstance(record, dict) else None
+
+
+def _key(name) -> str:
+    return str(name).strip().lower()
+
+
+def _as_id(value):
+    """An integer ID, or None if `value` isn't one"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_time(value):
+    if value in (None, ''):
+        return None
+    parsed = value if isinstance(value, datetime) else parse_datetime(str(value))
+    if parsed is None:
+        raise ValidationError(f"Invalid datetime: {value}")
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+
+class RatingImporter:
+    """
+    Validates and inserts chunks of records, keeping the name -> ID maps
+    between chunks.
+    """
+
+    def __init__(self):
+        self.networks: Dict[str, int] = {}
+        for network_id, name, slug in Network.objects.values_list('id', 'name', 'slug'):
+            self.networks.setdefault(_key(name), network_id)
+            self.networks.setdefault(_key(slug), network_id)
+        self.network_ids = set(self.networks.values())
+        self.devices: Dict[str, int] = {}
+        for device_id, name, slug in NetworkDevice.objects.values_list('id', 'name', 'slug'):
+            self.devices.setdefault(_key(name), device_id)
+            self.devices.setdefault(_key(slug), device_id)
+        self.device_ids = set(self.devices.values())
+        self.users: Dict[str, int] = {}
+        self.user_ids = set()
+        self.fields = {name: NetworkRating._meta.get_field(name) for name in RATING_FIELDS}
+
+    def _load_users(self, records: List[Dict]):
+        """Resolve the usernames and user IDs of a chunk with one query each"""
+        names, ids = set(), set()
+        for record in records:
+            for item in [record, *_comments(record)]:
+                if item.get('user_id') is not None:
+                    user_id = _as_id(item['user_id'])
+                    if user_id is not None and user_id not in self.user_ids:
+                        ids.add(user_id)
+                elif item.get('username') and str(item['username']) not in self.users:
+                    names.add(str(item['username']))
+        if names:
+            self.users.update(User.objects.filter(username__in=names).values_list('username', 'id'))
+        if ids:
+            self.user_ids.update(User.objects.filter(id__in=ids).values_list('id', flat=True))
+
+    def _resolve(self, record: Dict, kind: str, required: bool, errors: Dict):
+        """ID of the network, device or user a record refers to, by ID or by name"""
+        if kind == 'user':
+            id_field, name_field, by_name, known = 'user_id', 'username', self.users, self.user_ids
+        elif kind == 'network':
+            id_field, name_field, by_name, known = 'network_id', 'network', self.networks, self.network_ids
+        else:
+            id_field, name_field, by_name, known = 'device_id', 'device', self.devices, self.device_ids
+
+        if record.get(id_field) is not None:
+            resolved = _as_id(record[id_field])
+            if resolved is None or resolved not in known:
+                errors[id_field] = [f'Invalid pk "{record[id_field]}" - object does not exist.']
+            return resolved
+        if record.get(name_field) not in (None, ''):
+            name = record[name_field]
+            resolved = by_name.get(str(name) if kind == 'user' else _key(name))
+            if resolved is None:
+                errors[name_field] = [f'No {kind} named "{name}".']
+            return resolved
+        if required:
+            errors[id_field] = ['This field is required.']
+        return None
+
+    def validate(self, records: List[Tuple[int, Dict]]) -> Tuple[List[Tuple[int, NetworkRating, List]], Dict[int, Dict]]:
+        """
+        Check a chunk of records.
+
+        Returns:
+            (record number, unsaved rating, comment records) for every valid
+            record, and validation errors by record number
+        """
+        errors: Dict[int, Dict] = {}
+        chunk = []
+        for number, record in records:
+            if record is None:
+                errors[number] = {api_settings.NON_FIELD_ERRORS_KEY: ['Not a JSON object.']}
+            else:
+                chunk.append((number, record))
+        self._load_users([record for _, record in chunk])
+
+        # References, then each model field over the whole chunk
+        values = {number: {} for number, _ in chunk}
+        for number, record in chunk:
+            found = {}
+            values[number]['user_id'] = self._resolve(record, 'user', True, found)
+            values[number]['network_id'] = self._resolve(record, 'network', True, found)
+            values[number]['device_id'] = self._resolve(record, 'device', False, found)
+            if found:
+                errors[number] = found
+        for name, field in self.fields.items():
+            for number, record in chunk:
+                value = record.get(name)
+                if isinstance(value, str) and name != 'review':
+                    value = value.strip() or None
+                try:
+                    values[number][name] = field.clean(value, None)
+                except ValidationError as e:
+                    errors.setdefault(number, {})[name] = e.messages
+        for number, record in chunk:
+            data = values[number]
+            try:
+                data['created_at'] = _parse_time(record.get('created_at')) or timezone.now()
+            except ValidationError as e:
+                errors.setdefault(number, {})['created_at'] = e.messages
+            if number in errors:
+                continue
+            if (data['latitude'] is None) != (data['longitude'] is None):
+                errors[number] = {api_settings.NON_FIELD_ERRORS_KEY: ['Both latitude and longitude must be provided together']}
+            elif len(data['review'].strip()) < 10:
+                errors[number] = {'review': ['Review must be at least 10 characters long']}
+
+        valid = [(number, record) for number, record in chunk if number not in errors]
+        taken = set(
+            NetworkRating.objects
+            .filter(user_id__in={values[number]['user_id'] for number, _ in valid},
+                    network_id__in={values[number]['network_id'] for number, _ in valid})
+            .values_list('user_id', 'network_id')
+        ) if valid else set()
+
+        accepted = []
+        for number, record in valid:
+            data = values[number]
+            pair = (data['user_id'], data['network_id'])
+            if pair in taken:
+                errors[number] = {api_settings.NON_FIELD_ERRORS_KEY: [DUPLICATE_RATING_MESSAGE]}
+                continue
+            comments, comment_errors = self._validate_comments(_comments(record, nested=False), data['created_at'])
+            if comment_errors:
+                errors[number] = {'comments': comment_errors}
+                continue
+            taken.add(pair)
+            rating = NetworkRating(**data)
+            rating.geohash = rating.compute_geohash()
+            accepted.append((number, rating, comments))
+        return accepted, errors
+
+    def _validate_comments(self, items, default_time) -> Tuple[List, List]:
+        """Comments of one record as (comment, replies) pairs, or their errors"""
+        comments, errors = [], []
+        for item in items:
+            found = {}
+            if not isinstance(item, dict):
+                errors.append({api_settings.NON_FIELD_ERRORS_KEY: ['Not a JSON object.']})
+                continue
+            user_id = self._resolve(item, 'user', True, found)
+            content = item.get('content')
+            if not isinstance(content, str) or not content.strip():
+                found['content'] = ['This field may not be blank.']
+            try:
+                created_at = _parse_time(item.get('created_at')) or default_time
+            except ValidationError as e:
+                found['created_at'] = e.messages
+            replies, reply_errors = ([], [])
+            if isinstance(item.get('replies'), list):
+                replies, reply_errors = self._validate_comments(item['replies'], default_time)
+            if reply_errors:
+                found['replies'] = reply_errors
+            if found:
+                errors.append(found)
+                continue
+            comment = Comment(user_id=user_id, content=content, created_at=created_at, updated_at=created_at)
+            comments.append((comment, [reply for reply, _ in replies]))
+        return comments, errors
+
+    def insert(self, accepted: List[Tuple[int, NetworkRating, List]]) -> Tuple[int, int, Dict[int, Dict]]:
+        """
+        Insert a validated chunk and its comments in one transaction.
+
+        Ratings stored concurrently since the chunk was validated are
+        rejected as duplicates, along with their comments; the rest of the
+        chunk is still inserted.
+
+        Returns:
+            Number of ratings and of comments created, and errors by record
+            number
+        """
+        if not accepted:
+            return 0, 0, {}
+        with transaction.atomic():
+            created, errors = insert_rating_batch(
+                {number: rating for number, rating, _ in accepted}, len(accepted), keep_created_at=True,
+            )
+
+            top_level, replies = [], []
+            for number, rating, comments in accepted:
+                if number not in created:
+                    continue
+                for comment, comment_replies in comments:
+                    comment.network_rating_id = rating.pk
+                    top_level.append((comment, comment_replies))
+            bulk_create_with_timestamps(Comment, [comment for comment, _ in top_level], COMMENT_TIMESTAMPS)
+            for comment, comment_replies in top_level:
+                for reply in comment_replies:
+                    reply.network_rating_id = comment.network_rating_id
+                    reply.parent_id = comment.pk
+                    replies.append(reply)
+            bulk_create_with_timestamps(Comment, replies, COMMENT_TIMESTAMPS)
+
+            network_of = {rating.pk: rating.network_id for rating in created.values()}
+            per_network = defaultdict(int)
+            for comment in [comment for comment, _ in top_level] + replies:
+                per_network[network_of[comment.network_rating_id]] += 1
+            for network_id, count in per_network.items():
+                rollups.apply_network_delta(network_id, comments=count)
+        return len(created), len(top_level) + len(replies), errors
+
+
+def _comments(record: Dict, nested: bool = True) -> List:
+    """Comments of a record; with `nested`, their replies too"""
+    comments = record.get('comments')
+    if not isinstance(comments, list):
+        return []
+    if not nested:
+        return comments
+    found = []
+    for comment in comments:
+        if isinstance(comment, dict):
+            found.append(comment)
+            found.extend(_comments({'comments': comment.get('replies')}))
+    return found
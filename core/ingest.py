@@ -0,0 +1,207 @@
+"""
+Bulk rating ingestion.
+
+Creating ratings one at a time costs a query per foreign key to validate
+it, a duplicate check, the rollup updates and, through the API, an IP
+geolocation lookup. Batches are instead validated with one query per kind
+of reference plus one for existing (user, network) pairs, inserted with
+`bulk_create` and counted into the rollups once per chunk.
+
+Ratings created here are not geolocated from the uploader's IP address,
+which says nothing about where the ratings were collected; uploads carry
+their own coordinates and addresses.
+"""
+from typing import Dict, List, Optional, Tuple
+
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.settings import api_settings
+
+from core import rollups
+from core.models import Network, NetworkDevice, NetworkRating
+from core.response_cache import response_cache
+from core.serializers import DUPLICATE_RATING_MESSAGE, NetworkRatingBatchItemSerializer
+
+User = get_user_model()
+
+OTHER_USER_MESSAGE = "Only staff can upload ratings for other users."
+
+
+def _does_not_exist(pk) -> List[str]:
+    return [PrimaryKeyRelatedField.default_error_messages['does_not_exist'].format(pk_value=pk)]
+
+
+def _duplicate() -> Dict:
+    return {api_settings.NON_FIELD_ERRORS_KEY: [DUPLICATE_RATING_MESSAGE]}
+
+
+def validate_rating_batch(items: List, user: User, allow_other_users: bool = False,
+                          active_network_ids: Optional[set] = None,
+                          device_ids: Optional[set] = None) -> Tuple[Dict[int, NetworkRating], Dict[int, Dict]]:
+    """
+    Validate a batch of ratings with a fixed number of queries.
+
+    Each item is checked like a rating posted on its own: field values,
+    an existing active network, an existing device, and at most one rating
+    per user and network (counting both stored ratings and earlier items of
+    the batch).
+
+    Args:
+        items: Rating payloads (see NetworkRatingBatchItemSerializer)
+        user: Author of items without a `user_id`
+        allow_other_users: Accept `user_id` for other users
+        active_network_ids: IDs of the active networks, if already known
+            (saves a query per batch)
+        device_ids: IDs of every device, if already known
+
+    Returns:
+        Unsaved ratings by item index, and validation errors by item index
+    """
+    errors = {}
+    valid = {}
+    for index, item in enumerate(items):
+        serializer = NetworkRatingBatchItemSerializer(data=item)
+        if not serializer.is_valid():
+            errors[index] = serializer.errors
+            continue
+        data = serializer.validated_data
+        if data.get('user_id', user.pk) != user.pk and not allow_other_users:
+            errors[index] = {'user_id': [OTHER_USER_MESSAGE]}
+            continue
+        data.setdefault('user_id', user.pk)
+        valid[index] = data
+
+    network_ids = {data['network_id'] for data in valid.values()}
+    if active_network_ids is None:
+        active_network_ids = set(Network.objects.filter(id__in=network_ids, status=True).values_list('id', flat=True))
+    wanted_devices = {data['device_id'] for data in valid.values() if data.get('device_id') is not None}
+    if device_ids is None:
+        device_ids = set(NetworkDevice.objects.filter(id__in=wanted_devices).values_list('id', flat=True))
+    user_ids = {data['user_id'] for data in valid.values()}
+    other_users = user_ids - {user.pk}
+    known_users = {user.pk}
+    if other_users:
+        known_users |= set(User.objects.filter(id__in=other_users).values_list('id', flat=True))
+    taken = set(
+        NetworkRating.objects
+        .filter(user_id__in=user_ids, network_id__in=network_ids)
+        .values_list('user_id', 'network_id')
+    ) if valid else set()
+
+    ratings = {}
+    for index, data in valid.items():
+        if data['network_id'] not in active_network_ids:
+            errors[index] = {'network_id': _does_not_exist(data['network_id'])}
+        elif data.get('device_id') is not None and data['device_id'] not in device_ids:
+            errors[index] = {'device_id': _does_not_exist(data['device_id'])}
+        elif data['user_id'] not in known_users:
+            errors[index] = {'user_id': _does_not_exist(data['user_id'])}
+        elif (data['user_id'], data['network_id']) in taken:
+            errors[index] = _duplicate()
+        else:
+            taken.add((data['user_id'], data['network_id']))
+            rating = NetworkRating(**data)
+            rating.geohash = rating.compute_geohash()
+            ratings[index] = rating
+    return ratings, errors
+
+
+def bulk_create_with_timestamps(model, objects: List, fields: Tuple[str, ...]) -> List:
+    """
+    `bulk_create` that keeps the values of the `auto_now`/`auto_now_add`
+    `fields` set on the objects (e.g. imported history).
+
+    Inserting overwrites those fields with the current time, so the values
+    are put back on the objects, whether or not the insert succeeds, and
+    written with a bulk UPDATE. Call inside a transaction.
+    """
+    intended = [[getattr(obj, name) for name in fields] for obj in objects]
+    try:
+        created = model.objects.bulk_create(objects)
+    finally:
+        for obj, values in zip(objects, intended):
+            for name, value in zip(fields, values):
+                setattr(obj, name, value)
+    model.objects.bulk_update(created, fields, batch_size=500)
+    return created
+
+
+def insert_ratings(ratings: List[NetworkRating], keep_created_at: bool = False) -> List[NetworkRating]:
+    """
+    Insert already validated ratings in one transaction, with their rollups.
+
+    Args:
+        ratings: Unsaved ratings
+        keep_created_at: Store the `created_at` set on the ratings rather
+            than the current time
+
+    Raises:
+        IntegrityError: If any rating conflicts with a stored one; nothing
+            is inserted then
+    """
+    with transaction.atomic():
+        if keep_created_at:
+            created = bulk_create_with_timestamps(NetworkRating, ratings, ('created_at',))
+        else:
+            created = NetworkRating.objects.bulk_create(ratings)
+        rollups.record_ratings(created)
+        response_cache.bump_on_commit('ratings')
+    return created
+
+
+def insert_rating_batch(ratings: Dict[int, NetworkRating], chunk_size: int,
+                        keep_created_at: bool = False) -> Tuple[Dict[int, NetworkRating], Dict[int, Dict]]:
+    """
+    Insert validated ratings in chunks of `chunk_size`, one transaction each.
+
+    A chunk that hits a conflict (a rating stored concurrently since the
+    batch was validated) is retried one rating at a time, so only the
+    conflicting ratings fail.
+
+    Args:
+        ratings: Unsaved ratings by item index
+        chunk_size: Ratings inserted per transaction
+        keep_created_at: As for `insert_ratings`
+
+    Returns:
+        Created ratings by item index, and errors by item index
+    """
+    created = {}
+    errors = {}
+    indexed = sorted(ratings.items())
+    for start in range(0, len(indexed), chunk_size):
+        chunk = indexed[start:start + chunk_size]
+        try:
+            insert_ratings([rating for _, rating in chunk], keep_created_at)
+            created.update(chunk)
+        except IntegrityError:
+            for index, rating in chunk:
+                rating.pk = None
+                try:
+                    insert_ratings([rating], keep_created_at)
+                    created[index] = rating
+                except IntegrityError:
+                    errors[index] = _duplicate()
+    return created, errors
+
+
+def ingest_rating_batch(items: List, user: User, chunk_size: int, allow_other_users: bool = False) -> List[Dict]:
+    """
+    Validate and insert a batch of ratings.
+
+    Returns:
+        One result per item, in order: `{"index", "status": "created", "id"}`
+        or `{"index", "status": "error", "errors"}`
+    """
+    ratings, errors = validate_rating_batch(items, user, allow_other_users)
+    created, insert_errors = insert_rating_batch(ratings, chunk_size)
+    errors.update(insert_errors)
+
+    results = []
+    for index in range(len(items)):
+        if index in created:
+            results.append({'index': index, 'status': 'created', 'id': created[index].pk})
+        else:
+            results.append({'index': index, 'status': 'error', 'errors': errors[index]})
+    return results
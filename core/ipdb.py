@@ -0,0 +1,261 @@
+"""
+Offline IP-to-location database.
+
+An IP-range dataset (CSV) is compiled into a compact binary file which is
+memory-mapped and searched with a binary search, so lookups cost a few
+microseconds and no network I/O. Only IPv4 ranges are supported; IPv6
+addresses (other than IPv4-mapped ones) are reported as unknown.
+
+File layout (native byte order, recorded in the header):
+
+    header   magic, byte order, record count, section offsets
+    starts   uint32[count]        first address of every range, ascending
+    records  (uint32 end, float32 lat, float32 lon, uint32 city, uint32 country)[count]
+    strings  length-prefixed UTF-8 strings referenced by offset from records
+"""
+import bisect
+import csv
+import ipaddress
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from django.conf import settings
+
+MAGIC = b'RADEURIP'
+VERSION = 1
+HEADER = struct.Struct('=8sHBxIIII')
+RECORD = struct.Struct('=IffII')
+STRING_LENGTH = struct.Struct('=H')
+
+START_COLUMNS = ('start_ip', 'ip_from', 'range_start', 'start')
+END_COLUMNS = ('end_ip', 'ip_to', 'range_end', 'end')
+NETWORK_COLUMNS = ('network', 'cidr')
+CITY_COLUMNS = ('city', 'city_name')
+COUNTRY_COLUMNS = ('country_name', 'country')
+LATITUDE_COLUMNS = ('latitude', 'lat')
+LONGITUDE_COLUMNS = ('longitude', 'lon', 'lng')
+
+logger = logging.getLogger(__name__)
+
+
+class IPDatabaseError(Exception):
+    pass
+
+
+def _parse_ipv4(value: str) -> int:
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    return int(ipaddress.IPv4Address(value))
+
+
+def _column(row: Dict[str, str], names: Tuple[str, ...]) -> Optional[str]:
+    for name in names:
+        if row.get(name) not in (None, ''):
+            return row[name]
+    return None
+
+
+def read_csv_ranges(path) -> Iterator[Tuple[int, int, str, str, float, float]]:
+    """
+    Read IP ranges from a CSV file with a header row.
+
+    Ranges are given either as `start_ip`/`end_ip` columns (dotted quads or
+    integers) or as a CIDR `network` column; location columns are `city`,
+    `country_name`, `latitude` and `longitude` (common aliases accepted).
+    Rows that are IPv6 or lack coordinates are skipped.
+
+    Yields:
+        Tuples of (start, end, city, country, latitude, longitude)
+    """
+    with open(path, newline='', encoding='utf-8') as handle:
+        reader = csv.DictReader(handle)
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames or []]
+        for row in reader:
+            try:
+                network = _column(row, NETWORK_COLUMNS)
+                if network:
+                    net = ipaddress.ip_network(network.strip(), strict=False)
+                    if net.version != 4:
+                        continue
+                    start, end = int(net.network_address), int(net.broadcast_address)
+                else:
+                    start = _parse_ipv4(_column(row, START_COLUMNS) or '')
+                    end = _parse_ipv4(_column(row, END_COLUMNS) or '')
+                latitude = float(_column(row, LATITUDE_COLUMNS))
+                longitude = float(_column(row, LONGITUDE_COLUMNS))
+            except (TypeError, ValueError):
+                continue
+            if start > end:
+                continue
+            yield (
+                start, end,
+                (_column(row, CITY_COLUMNS) or '').strip(),
+                (_column(row, COUNTRY_COLUMNS) or '').strip(),
+                latitude, longitude,
+            )
+
+
+def build_database(ranges: Iterable[Tuple[int, int, str, str, float, float]], output_path) -> int:
+    """
+    Compile IP ranges into the binary lookup format.
+
+    Overlapping ranges are resolved in favour of the one starting first.
+
+    Returns:
+        Number of ranges written
+    """
+    ranges = sorted(ranges, key=lambda item: (item[0], item[1]))
+
+    starts = []
+    records = []
+    strings = bytearray()
+    string_offsets = {}
+
+    def intern(value: str) -> int:
+        if value not in string_offsets:
+            encoded = value.encode('utf-8')[:0xFFFF]
+            string_offsets[value] = len(strings)
+            strings.extend(STRING_LENGTH.pack(len(encoded)))
+            strings.extend(encoded)
+        return string_offsets[value]
+
+    last_end = -1
+    for start, end, city, country, latitude, longitude in ranges:
+        if start <= last_end:
+            if end <= last_end:
+                continue
+            start = last_end + 1
+        starts.append(start)
+        records.append(RECORD.pack(end, latitude, longitude, intern(city), intern(country)))
+        last_end = end
+
+    count = len(starts)
+    starts_offset = HEADER.size
+    records_offset = starts_offset + 4 * count
+    strings_offset = records_offset + RECORD.size * count
+    byte_order = 1 if sys.byteorder == 'little' else 0
+
+    tmp_path = f'{output_path}.tmp'
+    with open(tmp_path, 'wb') as handle:
+        handle.write(HEADER.pack(MAGIC, VERSION, byte_order, count, starts_offset, records_offset, strings_offset))
+        handle.write(struct.pack(f'={count}I', *starts))
+        for record in records:
+            handle.write(record)
+        handle.write(strings)
+    os.replace(tmp_path, output_path)
+    return count
+
+
+class IPDatabase:
+    """
+    Memory-mapped reader for a compiled IP-range database.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        with open(self.path, 'rb') as handle:
+            try:
+                self._mmap = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # mmap refuses empty files
+                raise IPDatabaseError(f'{self.path} is empty')
+
+        if len(self._mmap) < HEADER.size:
+            raise IPDatabaseError(f'{self.path} is not an IP database')
+        magic, version, byte_order, count, starts_offset, records_offset, strings_offset = \
+            HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise IPDatabaseError(f'{self.path} is not an IP database (or has an unsupported version)')
+        if byte_order != (1 if sys.byteorder == 'little' else 0):
+            raise IPDatabaseError(f'{self.path} was built on a machine with a different byte order')
+
+        self.count = count
+        self._records_offset = records_offset
+        self._strings_offset = strings_offset
+        self._starts = memoryview(self._mmap)[starts_offset:records_offset].cast('I')
+
+    def __len__(self):
+        return self.count
+
+    def _string(self, offset: int) -> str:
+        position = self._strings_offset + offset
+        (length,) = STRING_LENGTH.unpack_from(self._mmap, position)
+        start = position + STRING_LENGTH.size
+        return self._mmap[start:start + length].decode('utf-8')
+
+    def lookup(self, ip: str) -> Optional[Dict]:
+        """
+        Location for an IP address, shaped like an ipstack response.
+
+        Returns:
+            Dictionary with city, country_name, latitude and longitude, or
+            None if the address is not covered
+        """
+        try:
+            address = ipaddress.ip_address(ip.strip())
+        except (AttributeError, ValueError):
+            return None
+        if address.version == 6:
+            if address.ipv4_mapped is None:
+                return None
+            address = address.ipv4_mapped
+        value = int(address)
+
+        index = bisect.bisect_right(self._starts, value) - 1
+        if index < 0:
+            return None
+        end, latitude, longitude, city, country = RECORD.unpack_from(
+            self._mmap, self._records_offset + index * RECORD.size
+        )
+        if value > end:
+            return None
+        return {
+            'ip': str(address),
+            'city': self._string(city),
+            'country_name': self._string(country),
+            'latitude': round(latitude, 4),
+            'longitude': round(longitude, 4),
+        }
+
+    def close(self):
+        self._starts.release()
+        self._mmap.close()
+
+
+_database = None
+# Path of a database found missing or unusable, so it isn't retried (and
+# reported) on every lookup; workers pick up a newly built file on restart
+_unavailable_path = None
+_database_lock = threading.Lock()
+
+
+def get_local_database() -> Optional[IPDatabase]:
+    """
+    The configured database, opened on first use.
+
+    Returns:
+        IPDatabase, or None if IP_GEOLOCATION_DB_PATH is missing, empty or
+        not an IP database
+    """
+    global _database, _unavailable_path
+    if _database is None:
+        path = settings.IP_GEOLOCATION_DB_PATH
+        if _unavailable_path == path:
+            return None
+        with _database_lock:
+            if _database is None and _unavailable_path != path:
+                try:
+                    _database = IPDatabase(path)
+                except FileNotFoundError:
+                    logger.warning("IP geolocation database not found at %s", path)
+                    _unavailable_path = path
+                except (OSError, IPDatabaseError) as e:
+                    logger.error("IP geolocation database at %s can't be used: %s", path, e)
+                    _unavailable_path = path
+    return _database
@@ -0,0 +1,51 @@
+import random
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from geopy.distance import geodesic
+
+from core.distance import within_radius
+
+
+class Command(BaseCommand):
+    help = "Benchmark the vectorized radius filter against the per-row geodesic loop."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[10_000, 100_000, 1_000_000],
+                            help="Number of points to filter in each run")
+        parser.add_argument('--radius', type=float, default=5.0, help="Search radius in kilometers")
+        parser.add_argument('--spread', type=float, default=0.5,
+                            help="Points are scattered this many degrees around the origin")
+        parser.add_argument('--max-loop', type=int, default=100_000,
+                            help="Time the geodesic loop on at most this many points and extrapolate beyond it")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        origin_lat, origin_lon = 6.5244, 3.3792
+        radius = options['radius']
+        spread = options['spread']
+        rng = random.Random(options['seed'])
+
+        self.stdout.write(f"{'points':>10} {'loop (s)':>12} {'vectorized (s)':>15} {'speedup':>9} {'matches':>8}")
+        for size in options['sizes']:
+            lats = np.array([origin_lat + rng.uniform(-spread, spread) for _ in range(size)])
+            lons = np.array([origin_lon + rng.uniform(-spread, spread) for _ in range(size)])
+
+            start = time.perf_counter()
+            mask = within_radius(origin_lat, origin_lon, lats, lons, radius)
+            vectorized = time.perf_counter() - start
+
+            loop_size = min(size, options['max_loop'])
+            origin = (origin_lat, origin_lon)
+            start = time.perf_counter()
+            expected = [geodesic((lats[i], lons[i]), origin).km <= radius for i in range(loop_size)]
+            loop = (time.perf_counter() - start) * size / loop_size
+            matches = bool(np.array_equal(mask[:loop_size], np.array(expected, dtype=bool)))
+
+            loop_label = f"{loop:.3f}" + ('*' if loop_size < size else '')
+            self.stdout.write(
+                f"{size:>10} {loop_label:>12} {vectorized:>15.4f} {loop / vectorized:>8.0f}x {str(matches):>8}"
+            )
+
+        self.stdout.write("* extrapolated from --max-loop points")
@@ -0,0 +1,40 @@
+import ipaddress
+import random
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.ipdb import IPDatabase, IPDatabaseError
+
+
+class Command(BaseCommand):
+    help = "Measure lookups per second against the offline geolocation database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=settings.IP_GEOLOCATION_DB_PATH)
+        parser.add_argument('--lookups', type=int, default=200_000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        try:
+            database = IPDatabase(options['path'])
+        except (OSError, IPDatabaseError) as e:
+            raise CommandError(str(e))
+
+        rng = random.Random(options['seed'])
+        addresses = [str(ipaddress.IPv4Address(rng.getrandbits(32))) for _ in range(options['lookups'])]
+
+        found = 0
+        start = time.perf_counter()
+        for address in addresses:
+            if database.lookup(address) is not None:
+                found += 1
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(
+            f"{len(database)} ranges, {len(addresses)} lookups in {elapsed:.3f}s: "
+            f"{len(addresses) / elapsed:,.0f} lookups/s, {elapsed / len(addresses) * 1e6:.2f} us/lookup, "
+            f"{found} hits"
+        )
+        database.close()
@@ -0,0 +1,97 @@
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from core.fastserializers import FastSerializer
+from core.models import Comment, Network, NetworkDevice, NetworkRating
+from core.serializers import NetworkRatingListSerializer, NetworkRatingSerializer
+
+
+class Command(BaseCommand):
+    help = "Benchmark the fast rating serializer against NetworkRatingSerializer and check their output is identical."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ratings', type=int, default=1000, help="Ratings per payload")
+        parser.add_argument('--comments', type=int, default=2, help="Top-level comments per rating")
+        parser.add_argument('--replies', type=int, default=2, help="Replies shown per comment")
+        parser.add_argument('--repeat', type=int, default=5, help="Payloads serialized per path; the best run is kept")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        ratings = self.build_ratings(options['ratings'], options['comments'], options['replies'], rng)
+        request = Request(RequestFactory().get('/api/network/ratings/', HTTP_HOST='localhost'))
+        request.user = AnonymousUser()
+        liked = {
+            comment.id for rating in ratings for comment in rating.top_level_comments if rng.random() < 0.3
+        }
+        context = {'request': request, 'liked_comment_ids': liked}
+
+        self.stdout.write(f"{'payload':>18} {'serializer (s)':>15} {'fast (s)':>10} {'rows/s':>20} {'speedup':>8} {'identical':>10}")
+        for label, comments, reference in (
+            ('with comments', True, NetworkRatingSerializer),
+            ('without comments', False, NetworkRatingListSerializer),
+        ):
+            slow, expected = self.best(options['repeat'], lambda: reference(ratings, many=True, context=context).data)
+            fast, actual = self.best(options['repeat'], lambda: FastSerializer(context).ratings(ratings, comments))
+            identical = JSONRenderer().render(expected) == JSONRenderer().render(actual)
+            rows = f"{len(ratings) / slow:,.0f} -> {len(ratings) / fast:,.0f}"
+            self.stdout.write(
+                f"{label:>18} {slow:>15.4f} {fast:>10.4f} {rows:>20} {slow / fast:>7.1f}x {str(identical):>10}"
+            )
+
+    def best(self, repeat, serialize):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            data = serialize()
+            timings.append(time.perf_counter() - start)
+        return min(timings), data
+
+    def build_ratings(self, count, comments, replies, rng):
+        """Unsaved ratings with their relations and threads attached, as prefetch_ratings leaves them"""
+        networks = [
+            Network(id=index, name=f'Network {index}', image=f'uploads/network-{index}.png', status=True, slug=f'network-{index}')
+            for index in range(1, 6)
+        ]
+        devices = [NetworkDevice(id=index, name=f'Device {index}', slug=f'device-{index}') for index in range(1, 4)]
+        users = [User(id=index, username=f'user{index}') for index in range(1, 51)]
+        now = timezone.now()
+        comment_ids = iter(range(1, count * comments * (replies + 1) + 1))
+
+        def comment(rating, parent, created_at):
+            user = rng.choice(users)
+            instance = Comment(
+                id=next(comment_ids), user=user, content='Same here, the signal drops every evening.',
+                network_rating_id=rating.id, parent_id=parent.id if parent else None,
+                created_at=created_at, updated_at=created_at, like_count=rng.randrange(20),
+            )
+            instance.user = user
+            return instance
+
+        ratings = []
+        for index in range(1, count + 1):
+            created_at = now - timedelta(minutes=index)
+            rating = NetworkRating(
+                id=index, user=rng.choice(users), rating=Decimal(rng.randint(1, 5)),
+                review='Coverage is solid downtown but weak in the suburbs.', address='Yaba, Lagos',
+                created_at=created_at, location_pending=False,
+            )
+            rating.network = rng.choice(networks)
+            rating.device = rng.choice(devices) if rng.random() < 0.8 else None
+            rating.top_level_comments = []
+            for _ in range(comments):
+                top = comment(rating, None, created_at + timedelta(seconds=1))
+                top.prefetched_replies = [comment(rating, top, created_at + timedelta(seconds=2)) for _ in range(replies)]
+                top.has_more_replies = rng.random() < 0.2
+                rating.top_level_comments.append(top)
+            ratings.append(rating)
+        return ratings
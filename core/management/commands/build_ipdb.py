@@ -0,0 +1,34 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.ipdb import build_database, read_csv_ranges
+
+
+class Command(BaseCommand):
+    help = "Compile a CSV of IP ranges into the memory-mapped offline geolocation database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path', help="CSV with start_ip/end_ip (or network), city, country_name, latitude, longitude")
+        parser.add_argument('--output', default=settings.IP_GEOLOCATION_DB_PATH,
+                            help="Where to write the database (defaults to IP_GEOLOCATION_DB_PATH)")
+
+    def handle(self, *args, **options):
+        csv_path = options['csv_path']
+        output = options['output']
+        if not os.path.exists(csv_path):
+            raise CommandError(f"{csv_path} does not exist")
+
+        directory = os.path.dirname(output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        start = time.perf_counter()
+        count = build_database(read_csv_ranges(csv_path), output)
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {count} ranges to {output} ({os.path.getsize(output)} bytes) in {elapsed:.2f}s"
+        ))
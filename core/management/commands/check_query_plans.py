@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from core.queryplans import check_query_plans
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN the hot rating queries and fail if any of them scans the whole ratings table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help="Database alias to check")
+        parser.add_argument('--show-plans', action='store_true', help="Print every plan, not only failing ones")
+
+    def handle(self, *args, **options):
+        try:
+            results = check_query_plans(options['database'])
+        except NotImplementedError as e:
+            raise CommandError(str(e))
+
+        failed = [result for result in results if result['full_scans']]
+        for result in results:
+            if result['full_scans']:
+                self.stdout.write(self.style.ERROR(f"FULL SCAN  {result['name']}"))
+            else:
+                self.stdout.write(f"ok         {result['name']}")
+            if result['full_scans'] or options['show_plans']:
+                for line in result['plan'].splitlines():
+                    self.stdout.write(f"    {line}")
+
+        if failed:
+            raise CommandError(f"{len(failed)} of {len(results)} hot queries scan the whole ratings table")
+        self.stdout.write(self.style.SUCCESS(f"All {len(results)} hot queries use an index"))
@@ -0,0 +1,23 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.enrichment import sweep_stale_locations
+
+
+class Command(BaseCommand):
+    help = "Retry the location lookups of ratings left pending, e.g. by a worker restart that lost its queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=settings.LOCATION_ENRICHMENT_STALE_AFTER,
+                            help="Only ratings created at least this many seconds ago")
+
+    def handle(self, *args, **options):
+        if options['older_than'] < 0:
+            raise CommandError("--older-than can't be negative")
+        start = time.perf_counter()
+        enriched, failed = sweep_stale_locations(options['older_than'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Enriched {enriched} ratings, {failed} left without a location ({time.perf_counter() - start:.1f}s)"
+        ))
@@ -0,0 +1,92 @@
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.importer import FORMATS, RatingImporter, detect_format, read_records
+
+
+class Command(BaseCommand):
+    help = "Import ratings (and their comments) from a JSONL or CSV file, in bulk, resuming from a checkpoint."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="JSONL or CSV file of ratings, shaped like the rating export")
+        parser.add_argument('--format', choices=FORMATS, help="Input format (defaults to the file extension)")
+        parser.add_argument('--batch-size', type=int, default=settings.RATING_IMPORT_BATCH_SIZE,
+                            help="Records validated and inserted per transaction")
+        parser.add_argument('--checkpoint', help="Checkpoint file (defaults to <path>.checkpoint)")
+        parser.add_argument('--resume', action='store_true',
+                            help="Skip the records imported by a previous run, as recorded in the checkpoint")
+        parser.add_argument('--errors', help="Write rejected records, with their errors, to this JSONL file")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f"{path} does not exist")
+        if options['batch_size'] < 1:
+            raise CommandError("--batch-size must be positive")
+        fmt = options['format'] or detect_format(path)
+        checkpoint_path = options['checkpoint'] or f'{path}.checkpoint'
+
+        progress = {'path': os.path.abspath(path), 'records': 0, 'created': 0, 'comments': 0, 'failed': 0}
+        if options['resume'] and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as checkpoint:
+                progress = json.load(checkpoint)
+            if progress.get('path') != os.path.abspath(path):
+                raise CommandError(f"{checkpoint_path} is the checkpoint of {progress.get('path')}")
+            self.stdout.write(f"Resuming after record {progress['records']}")
+
+        importer = RatingImporter()
+        errors = open(options['errors'], 'a', encoding='utf-8') if options['errors'] else None
+        start = time.perf_counter()
+        done = 0
+        try:
+            chunk = []
+            for number, record in read_records(path, fmt, skip=progress['records']):
+                chunk.append((number, record))
+                if len(chunk) >= options['batch_size']:
+                    self.import_chunk(importer, chunk, progress, checkpoint_path, errors)
+                    done += len(chunk)
+                    self.report(progress, done, start)
+                    chunk = []
+            if chunk:
+                self.import_chunk(importer, chunk, progress, checkpoint_path, errors)
+                done += len(chunk)
+        finally:
+            if errors:
+                errors.close()
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {progress['created']} ratings and {progress['comments']} comments, "
+            f"rejected {progress['failed']} records ({done} records in {elapsed:.1f}s, {done / elapsed if elapsed else 0:.0f} rows/s)"
+        ))
+
+    def import_chunk(self, importer, chunk, progress, checkpoint_path, errors):
+        accepted, rejected = importer.validate(chunk)
+        created, comments, conflicts = importer.insert(accepted)
+        rejected.update(conflicts)
+
+        progress['records'] = chunk[-1][0]
+        progress['created'] += created
+        progress['comments'] += comments
+        progress['failed'] += len(rejected)
+        # Written once the chunk is committed. A crash in between replays the
+        # chunk on resume, whose ratings are then rejected as duplicates.
+        with open(f'{checkpoint_path}.tmp', 'w') as checkpoint:
+            json.dump(progress, checkpoint)
+        os.replace(f'{checkpoint_path}.tmp', checkpoint_path)
+
+        if errors:
+            for number, record_errors in sorted(rejected.items()):
+                errors.write(json.dumps({'record': number, 'errors': record_errors}) + '\n')
+            errors.flush()
+
+    def report(self, progress, done, start):
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"{progress['records']} records: {progress['created']} created, {progress['failed']} rejected "
+            f"({done / elapsed if elapsed else 0:.0f} rows/s)"
+        )
@@ -0,0 +1,50 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.response_cache import response_cache
+from core.rollups import rebuild_daily_buckets, rebuild_network_stats, rebuild_user_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-network rating rollups, daily buckets and user summaries from the ratings and comments tables and report drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only report drift, don't write the recomputed rollups")
+        parser.add_argument('--since', help="Only rebuild daily buckets from this day on (YYYY-MM-DD)")
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        try:
+            since = date.fromisoformat(options['since']) if options['since'] else None
+        except ValueError:
+            raise CommandError(f"Invalid --since date: {options['since']}")
+
+        self.report("network rollups", rebuild_network_stats, dry_run=dry_run)
+        self.report("daily buckets", rebuild_daily_buckets, dry_run=dry_run, since=since)
+        self.report("user summaries", rebuild_user_stats, dry_run=dry_run)
+        if not dry_run:
+            response_cache.bump('ratings')
+
+    def report(self, label, rebuild, **kwargs):
+        start = time.perf_counter()
+        drift = rebuild(**kwargs)
+        elapsed = time.perf_counter() - start
+
+        for entry in drift:
+            if 'user_id' in entry:
+                key = f"user {entry.pop('user_id')}"
+            else:
+                key = ' '.join(str(entry.pop(name)) for name in ('network_id', 'day') if name in entry)
+                key = f"network {key}"
+            details = ', '.join(f"{field}: {stored} -> {expected}" for field, (stored, expected) in entry.items())
+            self.stdout.write(f"{key}: {details}")
+
+        if not drift:
+            self.stdout.write(self.style.SUCCESS(f"The {label} are consistent ({elapsed:.2f}s)"))
+        elif kwargs['dry_run']:
+            self.stdout.write(self.style.WARNING(f"{len(drift)} {label} drifted ({elapsed:.2f}s, not fixed)"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Fixed {len(drift)} drifted {label} ({elapsed:.2f}s)"))
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from core.search import reset_active_backends, search_backend
+
+
+class Command(BaseCommand):
+    help = "Reindex every rating for full-text search, putting back missing triggers."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help="Database alias to reindex")
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        backend = search_backend(connection)
+        if backend.vendor is None:
+            raise CommandError(f"No full-text search index for the {connection.vendor} backend")
+        if not backend.installed(connection):
+            raise CommandError("The full-text search index is not installed; run `migrate` first")
+
+        start = time.perf_counter()
+        with transaction.atomic(using=connection.alias):
+            if backend.suspended(connection):
+                # Puts the triggers back and reindexes
+                backend.resume(connection)
+            else:
+                backend.rebuild(connection)
+        reset_active_backends()
+        self.stdout.write(self.style.SUCCESS(
+            f"Reindexed ratings for full-text search ({time.perf_counter() - start:.2f}s)"
+        ))
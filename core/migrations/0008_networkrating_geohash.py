@@ -0,0 +1,56 @@
+# Generated by Django 4.2.2 on 2026-10-17 21:56
+
+import django.core.validators
+from django.db import migrations, models
+
+from core.geohash import encode
+
+
+def backfill_geohash(apps, schema_editor):
+    NetworkRating = apps.get_model('core', 'NetworkRating')
+    ratings = NetworkRating.objects.filter(latitude__isnull=False, longitude__isnull=False)
+    for rating in ratings.only('id', 'latitude', 'longitude').iterator():
+        NetworkRating.objects.filter(pk=rating.pk).update(
+            geohash=encode(float(rating.latitude), float(rating.longitude))
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_remove_comment_network_rating_comment_network_rating'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='networkrating',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12, null=True),
+        ),
+        migrations.AlterField(
+            model_name='networkrating',
+            name='address',
+            field=models.CharField(blank=True, help_text="User's location address", max_length=500, null=True),
+        ),
+        migrations.AlterField(
+            model_name='networkrating',
+            name='latitude',
+            field=models.DecimalField(blank=True, decimal_places=6, help_text='Latitude coordinate (-90 to 90)', max_digits=9, null=True, validators=[django.core.validators.MinValueValidator(-90.0), django.core.validators.MaxValueValidator(90.0)]),
+        ),
+        migrations.AlterField(
+            model_name='networkrating',
+            name='longitude',
+            field=models.DecimalField(blank=True, decimal_places=6, help_text='Longitude coordinate (-180 to 180)', max_digits=9, null=True, validators=[django.core.validators.MinValueValidator(-180.0), django.core.validators.MaxValueValidator(180.0)]),
+        ),
+        migrations.AlterField(
+            model_name='networkrating',
+            name='rating',
+            field=models.DecimalField(decimal_places=1, help_text='Rating between 1.0 and 5.0', max_digits=3, validators=[django.core.validators.MinValueValidator(1.0), django.core.validators.MaxValueValidator(5.0)]),
+        ),
+        migrations.AlterField(
+            model_name='networkrating',
+            name='review',
+            field=models.TextField(help_text="User's detailed review of the network", max_length=1000),
+        ),
+        migrations.RunPython(backfill_geohash, migrations.RunPython.noop),
+    ]
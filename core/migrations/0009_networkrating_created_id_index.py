@@ -0,0 +1,17 @@
+# Generated by Django 4.2.2 on 2026-10-17 21:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_networkrating_geohash'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='networkrating',
+            index=models.Index(fields=['-created_at', '-id'], name='rating_created_id_idx'),
+        ),
+    ]
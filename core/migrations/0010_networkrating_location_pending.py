@@ -0,0 +1,18 @@
+# Generated by Django 4.2.2 on 2026-10-17 22:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_networkrating_created_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='networkrating',
+            name='location_pending',
+            field=models.BooleanField(default=False, help_text='Location lookup still in progress'),
+        ),
+    ]
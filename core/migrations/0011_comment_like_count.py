@@ -0,0 +1,34 @@
+# Generated by Django 4.2.2 on 2026-10-17 22:06
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_like_count(apps, schema_editor):
+    Comment = apps.get_model('core', 'Comment')
+    likes = (
+        Comment.likes.through.objects
+        .filter(comment_id=OuterRef('pk'))
+        .order_by()
+        .values('comment_id')
+        .annotate(total=Count('*'))
+        .values('total')
+    )
+    Comment.objects.update(like_count=Coalesce(Subquery(likes), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_networkrating_location_pending'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_like_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 4.2.2 on 2026-10-17 22:09
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Q, Sum
+import django.db.models.deletion
+
+
+def backfill_rating_stats(apps, schema_editor):
+    Network = apps.get_model('core', 'Network')
+    NetworkRating = apps.get_model('core', 'NetworkRating')
+    NetworkRatingStats = apps.get_model('core', 'NetworkRatingStats')
+    Comment = apps.get_model('core', 'Comment')
+
+    stats = {network_id: NetworkRatingStats(network_id=network_id) for network_id in Network.objects.values_list('id', flat=True)}
+    ratings = (
+        NetworkRating.objects
+        .filter(network__isnull=False)
+        .order_by()
+        .values('network_id')
+        .annotate(
+            rating_count=Count('id'),
+            rating_sum=Sum('rating'),
+            last_rated_at=Max('created_at'),
+            **{f'count_{star}': Count('id', filter=Q(rating=star)) for star in range(1, 6)},
+        )
+    )
+    for row in ratings:
+        row['rating_sum'] = Decimal(str(row['rating_sum'] or 0)).quantize(Decimal('0.1'))
+        for field, value in row.items():
+            setattr(stats[row['network_id']], field, value)
+
+    comments = (
+        Comment.objects
+        .filter(network_rating__network__isnull=False)
+        .order_by()
+        .values('network_rating__network_id')
+        .annotate(total=Count('id'))
+    )
+    for row in comments:
+        stats[row['network_rating__network_id']].comment_count = row['total']
+
+    NetworkRatingStats.objects.bulk_create(stats.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_comment_like_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NetworkRatingStats',
+            fields=[
+                ('network', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_stats', serialize=False, to='core.network')),
+                ('rating_count', models.PositiveIntegerField(default=0)),
+                ('rating_sum', models.DecimalField(decimal_places=1, default=0, max_digits=14)),
+                ('count_1', models.PositiveIntegerField(default=0)),
+                ('count_2', models.PositiveIntegerField(default=0)),
+                ('count_3', models.PositiveIntegerField(default=0)),
+                ('count_4', models.PositiveIntegerField(default=0)),
+                ('count_5', models.PositiveIntegerField(default=0)),
+                ('comment_count', models.PositiveIntegerField(default=0)),
+                ('last_rated_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'network rating stats',
+            },
+        ),
+        migrations.RunPython(backfill_rating_stats, migrations.RunPython.noop),
+    ]
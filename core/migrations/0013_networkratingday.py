@@ -0,0 +1,61 @@
+# Generated by Django 4.2.2 on 2026-10-17 22:12
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+import django.db.models.deletion
+
+
+def backfill_rating_days(apps, schema_editor):
+    NetworkRating = apps.get_model('core', 'NetworkRating')
+    NetworkRatingDay = apps.get_model('core', 'NetworkRatingDay')
+
+    rows = (
+        NetworkRating.objects
+        .filter(network__isnull=False)
+        .order_by()
+        .annotate(day=TruncDate('created_at'))
+        .values('network_id', 'day')
+        .annotate(
+            rating_count=Count('id'),
+            rating_sum=Sum('rating'),
+            **{f'count_{star}': Count('id', filter=Q(rating=star)) for star in range(1, 6)},
+        )
+    )
+    buckets = []
+    for row in rows:
+        row['rating_sum'] = Decimal(str(row['rating_sum'] or 0)).quantize(Decimal('0.1'))
+        buckets.append(NetworkRatingDay(**row))
+    NetworkRatingDay.objects.bulk_create(buckets, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_networkratingstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NetworkRatingDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('rating_count', models.PositiveIntegerField(default=0)),
+                ('rating_sum', models.DecimalField(decimal_places=1, default=0, max_digits=12)),
+                ('count_1', models.PositiveIntegerField(default=0)),
+                ('count_2', models.PositiveIntegerField(default=0)),
+                ('count_3', models.PositiveIntegerField(default=0)),
+                ('count_4', models.PositiveIntegerField(default=0)),
+                ('count_5', models.PositiveIntegerField(default=0)),
+                ('network', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rating_days', to='core.network')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='networkratingday',
+            constraint=models.UniqueConstraint(fields=('network', 'day'), name='rating_day_network_day_uniq'),
+        ),
+        migrations.RunPython(backfill_rating_days, migrations.RunPython.noop),
+    ]
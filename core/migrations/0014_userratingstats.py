@@ -0,0 +1,77 @@
+# Generated by Django 4.2.2 on 2026-10-17 22:15
+
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+import django.db.models.deletion
+
+
+def backfill_user_stats(apps, schema_editor):
+    NetworkRating = apps.get_model('core', 'NetworkRating')
+    UserRatingStats = apps.get_model('core', 'UserRatingStats')
+
+    stats = {}
+    rows = (
+        NetworkRating.objects
+        .order_by()
+        .values('user_id')
+        .annotate(
+            rating_count=Count('id'),
+            rating_sum=Sum('rating'),
+            networks_rated=Count('network_id', distinct=True),
+            last_rated_at=Max('created_at'),
+            **{f'count_{star}': Count('id', filter=Q(rating=star)) for star in range(1, 6)},
+        )
+    )
+    for row in rows:
+        row['rating_sum'] = Decimal(str(row['rating_sum'] or 0)).quantize(Decimal('0.1'))
+        stats[row['user_id']] = UserRatingStats(recent_counts={}, **row)
+
+    recent = (
+        NetworkRating.objects
+        .order_by()
+        .annotate(day=TruncDate('created_at'))
+        .filter(day__gte=timezone.localdate() - timedelta(days=6))
+        .values('user_id', 'day')
+        .annotate(total=Count('id'))
+    )
+    for row in recent:
+        stats[row['user_id']].recent_counts[row['day'].isoformat()] = row['total']
+
+    UserRatingStats.objects.bulk_create(stats.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('core', '0013_networkratingday'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserRatingStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('rating_count', models.PositiveIntegerField(default=0)),
+                ('rating_sum', models.DecimalField(decimal_places=1, default=0, max_digits=12)),
+                ('count_1', models.PositiveIntegerField(default=0)),
+                ('count_2', models.PositiveIntegerField(default=0)),
+                ('count_3', models.PositiveIntegerField(default=0)),
+                ('count_4', models.PositiveIntegerField(default=0)),
+                ('count_5', models.PositiveIntegerField(default=0)),
+                ('networks_rated', models.PositiveIntegerField(default=0)),
+                ('recent_counts', models.JSONField(default=dict)),
+                ('last_rated_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'user rating stats',
+            },
+        ),
+        migrations.RunPython(backfill_user_stats, migrations.RunPython.noop),
+    ]
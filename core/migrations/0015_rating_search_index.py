@@ -0,0 +1,109 @@
+# Generated by Django 4.2.2 on 2026-10-17 22:30
+
+from django.db import migrations
+
+# The statements are copied here rather than imported from core.search, so
+# this migration keeps creating the index as it was at this point in history.
+
+POSTGRES_INSTALL = [
+    "ALTER TABLE core_networkrating ADD COLUMN IF NOT EXISTS search_document tsvector",
+    """
+    CREATE OR REPLACE FUNCTION core_networkrating_search_document(review text, address text, network bigint)
+    RETURNS tsvector AS $$
+        SELECT setweight(to_tsvector('simple', coalesce((SELECT name FROM core_network WHERE id = network), '')), 'A')
+            || setweight(to_tsvector('simple', coalesce(review, '')), 'B')
+            || setweight(to_tsvector('simple', coalesce(address, '')), 'C')
+    $$ LANGUAGE sql STABLE
+    """,
+    """
+    CREATE OR REPLACE FUNCTION core_networkrating_search_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_document := core_networkrating_search_document(NEW.review, NEW.address, NEW.network_id);
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE FUNCTION core_network_search_update() RETURNS trigger AS $$
+    BEGIN
+        UPDATE core_networkrating
+        SET search_document = core_networkrating_search_document(review, address, network_id)
+        WHERE network_id = NEW.id;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS core_networkrating_search ON core_networkrating",
+    """
+    CREATE TRIGGER core_networkrating_search
+    BEFORE INSERT OR UPDATE OF review, address, network_id ON core_networkrating
+    FOR EACH ROW EXECUTE FUNCTION core_networkrating_search_update()
+    """,
+    "DROP TRIGGER IF EXISTS core_network_search ON core_network",
+    """
+    CREATE TRIGGER core_network_search
+    AFTER UPDATE OF name ON core_network
+    FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+    EXECUTE FUNCTION core_network_search_update()
+    """,
+    "CREATE INDEX IF NOT EXISTS core_networkrating_search_gin ON core_networkrating USING gin (search_document)",
+    "UPDATE core_networkrating SET search_document = core_networkrating_search_document(review, address, network_id)",
+]
+
+POSTGRES_UNINSTALL = [
+    "DROP TRIGGER IF EXISTS core_network_search ON core_network",
+    "DROP TRIGGER IF EXISTS core_networkrating_search ON core_networkrating",
+    "DROP FUNCTION IF EXISTS core_network_search_update()",
+    "DROP FUNCTION IF EXISTS core_networkrating_search_update()",
+    "DROP FUNCTION IF EXISTS core_networkrating_search_document(text, text, bigint)",
+    "DROP INDEX IF EXISTS core_networkrating_search_gin",
+    "ALTER TABLE core_networkrating DROP COLUMN IF EXISTS search_document",
+]
+
+# The SQLite triggers would break the table rebuilds of later migrations;
+# they are created, with a full reindex, once `migrate` is done (see
+# core/signals.py). Only the table is created and filled here.
+SQLITE_INSTALL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS core_networkrating_fts
+    USING fts5(network_name, review, address, tokenize = 'unicode61 remove_diacritics 2')
+    """,
+    """
+    INSERT INTO core_networkrating_fts (rowid, network_name, review, address)
+    SELECT rating.id, network.name, rating.review, rating.address
+    FROM core_networkrating rating LEFT JOIN core_network network ON network.id = rating.network_id
+    """,
+]
+
+SQLITE_UNINSTALL = [
+    "DROP TRIGGER IF EXISTS core_network_fts_update",
+    "DROP TRIGGER IF EXISTS core_networkrating_fts_delete",
+    "DROP TRIGGER IF EXISTS core_networkrating_fts_update",
+    "DROP TRIGGER IF EXISTS core_networkrating_fts_insert",
+    "DROP TABLE IF EXISTS core_networkrating_fts",
+]
+
+INSTALL = {'postgresql': POSTGRES_INSTALL, 'sqlite': SQLITE_INSTALL}
+UNINSTALL = {'postgresql': POSTGRES_UNINSTALL, 'sqlite': SQLITE_UNINSTALL}
+
+
+def install_search_index(apps, schema_editor):
+    # Other backends search without an index
+    for statement in INSTALL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def uninstall_search_index(apps, schema_editor):
+    for statement in UNINSTALL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_userratingstats'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
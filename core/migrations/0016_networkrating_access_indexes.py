@@ -0,0 +1,155 @@
+# Generated by Django 4.2.2 on 2026-10-17 22:36
+
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+STARS = range(1, 6)
+
+
+def dedupe_ratings(apps, schema_editor):
+    """
+    Keep one rating per user and network, so rating_user_network_uniq can be
+    added: the newest rating stays, comments on the older ones move onto
+    it, and the older ones are deleted. Migrations send no signals, so the
+    rollups of the networks and users involved are recomputed.
+    """
+    NetworkRating = apps.get_model('core', 'NetworkRating')
+    Comment = apps.get_model('core', 'Comment')
+
+    duplicates = list(
+        NetworkRating.objects
+        .filter(network__isnull=False)
+        .order_by()
+        .values('user_id', 'network_id')
+        .annotate(ratings=Count('id'))
+        .filter(ratings__gt=1)
+    )
+    if not duplicates:
+        return
+
+    for row in duplicates:
+        kept, *older = (
+            NetworkRating.objects
+            .filter(user_id=row['user_id'], network_id=row['network_id'])
+            .order_by('-created_at', '-id')
+            .values_list('id', flat=True)
+        )
+        Comment.objects.filter(network_rating_id__in=older).update(network_rating_id=kept)
+        NetworkRating.objects.filter(id__in=older).delete()
+
+    network_ids = {row['network_id'] for row in duplicates}
+    user_ids = {row['user_id'] for row in duplicates}
+    recompute_network_rollups(apps, network_ids)
+    recompute_user_rollups(apps, user_ids)
+
+    if schema_editor.connection.vendor == 'postgresql':
+        # Run the deferred foreign key checks now: PostgreSQL refuses to
+        # ALTER a table with pending trigger events, as AddConstraint does next
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+def rating_aggregates():
+    return {
+        'rating_count': Count('id'),
+        'rating_sum': Sum('rating'),
+        **{f'count_{star}': Count('id', filter=Q(rating=star)) for star in STARS},
+    }
+
+
+def empty_rollup():
+    return {'rating_count': 0, 'rating_sum': Decimal(0), **{f'count_{star}': 0 for star in STARS}}
+
+
+def clean_sum(row):
+    row['rating_sum'] = Decimal(str(row['rating_sum'] or 0)).quantize(Decimal('0.1'))
+    return row
+
+
+def recompute_network_rollups(apps, network_ids):
+    """Rewrite the rollups and daily buckets of `network_ids` from their ratings"""
+    NetworkRating = apps.get_model('core', 'NetworkRating')
+    NetworkRatingStats = apps.get_model('core', 'NetworkRatingStats')
+    NetworkRatingDay = apps.get_model('core', 'NetworkRatingDay')
+    Comment = apps.get_model('core', 'Comment')
+    ratings = NetworkRating.objects.filter(network_id__in=network_ids).order_by()
+
+    totals = {network_id: {**empty_rollup(), 'last_rated_at': None, 'comment_count': 0} for network_id in network_ids}
+    for row in ratings.values('network_id').annotate(last_rated_at=Max('created_at'), **rating_aggregates()):
+        totals[row.pop('network_id')].update(clean_sum(row))
+    comments = (
+        Comment.objects
+        .filter(network_rating__network_id__in=network_ids)
+        .order_by()
+        .values('network_rating__network_id')
+        .annotate(total=Count('id'))
+    )
+    for row in comments:
+        totals[row['network_rating__network_id']]['comment_count'] = row['total']
+    for network_id, values in totals.items():
+        NetworkRatingStats.objects.update_or_create(network_id=network_id, defaults=values)
+
+    NetworkRatingDay.objects.filter(network_id__in=network_ids).delete()
+    NetworkRatingDay.objects.bulk_create([
+        NetworkRatingDay(**clean_sum(row))
+        for row in ratings.annotate(day=TruncDate('created_at')).values('network_id', 'day').annotate(**rating_aggregates())
+    ], batch_size=500)
+
+
+def recompute_user_rollups(apps, user_ids):
+    """Rewrite the rating summaries of `user_ids` from their ratings"""
+    NetworkRating = apps.get_model('core', 'NetworkRating')
+    UserRatingStats = apps.get_model('core', 'UserRatingStats')
+    ratings = NetworkRating.objects.filter(user_id__in=user_ids).order_by()
+
+    summaries = {
+        user_id: {**empty_rollup(), 'networks_rated': 0, 'last_rated_at': None, 'recent_counts': {}}
+        for user_id in user_ids
+    }
+    rows = ratings.values('user_id').annotate(
+        networks_rated=Count('network_id', distinct=True), last_rated_at=Max('created_at'), **rating_aggregates(),
+    )
+    for row in rows:
+        summaries[row.pop('user_id')].update(clean_sum(row))
+    recent = (
+        ratings
+        .annotate(day=TruncDate('created_at'))
+        .filter(day__gte=timezone.localdate() - timedelta(days=6))
+        .values('user_id', 'day')
+        .annotate(total=Count('id'))
+    )
+    for row in recent:
+        summaries[row['user_id']]['recent_counts'][row['day'].isoformat()] = row['total']
+    for user_id, values in summaries.items():
+        UserRatingStats.objects.update_or_create(user_id=user_id, defaults=values)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_rating_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='networkrating',
+            index=models.Index(fields=['network', '-created_at', '-id'], name='rating_network_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='networkrating',
+            index=models.Index(fields=['rating'], name='rating_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='networkrating',
+            index=models.Index(fields=['latitude', 'longitude'], name='rating_lat_lon_idx'),
+        ),
+        migrations.RunPython(dedupe_ratings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='networkrating',
+            constraint=models.UniqueConstraint(fields=('user', 'network'), name='rating_user_network_uniq'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.2 on 2026-10-17 23:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_dataversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='networkrating',
+            name='client_ip',
+            field=models.GenericIPAddressField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='networkrating',
+            index=models.Index(condition=models.Q(('location_pending', True)), fields=['created_at'], name='rating_location_pending_idx'),
+        ),
+    ]
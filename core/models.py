@@ -1,9 +1,16 @@
+from datetime import timedelta
+
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.db.models import DEFERRED, F
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 from django.utils.text import slugify
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.core.exceptions import ValidationError
+
+from core import geohash as geo
+from core.response_cache import response_cache
 # from django.contrib.gis.db import models as gis_models
 
 User = get_user_model()
@@ -63,6 +70,12 @@ class NetworkRating(models.Model):
         longitude: Longitude for geolocation (optional).
         created_at: The date and time when the rating was created.
         review: The user's review text.
+        geohash: Geohash of the coordinates, kept in sync on save and used as a
+            spatial index for nearby lookups.
+        location_pending: True while the location lookup for a new rating is
+            still queued in the background.
+        client_ip: IP address the rating was posted from, kept only while
+            its location lookup is pending so the lookup can be retried.
     """
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     network = models.ForeignKey(Network, on_delete=models.CASCADE, blank=True, null=True)
@@ -94,6 +107,25 @@ class NetworkRating(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     # objects = gis_models.Manager()
     review = models.TextField(max_length=1000, help_text="User's detailed review of the network")
+    geohash = models.CharField(max_length=geo.MAX_PRECISION, null=True, blank=True, db_index=True, editable=False)
+    location_pending = models.BooleanField(default=False, help_text="Location lookup still in progress")
+    client_ip = models.GenericIPAddressField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='rating_created_id_idx'),
+            models.Index(fields=['network', '-created_at', '-id'], name='rating_network_created_idx'),
+            models.Index(fields=['rating'], name='rating_rating_idx'),
+            models.Index(fields=['latitude', 'longitude'], name='rating_lat_lon_idx'),
+            # Ratings whose location lookup is still pending, for the sweep
+            models.Index(
+                fields=['created_at'], name='rating_location_pending_idx', condition=models.Q(location_pending=True),
+            ),
+        ]
+        constraints = [
+            # One rating per user and network; also the index for user lookups
+            models.UniqueConstraint(fields=['user', 'network'], name='rating_user_network_uniq'),
+        ]
 
     def clean(self):
         """Validate the model instance"""
@@ -119,8 +151,38 @@ class NetworkRating(models.Model):
             raise ValidationError({'review': 'Review must be at least 10 characters long'})
 
     def save(self, *args, **kwargs):
-        self.full_clean()
-        super().save(*args, **kwargs)
+        # The database enforces the unique constraints; checking them here
+        # would cost a query per save
+        self.full_clean(validate_constraints=False)
+        self.geohash = self.compute_geohash()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and ({'latitude', 'longitude'} & set(update_fields)):
+            kwargs['update_fields'] = set(update_fields) | {'geohash'}
+        # Rollups are updated from post_save handlers; keep them in the same
+        # transaction as the row they summarize.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+        self._loaded_values = self.tracked_values()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = instance.tracked_values()
+        return instance
+
+    def tracked_values(self):
+        """
+        Values the rating rollups depend on, to diff against on update.
+
+        Deferred fields are reported as DEFERRED rather than loaded.
+        """
+        return {name: self.__dict__.get(name, DEFERRED) for name in ('network_id', 'user_id', 'rating')}
+
+    def compute_geohash(self):
+        """Geohash for the current coordinates, or None if they are not set"""
+        if self.latitude is None or self.longitude is None:
+            return None
+        return geo.encode(float(self.latitude), float(self.longitude))
 
     def __str__(self):
         return f'{self.network.name} Rating by {self.user.username}' if self.network else f'Rating by {self.user.username}'
@@ -137,6 +199,7 @@ class Comment(models.Model):
         updated_at: The date and time when the comment was last updated.
         parent: Reference to another comment if this is a reply.
         likes: Users who liked the comment.
+        like_count: Number of likes, maintained alongside `likes`.
     """
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     content = models.TextField()
@@ -145,10 +208,22 @@ class Comment(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     parent = models.ForeignKey('self', null=True, blank=True, related_name='replies', on_delete=models.CASCADE)
     likes = models.ManyToManyField(settings.AUTH_USER_MODEL, related_name='liked_comments', blank=True)
+    like_count = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return f'Comment by {self.user} on {self.created_at}'
 
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+        self._loaded_network_rating_id = self.network_rating_id
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_network_rating_id = instance.__dict__.get('network_rating_id')
+        return instance
+
     @property
     def is_reply(self):
         return self.parent is not None
@@ -159,4 +234,163 @@ class Comment(models.Model):
 
     @property
     def total_likes(self):
-        return self.likes.count()
+        return self.like_count
+
+    def toggle_like(self, user):
+        """
+        Like the comment for `user`, or unlike it if they already did.
+
+        The comment row is locked for the duration, so concurrent toggles
+        serialize and `like_count` stays equal to the number of likes. Only an
+        indexed delete/insert on the through table and a single-row counter
+        update are issued, whatever the number of likers.
+
+        Returns:
+            Tuple of (liked, like_count) after the toggle
+        """
+        Like = Comment.likes.through
+        with transaction.atomic():
+            like_count = Comment.objects.select_for_update().values_list('like_count', flat=True).get(pk=self.pk)
+            removed, _ = Like.objects.filter(comment_id=self.pk, user_id=user.pk).delete()
+            if removed:
+                delta = -1
+            else:
+                Like.objects.create(comment_id=self.pk, user_id=user.pk)
+                delta = 1
+            Comment.objects.filter(pk=self.pk).update(like_count=F('like_count') + delta)
+            response_cache.bump_on_commit('ratings')
+        self.like_count = like_count + delta
+        return delta > 0, self.like_count
+
+
+class NetworkRatingStats(models.Model):
+    """
+    Per-network rating rollup, maintained on every rating and comment write.
+
+    Fields:
+        network: The network summarized.
+        rating_count: Number of ratings.
+        rating_sum: Sum of all rating values.
+        count_1 .. count_5: Number of ratings of exactly 1 to 5 stars.
+        comment_count: Number of comments on the network's ratings.
+        last_rated_at: When the most recent rating was created.
+    """
+    network = models.OneToOneField(Network, on_delete=models.CASCADE, primary_key=True, related_name='rating_stats')
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.DecimalField(max_digits=14, decimal_places=1, default=0)
+    count_1 = models.PositiveIntegerField(default=0)
+    count_2 = models.PositiveIntegerField(default=0)
+    count_3 = models.PositiveIntegerField(default=0)
+    count_4 = models.PositiveIntegerField(default=0)
+    count_5 = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    last_rated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = 'network rating stats'
+
+    def __str__(self):
+        return f'Rating stats for network {self.network_id}'
+
+    @property
+    def average_rating(self):
+        return float(self.rating_sum) / self.rating_count if self.rating_count else 0.0
+
+    @property
+    def rating_distribution(self):
+        return {str(star): getattr(self, f'count_{star}') for star in range(1, 6)}
+
+
+class NetworkRatingDay(models.Model):
+    """
+    Ratings of a network created on one day, maintained on every rating write.
+
+    Fields:
+        network: The network summarized.
+        day: The day (in the current time zone) the ratings were created.
+        rating_count: Number of ratings.
+        rating_sum: Sum of the rating values.
+        count_1 .. count_5: Number of ratings of exactly 1 to 5 stars.
+    """
+    network = models.ForeignKey(Network, on_delete=models.CASCADE, related_name='rating_days')
+    day = models.DateField()
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.DecimalField(max_digits=12, decimal_places=1, default=0)
+    count_1 = models.PositiveIntegerField(default=0)
+    count_2 = models.PositiveIntegerField(default=0)
+    count_3 = models.PositiveIntegerField(default=0)
+    count_4 = models.PositiveIntegerField(default=0)
+    count_5 = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['network', 'day'], name='rating_day_network_day_uniq'),
+        ]
+
+    def __str__(self):
+        return f'Ratings of network {self.network_id} on {self.day}'
+
+
+class UserRatingStats(models.Model):
+    """
+    Per-user summary of the ratings given, maintained on every rating write.
+
+    Fields:
+        user: The user summarized.
+        rating_count: Number of ratings given.
+        rating_sum: Sum of the rating values given.
+        count_1 .. count_5: Number of ratings of exactly 1 to 5 stars.
+        networks_rated: Number of distinct networks rated.
+        recent_counts: Ratings given per day over the last week, keyed by ISO date.
+        last_rated_at: When the user's most recent rating was created.
+    """
+    RECENT_DAYS = 7
+
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='rating_stats')
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.DecimalField(max_digits=12, decimal_places=1, default=0)
+    count_1 = models.PositiveIntegerField(default=0)
+    count_2 = models.PositiveIntegerField(default=0)
+    count_3 = models.PositiveIntegerField(default=0)
+    count_4 = models.PositiveIntegerField(default=0)
+    count_5 = models.PositiveIntegerField(default=0)
+    networks_rated = models.PositiveIntegerField(default=0)
+    recent_counts = models.JSONField(default=dict)
+    last_rated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name_plural = 'user rating stats'
+
+    def __str__(self):
+        return f'Rating stats for user {self.user_id}'
+
+    @property
+    def average_rating(self):
+        return float(self.rating_sum) / self.rating_count if self.rating_count else 0.0
+
+    @property
+    def rating_distribution(self):
+        return {str(star): getattr(self, f'count_{star}') for star in range(1, 6)}
+
+    def recent_activity(self, today=None):
+        """Ratings given over the last RECENT_DAYS days, today included"""
+        since = ((today or timezone.localdate()) - timedelta(days=self.RECENT_DAYS - 1)).isoformat()
+        return sum(count for day, count in self.recent_counts.items() if day >= since)
+
+
+class DataVersion(models.Model):
+    """
+    Version counter of a data set the response cache depends on (see
+    core/response_cache.py), bumped with an atomic UPDATE on every write.
+
+    Fields:
+        name: Name of the data set, e.g. 'ratings'.
+        version: Current version; any change means cached responses are stale.
+        modified_at: When the data set was last written, as a UNIX timestamp.
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    version = models.BigIntegerField()
+    modified_at = models.FloatField()
+
+    def __str__(self):
+        return f'{self.name} v{self.version}'
@@ -0,0 +1,154 @@
+import base64
+import datetime
+import decimal
+import json
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from core.threads import COMMENT_ORDERING, REPLY_ORDERING
+
+
+def _json_value(value):
+    # Full precision: DjangoJSONEncoder would cut datetimes to milliseconds,
+    # which breaks seeking past rows created within the same millisecond.
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    raise TypeError(f'{type(value).__name__} is not a cursor value')
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (seek) pagination over a fixed, unique ordering.
+
+    The cursor is an opaque token holding the ordering values of the last row
+    of the previous page; the next page is fetched with a `WHERE (a, b) < (x, y)`
+    style predicate instead of an OFFSET, so every page costs the same index
+    range scan and no COUNT(*) is ever issued. The last ordering field must be
+    unique (usually `id`) so that ties are broken deterministically.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = api_settings.PAGE_SIZE or 50
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+
+        position = self.decode_cursor(request)
+        queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            try:
+                queryset = queryset.filter(self.seek_filter(position))
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+
+        rows = list(queryset[:page_size + 1])
+        self.has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        self.next_position = self.position_of(rows[-1]) if self.has_next else None
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def seek_filter(self, position):
+        """Rows strictly after `position` in the pagination ordering"""
+        clauses = []
+        for index, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            clause = Q(**{f'{name}__{lookup}': position[index]})
+            for previous_field, value in zip(self.ordering[:index], position):
+                clause &= Q(**{previous_field.lstrip('-'): value})
+            clauses.append(clause)
+        return reduce(or_, clauses)
+
+    def position_of(self, row):
+        return [getattr(row, field.lstrip('-')) for field in self.ordering]
+
+    @staticmethod
+    def encode_position(position) -> str:
+        """Opaque cursor token for a position in the ordering"""
+        payload = json.dumps(position, default=_json_value, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+    def encode_cursor(self, position):
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_position(position))
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            position = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class CommentPagination(KeysetPagination):
+    """
+    Newest-first pages of a rating's top-level comments, continuing from
+    the preview in a rating.
+    """
+    ordering = COMMENT_ORDERING
+    page_size = settings.COMMENT_PAGE_SIZE
+
+
+class ReplyPagination(KeysetPagination):
+    """
+    Oldest-first pages of replies, continuing from the preview in a thread.
+    """
+    ordering = REPLY_ORDERING
+    page_size = settings.COMMENT_REPLIES_PAGE_SIZE
+
+
+class SearchRankPagination(KeysetPagination):
+    """
+    Best matches first for querysets annotated by `core.search.search_ratings`.
+    """
+    ordering = ('-search_rank', '-id')
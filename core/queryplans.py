@@ -0,0 +1,97 @@
+"""
+EXPLAIN-based checks that the hot rating queries are served by an index.
+
+Each entry of HOT_QUERIES builds a queryset shaped like one issued by the
+API. `check_query_plans` asks the database for its plan and reports any
+query that reads the whole ratings table:
+
+    SQLite      a `SCAN core_networkrating` step without `USING ... INDEX`
+    PostgreSQL  a `Seq Scan on core_networkrating` node
+
+PostgreSQL prefers sequential scans on small tables whatever the indexes,
+so its plans are taken with `enable_seqscan` off: a sequential scan then
+only appears when no index can serve the query.
+"""
+import re
+from datetime import timedelta
+from typing import Callable, Dict, List
+
+from django.db import connections, transaction
+from django.utils import timezone
+
+from core.models import NetworkRating
+from core.pagination import KeysetPagination
+from core.utils import filter_nearby
+
+TABLE = NetworkRating._meta.db_table
+
+_SQLITE_SCAN = re.compile(rf'\bSCAN (?:TABLE )?{TABLE}\b(?!.*\bUSING\b.*\bINDEX\b)')
+_POSTGRES_SCAN = re.compile(rf'\bSeq Scan on {TABLE}\b')
+
+
+def _newest_first(queryset):
+    return queryset.order_by(*KeysetPagination.ordering)[:KeysetPagination.page_size + 1]
+
+
+def _nearby(radius_km: float):
+    return filter_nearby(NetworkRating.objects.all(), 6.5244, 3.3792, radius_km).values_list('id')
+
+
+HOT_QUERIES: Dict[str, Callable] = {
+    'ratings, newest first': lambda: _newest_first(NetworkRating.objects.all()),
+    'ratings of a network, newest first': lambda: _newest_first(NetworkRating.objects.filter(network_id=1)),
+    'ratings of a network in a window': lambda: NetworkRating.objects.filter(
+        network_id=1, created_at__gte=timezone.now() - timedelta(days=30),
+    ).values('rating'),
+    'ratings of several networks': lambda: NetworkRating.objects.filter(
+        network_id__in=[1, 2, 3],
+    ).values('network_id', 'rating'),
+    'rating of a user for a network': lambda: NetworkRating.objects.filter(user_id=1, network_id=1),
+    'ratings of a user, newest first': lambda: _newest_first(NetworkRating.objects.filter(user_id=1)),
+    'ratings above a minimum': lambda: NetworkRating.objects.filter(rating__gte=4).values('id'),
+    'ratings near a point': lambda: _nearby(5),
+    'ratings in a wide bounding box': lambda: _nearby(1000),
+    'ratings created since': lambda: NetworkRating.objects.filter(
+        created_at__gte=timezone.now() - timedelta(days=1),
+    ).values('id'),
+}
+
+
+def full_scans(plan: str, vendor: str) -> List[str]:
+    """Lines of an EXPLAIN output that read the whole ratings table"""
+    pattern = _POSTGRES_SCAN if vendor == 'postgresql' else _SQLITE_SCAN
+    return [line.strip() for line in plan.splitlines() if pattern.search(line)]
+
+
+def explain(queryset, using: str) -> str:
+    connection = connections[using]
+    with transaction.atomic(using=using):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.using(using).explain()
+
+
+def check_query_plans(using: str = 'default') -> List[Dict]:
+    """
+    Plan every hot query.
+
+    Args:
+        using: Database alias
+
+    Returns:
+        One dict per query with its `name`, `plan` and the `full_scans`
+        found in it (empty if the query is served by an index)
+
+    Raises:
+        NotImplementedError: For backends other than SQLite and PostgreSQL
+    """
+    vendor = connections[using].vendor
+    if vendor not in ('sqlite', 'postgresql'):
+        raise NotImplementedError(f"Query plans can't be checked on {vendor}")
+
+    results = []
+    for name, build in HOT_QUERIES.items():
+        plan = explain(build(), using)
+        results.append({'name': name, 'plan': plan, 'full_scans': full_scans(plan, vendor)})
+    return results
@@ -0,0 +1,118 @@
+"""
+Query preparation for endpoints that serialize ratings.
+
+NetworkRatingSerializer nests the network, the device and a two-level comment
+thread with like counts and a per-user "liked" flag. Serializing ratings
+straight from a plain queryset costs several queries per rating and per
+comment; these helpers load everything the serializers read up front, so a
+page of ratings costs a fixed number of queries whatever its size.
+"""
+from django.db.models import F, Window, prefetch_related_objects
+from django.db.models.functions import RowNumber
+
+from core.models import Comment
+from core.threads import attach_comment_threads
+
+RATING_RELATED = ('network', 'device')
+
+
+def prepare_ratings_queryset(queryset):
+    """
+    Join the network and device into the ratings query itself.
+
+    Args:
+        queryset: NetworkRating queryset
+
+    Returns:
+        Queryset whose rows still need `prefetch_ratings` for comment threads
+    """
+    return queryset.select_related(*RATING_RELATED)
+
+
+def prefetch_ratings(ratings):
+    """
+    Load everything NetworkRatingSerializer reads for already-fetched ratings.
+
+    Args:
+        ratings: Iterable of NetworkRating instances
+
+    Returns:
+        List of the ratings, with related objects and comment threads populated
+    """
+    ratings = list(ratings)
+    prefetch_related_objects(ratings, *RATING_RELATED)
+    attach_comment_threads(ratings)
+    return ratings
+
+
+def first_per_network(ratings, network_ids, limit: int, ordering) -> list:
+    """
+    The first `limit` ratings of each network in `network_ids`, in one query.
+
+    Args:
+        ratings: NetworkRating queryset to pick from
+        network_ids: IDs of the networks
+        limit: Maximum ratings per network
+        ordering: Field names ordering the ratings of a network
+
+    Returns:
+        List of the ratings, grouped by network in `ordering` order within
+        each network
+    """
+    network_ids = list(network_ids)
+    if not network_ids:
+        return []
+    return list(
+        ratings
+        .filter(network_id__in=network_ids)
+        .annotate(network_rank=Window(
+            RowNumber(),
+            partition_by=[F('network_id')],
+            order_by=[F(field).asc() for field in ordering],
+        ))
+        .filter(network_rank__lte=limit)
+        .order_by('network_id', *ordering)
+    )
+
+
+def shown_comment_ids(ratings) -> list:
+    """IDs of every comment and reply attached to `ratings` by `prefetch_ratings`"""
+    ids = []
+    for rating in ratings:
+        for comment in getattr(rating, 'top_level_comments', []):
+            ids.append(comment.id)
+            ids.extend(reply.id for reply in getattr(comment, 'prefetched_replies', []))
+    return ids
+
+
+def liked_comment_ids(user, comment_ids) -> set:
+    """
+    The subset of `comment_ids` that `user` has liked, in one query.
+    """
+    comment_ids = list(comment_ids)
+    if user is None or not user.is_authenticated or not comment_ids:
+        return set()
+    return set(
+        Comment.likes.through.objects.filter(
+            user_id=user.id,
+            comment_id__in=comment_ids,
+        ).values_list('comment_id', flat=True)
+    )
+
+
+def comments_serializer_context(request, comment_ids) -> dict:
+    """
+    Serializer context for rendering comments, including the liked-comment set.
+    """
+    user = getattr(request, 'user', None) if request is not None else None
+    return {
+        'request': request,
+        'liked_comment_ids': liked_comment_ids(user, comment_ids),
+    }
+
+
+def ratings_serializer_context(request, ratings) -> dict:
+    """
+    Serializer context for rendering ratings prepared by `prefetch_ratings`.
+    """
+    return comments_serializer_context(request, shown_comment_ids(ratings))
@@ -0,0 +1,308 @@
+"""
+Versioned cache for read-heavy API responses.
+
+Responses are cached under a key made of the endpoint, its normalized query
+parameters and the current version of every data set it depends on. A write
+to a data set bumps that set's version counter (after the transaction
+commits), which moves every dependent endpoint onto fresh keys: invalidation
+is a single counter increment. Entries left behind under old versions simply
+expire.
+
+The counters live in the `DataVersion` table rather than in the cache: the
+database cache backend's `incr` is a read followed by a write, which loses
+concurrent bumps, and cache entries can expire or be culled. A bump is one
+`UPDATE ... SET version = version + 1`, and all versions a response depends
+on are read with one primary-key query.
+
+Recomputations are single-flight: when an entry is missing, one caller
+(across threads and workers) recomputes it. The others are served the
+previous result for the same parameters while that refresh runs, or, if
+there is none, wait a bounded time for the new one before computing it
+themselves.
+
+Data sets:
+    networks  Network rows
+    devices   NetworkDevice rows
+    ratings   NetworkRating and Comment rows (and the rollups derived from them)
+"""
+import hashlib
+import threading
+import time
+from functools import wraps
+from typing import Callable, Dict, Iterable, Tuple
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+from rest_framework import status
+from rest_framework.response import Response
+
+from core.geoip import MISSING
+from core.singleflight import SingleFlight
+
+DATA_SETS = ('networks', 'devices', 'ratings')
+
+
+class ResponseCache:
+    """
+    Cache of computed response data keyed by data versions.
+    """
+    key_prefix = 'response:'
+    counter_names = ('hits', 'stale_hits', 'coalesced', 'misses')
+
+    def __init__(self, ttl: int, stale_ttl: int, wait_timeout: float, flights: SingleFlight,
+                 cache_alias: str = 'default'):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.wait_timeout = wait_timeout
+        self.flights = flights
+        self.cache_alias = cache_alias
+        self._lock = threading.Lock()
+        self._counters = {}
+
+    @property
+    def backend(self):
+        return caches[self.cache_alias]
+
+    def _count(self, namespace: str, counter: str):
+        with self._lock:
+            counters = self._counters.setdefault(namespace, dict.fromkeys(self.counter_names, 0))
+            counters[counter] += 1
+
+    def stamps(self, data_sets: Iterable[str]) -> Tuple[Tuple, float]:
+        """
+        Current version of each data set, in order, and the time the most
+        recently changed of them changed, from a single query.
+        """
+        DataVersion = _data_version_model()
+        data_sets = list(data_sets)
+        rows = {name: (version, modified) for name, version, modified in DataVersion.objects.filter(
+            name__in=data_sets).values_list('name', 'version', 'modified_at')}
+        if len(rows) < len(set(data_sets)):
+            self._create_counters(name for name in data_sets if name not in rows)
+            return self.stamps(data_sets)
+        versions = tuple(rows[name][0] for name in data_sets)
+        return versions, max((rows[name][1] for name in data_sets), default=0.0)
+
+    def _create_counters(self, data_sets: Iterable[str]):
+        """
+        Start missing counters from the current time, so a counter never
+        falls back to a version that may still have entries cached (e.g.
+        after the table was emptied).
+        """
+        DataVersion = _data_version_model()
+        now = time.time()
+        DataVersion.objects.bulk_create(
+            [DataVersion(name=name, version=time.time_ns(), modified_at=now) for name in data_sets],
+            ignore_conflicts=True,
+        )
+
+    def versions(self, data_sets: Iterable[str]) -> Tuple:
+        """Current version of each data set, in order"""
+        return self.stamps(data_sets)[0]
+
+    def bump(self, *data_sets: str):
+        """Move every response depending on `data_sets` onto fresh keys"""
+        DataVersion = _data_version_model()
+        for name in data_sets:
+            bumped = DataVersion.objects.filter(name=name)
+            if not bumped.update(version=F('version') + 1, modified_at=time.time()):
+                self._create_counters([name])
+                bumped.update(version=F('version') + 1, modified_at=time.time())
+
+    def bump_on_commit(self, *data_sets: str):
+        """
+        Bump once the current transaction commits (immediately outside one),
+        so no reader can cache pre-commit data under the new version.
+        """
+        transaction.on_commit(lambda: self.bump(*data_sets))
+
+    def make_keys(self, namespace: str, params: Dict, versions: Iterable) -> Tuple[str, str]:
+        """
+        Cache keys for `params`: at the given data versions, and regardless
+        of versions (holding the latest result, served while refreshing)
+        """
+        digest = params_digest(params)
+        versions = '.'.join(str(version) for version in versions)
+        return f'{self.key_prefix}{namespace}:{versions}:{digest}', f'{self.key_prefix}{namespace}:latest:{digest}'
+
+    def _get(self, key: str):
+        entry = self.backend.get(key)
+        # Entries cached before they carried their versions are recomputed
+        return MISSING if entry is None or 'versions' not in entry else entry
+
+    def get_or_compute(self, namespace: str, params: Dict, data_sets: Iterable[str], compute: Callable):
+        """
+        Cached result of `compute()` for `params` at the current data versions.
+
+        Args:
+            namespace: Name of the endpoint or function being cached
+            params: Everything the result depends on besides the data
+            data_sets: Data sets the result is computed from
+            compute: Called on a miss; must return a picklable value
+
+        Returns:
+            The cached or freshly computed value
+        """
+        return self.get_or_compute_entry(namespace, params, data_sets, compute)['value']
+
+    def get_or_compute_entry(self, namespace: str, params: Dict, data_sets: Iterable[str], compute: Callable) -> Dict:
+        """
+        As `get_or_compute`, but returns the cache entry: a dict with the
+        `value`, the `versions` of the data sets (by name) it was computed at
+        and the time they were `modified`. A stale entry served while another
+        caller refreshes it carries its own, older, versions.
+        """
+        data_sets = tuple(data_sets)
+        versions, modified = self.stamps(data_sets)
+        key, latest_key = self.make_keys(namespace, params, versions)
+        entry = self._get(key)
+        if entry is not MISSING:
+            self._count(namespace, 'hits')
+            return entry
+
+        stamps = {'versions': dict(zip(data_sets, versions)), 'modified': modified}
+        token = self.flights.acquire(key)
+        if token is None:
+            # Someone else is refreshing this entry
+            entry = self._get(latest_key)
+            if entry is not MISSING:
+                self._count(namespace, 'stale_hits')
+                return entry
+            entry = self.flights.wait(key, self.wait_timeout, lambda: self._get(key))
+            if entry is not MISSING:
+                self._count(namespace, 'coalesced')
+                return entry
+            # Waited long enough; compute it here as well
+            self._count(namespace, 'misses')
+            return self._compute(key, latest_key, compute, stamps)
+
+        try:
+            entry = self._get(key)
+            if entry is not MISSING:
+                self._count(namespace, 'hits')
+                return entry
+            self._count(namespace, 'misses')
+            return self._compute(key, latest_key, compute, stamps)
+        finally:
+            self.flights.release(key, token)
+
+    def _compute(self, key: str, latest_key: str, compute: Callable, stamps: Dict) -> Dict:
+        entry = {'value': compute(), **stamps}
+        self.backend.set(key, entry, self.ttl)
+        self.backend.set(latest_key, entry, self.stale_ttl)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+
+    def stats(self) -> Dict:
+        """
+        Hit/miss counters and hit ratios for this process, overall and per endpoint.
+
+        Stale hits (served during a refresh) and coalesced requests (which
+        waited for another caller's computation) count as hits.
+        """
+        with self._lock:
+            endpoints = {namespace: dict(counters) for namespace, counters in self._counters.items()}
+        overall = {
+            name: sum(counters[name] for counters in endpoints.values())
+            for name in self.counter_names
+        }
+        for counters in [overall, *endpoints.values()]:
+            lookups = sum(counters[name] for name in self.counter_names)
+            counters['lookups'] = lookups
+            counters['hit_ratio'] = round((lookups - counters['misses']) / lookups, 4) if lookups else 0.0
+        return {**overall, 'endpoints': endpoints}
+
+
+response_cache = ResponseCache(
+    ttl=settings.RESPONSE_CACHE_TTL,
+    stale_ttl=settings.RESPONSE_CACHE_STALE_TTL,
+    wait_timeout=settings.RESPONSE_CACHE_WAIT_TIMEOUT,
+    flights=SingleFlight(
+        lock_timeout=settings.RESPONSE_CACHE_LOCK_TIMEOUT,
+        poll_interval=settings.RESPONSE_CACHE_POLL_INTERVAL,
+        cache_alias=settings.RESPONSE_CACHE_ALIAS,
+    ),
+    cache_alias=settings.RESPONSE_CACHE_ALIAS,
+)
+
+
+def params_digest(params: Dict) -> str:
+    """Hash of request parameters, independent of their order"""
+    normalized = urlencode(sorted(
+        (str(name), str(value)) for name, values in params.items()
+        for value in (values if isinstance(values, (list, tuple)) else [values])
+    ))
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+
+def request_params(request, url_kwargs: Dict, per_user: bool = False) -> Dict:
+    """
+    Everything besides the data that a response to `request` depends on:
+    URL arguments, query parameters and the host (responses may contain
+    absolute URLs), plus the user if `per_user`.
+    """
+    params = {f'url:{name}': value for name, value in url_kwargs.items()}
+    params.update({name: request.GET.getlist(name) for name in request.GET})
+    params['host:'] = request.build_absolute_uri('/')
+    if per_user:
+        params['user:'] = request.user.pk if request.user.is_authenticated else ''
+    return params
+
+
+def cache_response(namespace: str, data_sets: Iterable[str], per_user: bool = False):
+    """
+    Cache the data of successful responses of an APIView `get` method.
+
+    The key covers the parameters from `request_params`. Only 200
+    responses are cached. The response carries the data versions of the
+    entry served as `data_stamps`.
+
+    Args:
+        namespace: Name of the endpoint
+        data_sets: Data sets the response is computed from
+        per_user: Cache separately for each user, for responses that
+            include per-user fields
+    """
+    data_sets = tuple(data_sets)
+
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            if not settings.RESPONSE_CACHE_ENABLED:
+                return method(view, request, *args, **kwargs)
+
+            params = request_params(request, kwargs, per_user)
+
+            def compute():
+                response = method(view, request, *args, **kwargs)
+                if response.status_code != status.HTTP_200_OK:
+                    raise _Uncacheable(response)
+                return response.data
+
+            try:
+                entry = response_cache.get_or_compute_entry(namespace, params, data_sets, compute)
+            except _Uncacheable as e:
+                return e.response
+            response = Response(entry['value'])
+            # For `conditional_get`: the validators must match the body sent
+            response.data_stamps = {'versions': entry['versions'], 'modified': entry['modified']}
+            return response
+        return wrapper
+    return decorator
+
+
+def _data_version_model():
+    # core.models imports this module, so the model is imported on use
+    from core.models import DataVersion
+    return DataVersion
+
+
+class _Uncacheable(Exception):
+    def __init__(self, response):
+        self.response = response
@@ -0,0 +1,640 @@
+"""
+Incrementally maintained rating rollups.
+
+`NetworkRatingStats` holds, per network, everything the statistics endpoints
+need: the rating count and sum, the 1-5 star histogram, the comment count and
+the time of the latest rating. Every rating and comment write applies its
+delta to the rollup row inside the same transaction, so reads are a single
+primary-key lookup (or join) instead of an aggregate over all ratings.
+
+`NetworkRatingDay` buckets the same rating figures per network and per day,
+so any time window is answered by summing a few hundred small rows.
+
+`UserRatingStats` summarizes the ratings each user has given, for profiles.
+
+`rebuild_network_stats`, `rebuild_daily_buckets` and `rebuild_user_stats`
+recompute the rollups from scratch and report any drift, for backfills and
+as a periodic consistency check.
+"""
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+
+from django.db import transaction
+from django.db.models import Case, Count, F, Max, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from core.models import Comment, Network, NetworkRating, NetworkRatingDay, NetworkRatingStats, UserRatingStats
+
+STARS = range(1, 6)
+DAY_FIELDS = ('rating_count', 'rating_sum', *(f'count_{star}' for star in STARS))
+USER_FIELDS = (
+    'rating_count', 'rating_sum', *(f'count_{star}' for star in STARS),
+    'networks_rated', 'recent_counts', 'last_rated_at',
+)
+STAT_FIELDS = ('rating_count', 'rating_sum', *(f'count_{star}' for star in STARS), 'comment_count', 'last_rated_at')
+
+
+def star_field(rating) -> Optional[str]:
+    """
+    Histogram column counting `rating`.
+
+    Only whole-star ratings are bucketed, matching a `rating=<star>` filter.
+
+    Returns:
+        Column name, or None for fractional ratings
+    """
+    value = Decimal(str(rating))
+    if value == value.to_integral_value() and 1 <= value <= 5:
+        return f'count_{int(value)}'
+    return None
+
+
+def stats_for(network: Network) -> NetworkRatingStats:
+    """
+    The rollup of a network, or an empty unsaved one if it has none yet.
+    """
+    try:
+        return network.rating_stats
+    except NetworkRatingStats.DoesNotExist:
+        return NetworkRatingStats(network=network)
+
+
+def apply_network_delta(network_id: int, ratings: int = 0, rating_sum=0, stars: Dict[str, int] = None,
+                        comments: int = 0, last_rated_at=None, create: bool = True):
+    """
+    Add a delta to a network's rollup with a single UPDATE.
+
+    Args:
+        network_id: ID of the network
+        ratings: Change in the number of ratings
+        rating_sum: Change in the sum of rating values
+        stars: Change per histogram column, e.g. {'count_4': 1}
+        comments: Change in the number of comments
+        last_rated_at: Creation time of an added rating; kept if newer
+        create: Create the rollup row if missing. Deletions pass False so a
+            network being deleted doesn't get its row recreated.
+    """
+    updates = _rating_updates(ratings, rating_sum, stars)
+    if comments:
+        updates['comment_count'] = F('comment_count') + comments
+    if last_rated_at is not None:
+        updates['last_rated_at'] = Case(
+            When(Q(last_rated_at__isnull=True) | Q(last_rated_at__lt=last_rated_at), then=Value(last_rated_at)),
+            default=F('last_rated_at'),
+        )
+    if not updates:
+        return
+
+    if create:
+        NetworkRatingStats.objects.get_or_create(network_id=network_id)
+    NetworkRatingStats.objects.filter(pk=network_id).update(**updates)
+
+
+def apply_day_delta(network_id: int, day: date, ratings: int = 0, rating_sum=0, stars: Dict[str, int] = None,
+                    create: bool = True):
+    """
+    Add a delta to a network's bucket for `day` with a single UPDATE.
+
+    Args are as for `apply_network_delta`.
+    """
+    updates = _rating_updates(ratings, rating_sum, stars)
+    if not updates:
+        return
+
+    if create:
+        NetworkRatingDay.objects.get_or_create(network_id=network_id, day=day)
+    NetworkRatingDay.objects.filter(network_id=network_id, day=day).update(**updates)
+
+
+def add_day_deltas(day_deltas: Dict[tuple, Dict]):
+    """
+    Add deltas to many daily buckets in a fixed number of queries, however
+    many (network, day) pairs there are.
+
+    The buckets are created if missing, locked, and rewritten with one
+    upsert per batch, which is much cheaper than an UPDATE per bucket when
+    a write spans many days (e.g. an import of historical ratings).
+
+    Args:
+        day_deltas: Deltas (as for `apply_day_delta`) by (network ID, day)
+    """
+    if not day_deltas:
+        return
+    network_ids = {network_id for network_id, _ in day_deltas}
+    days = {day for _, day in day_deltas}
+    NetworkRatingDay.objects.bulk_create(
+        [NetworkRatingDay(network_id=network_id, day=day) for network_id, day in day_deltas],
+        ignore_conflicts=True,
+    )
+    buckets = [
+        bucket for bucket in NetworkRatingDay.objects.select_for_update()
+        .filter(network_id__in=network_ids, day__in=days).order_by('pk')
+        if (bucket.network_id, bucket.day) in day_deltas
+    ]
+    for bucket in buckets:
+        delta = day_deltas[bucket.network_id, bucket.day]
+        bucket.rating_count += delta.get('ratings', 0)
+        bucket.rating_sum += Decimal(str(delta.get('rating_sum', 0)))
+        for field, count in (delta.get('stars') or {}).items():
+            setattr(bucket, field, getattr(bucket, field) + count)
+    NetworkRatingDay.objects.bulk_create(
+        buckets, update_conflicts=True, unique_fields=['network', 'day'], update_fields=DAY_FIELDS, batch_size=500,
+    )
+
+
+def _rating_updates(ratings: int, rating_sum, stars: Dict[str, int]) -> Dict:
+    updates = {}
+    if ratings:
+        updates['rating_count'] = F('rating_count') + ratings
+    if rating_sum:
+        updates['rating_sum'] = F('rating_sum') + Decimal(str(rating_sum))
+    for field, delta in (stars or {}).items():
+        if delta:
+            updates[field] = F(field) + delta
+    return updates
+
+
+def rating_day(created_at) -> date:
+    """The bucket day of a rating created at `created_at`"""
+    return timezone.localdate(created_at)
+
+
+def refresh_last_rated_at(network_ids: Iterable[int]):
+    """Recompute `last_rated_at` after ratings were removed from the networks"""
+    latest = (
+        NetworkRating.objects
+        .filter(network_id=OuterRef('pk'))
+        .order_by('-created_at')
+        .values('created_at')[:1]
+    )
+    NetworkRatingStats.objects.filter(pk__in=list(network_ids)).update(last_rated_at=Subquery(latest))
+
+
+def record_ratings(ratings: Iterable[NetworkRating], sign: int = 1):
+    """
+    Apply added (`sign=1`) or removed (`sign=-1`) ratings to their networks'
+    rollups and daily buckets, with one UPDATE per network and per day touched.
+
+    Ratings without a network only count towards their users' summaries.
+    """
+    deltas = defaultdict(lambda: {'ratings': 0, 'rating_sum': Decimal(0), 'stars': defaultdict(int), 'last_rated_at': None})
+    day_deltas = defaultdict(lambda: {'ratings': 0, 'rating_sum': Decimal(0), 'stars': defaultdict(int)})
+    for rating in ratings:
+        if rating.network_id is None:
+            continue
+        value = sign * Decimal(str(rating.rating))
+        field = star_field(rating.rating)
+        targets = [deltas[rating.network_id]]
+        if rating.created_at:
+            targets.append(day_deltas[rating.network_id, rating_day(rating.created_at)])
+        for delta in targets:
+            delta['ratings'] += sign
+            delta['rating_sum'] += value
+            if field:
+                delta['stars'][field] += sign
+        delta = deltas[rating.network_id]
+        if sign > 0 and rating.created_at and (
+            delta['last_rated_at'] is None or rating.created_at > delta['last_rated_at']
+        ):
+            delta['last_rated_at'] = rating.created_at
+
+    for network_id, delta in deltas.items():
+        apply_network_delta(network_id, create=sign > 0, **delta)
+    if sign > 0:
+        add_day_deltas(day_deltas)
+    else:
+        for (network_id, day), delta in day_deltas.items():
+            apply_day_delta(network_id, day, create=False, **delta)
+    if sign < 0 and deltas:
+        refresh_last_rated_at(deltas)
+
+    by_user = defaultdict(list)
+    for rating in ratings:
+        if rating.user_id is not None:
+            by_user[rating.user_id].append(rating)
+    if sign > 0:
+        add_user_ratings(by_user)
+        return
+    for user_id, user_ratings in by_user.items():
+        apply_user_ratings(user_id, user_ratings, sign)
+
+
+def _locked_user_stats(user_id: int, create: bool) -> Optional[UserRatingStats]:
+    stats = UserRatingStats.objects.select_for_update()
+    if create:
+        return stats.get_or_create(user_id=user_id)[0]
+    # Don't recreate the summary of a user being deleted
+    return stats.filter(pk=user_id).first()
+
+
+def _recent_since(today: date = None) -> str:
+    today = today or timezone.localdate()
+    return (today - timedelta(days=UserRatingStats.RECENT_DAYS - 1)).isoformat()
+
+
+def _count_user_ratings(stats: UserRatingStats, ratings: List[NetworkRating], sign: int, since: str):
+    """Apply ratings to the counters, histogram and recent activity of a summary"""
+    recent_counts = dict(stats.recent_counts)
+    for rating in ratings:
+        stats.rating_count += sign
+        stats.rating_sum += sign * Decimal(str(rating.rating))
+        field = star_field(rating.rating)
+        if field:
+            setattr(stats, field, getattr(stats, field) + sign)
+        if rating.created_at:
+            day = rating_day(rating.created_at).isoformat()
+            if day >= since:
+                recent_counts[day] = recent_counts.get(day, 0) + sign
+            if sign > 0 and (stats.last_rated_at is None or rating.created_at > stats.last_rated_at):
+                stats.last_rated_at = rating.created_at
+    stats.recent_counts = {day: count for day, count in recent_counts.items() if day >= since and count > 0}
+
+
+def add_user_ratings(ratings_by_user: Dict[int, List[NetworkRating]]):
+    """
+    Apply added ratings to their users' summaries, in a fixed number of
+    queries however many users and ratings there are.
+
+    The summary rows are locked and rewritten, since the recent-activity
+    counter and the distinct-network count can't be expressed as plain
+    increments. Must be called after the ratings were written.
+    """
+    if not ratings_by_user:
+        return
+    user_ids = list(ratings_by_user)
+    UserRatingStats.objects.bulk_create([UserRatingStats(user_id=user_id) for user_id in user_ids], ignore_conflicts=True)
+    summaries = list(UserRatingStats.objects.select_for_update().filter(pk__in=user_ids).order_by('pk'))
+
+    # A network is newly rated by a user if all of their ratings of it were
+    # just added.
+    added = defaultdict(lambda: defaultdict(int))
+    for user_id, ratings in ratings_by_user.items():
+        for rating in ratings:
+            added[user_id][rating.network_id] += 1
+    existing = {
+        (row['user_id'], row['network_id']): row['total']
+        for row in NetworkRating.objects
+        .filter(user_id__in=user_ids, network_id__in={rating.network_id for ratings in ratings_by_user.values() for rating in ratings})
+        .order_by()
+        .values('user_id', 'network_id')
+        .annotate(total=Count('id'))
+    }
+
+    since = _recent_since()
+    for stats in summaries:
+        _count_user_ratings(stats, ratings_by_user[stats.user_id], 1, since)
+        stats.networks_rated += sum(
+            1 for network_id, count in added[stats.user_id].items()
+            if existing.get((stats.user_id, network_id)) == count
+        )
+    # An upsert rather than bulk_update(), whose CASE per row and column
+    # grows quadratically with the batch
+    UserRatingStats.objects.bulk_create(
+        summaries, update_conflicts=True, unique_fields=['user'], update_fields=USER_FIELDS, batch_size=500,
+    )
+
+
+def apply_user_ratings(user_id: int, ratings: List[NetworkRating], sign: int = 1):
+    """
+    Apply added (`sign=1`) or removed (`sign=-1`) ratings of one user to their
+    summary. See `add_user_ratings`.
+    """
+    if sign > 0:
+        add_user_ratings({user_id: ratings})
+        return
+
+    stats = _locked_user_stats(user_id, create=False)
+    if stats is None:
+        return
+    _count_user_ratings(stats, ratings, sign, _recent_since())
+    # Cascades delete all of a user's ratings before any post_delete
+    # handler runs, so recount rather than decrement.
+    remaining = NetworkRating.objects.filter(user_id=user_id).aggregate(
+        networks_rated=Count('network_id', distinct=True),
+        last_rated_at=Max('created_at'),
+    )
+    stats.networks_rated = remaining['networks_rated']
+    stats.last_rated_at = remaining['last_rated_at']
+    stats.save(update_fields=USER_FIELDS)
+
+
+def apply_user_rating_change(user_id: int, old_rating, new_rating):
+    """Replace one rating value by another in a user's summary"""
+    stats = _locked_user_stats(user_id, create=True)
+    stats.rating_sum += Decimal(str(new_rating)) - Decimal(str(old_rating))
+    old_field, new_field = star_field(old_rating), star_field(new_rating)
+    if old_field:
+        setattr(stats, old_field, getattr(stats, old_field) - 1)
+    if new_field:
+        setattr(stats, new_field, getattr(stats, new_field) + 1)
+    stats.save(update_fields=USER_FIELDS)
+
+
+def record_rating_change(rating: NetworkRating, old_network_id: int, old_rating, old_user_id: int):
+    """
+    Move a rating's contribution when its value, network or user changed.
+    """
+    if old_network_id == rating.network_id and old_user_id == rating.user_id:
+        old_field, new_field = star_field(old_rating), star_field(rating.rating)
+        stars = defaultdict(int)
+        if old_field:
+            stars[old_field] -= 1
+        if new_field:
+            stars[new_field] += 1
+        delta = {
+            'rating_sum': Decimal(str(rating.rating)) - Decimal(str(old_rating)),
+            'stars': stars,
+        }
+        if rating.network_id is not None:
+            apply_network_delta(rating.network_id, **delta)
+            apply_day_delta(rating.network_id, rating_day(rating.created_at), **delta)
+        apply_user_rating_change(rating.user_id, old_rating, rating.rating)
+        return
+
+    old = NetworkRating(network_id=old_network_id, user_id=old_user_id, rating=old_rating, created_at=rating.created_at)
+    # Add before removing: a removal recounts the user's rated networks from
+    # the rows as they are now, which already include the moved rating
+    record_ratings([rating])
+    record_ratings([old], sign=-1)
+    comments = Comment.objects.filter(network_rating_id=rating.pk).count() if old_network_id != rating.network_id else 0
+    if comments and old_network_id is not None:
+        apply_network_delta(old_network_id, comments=-comments, create=False)
+    if comments and rating.network_id is not None:
+        apply_network_delta(rating.network_id, comments=comments)
+
+
+def network_id_of_rating(rating_id: int) -> Optional[int]:
+    return NetworkRating.objects.filter(pk=rating_id).values_list('network_id', flat=True).first()
+
+
+def record_comment(comment: Comment, sign: int = 1, network_rating_id: int = None):
+    """
+    Count an added (`sign=1`) or removed (`sign=-1`) comment against the
+    network of the rating it was left on.
+    """
+    network_rating_id = network_rating_id if network_rating_id is not None else comment.network_rating_id
+    if network_rating_id is None:
+        return
+    network_id = network_id_of_rating(network_rating_id)
+    if network_id is not None:
+        apply_network_delta(network_id, comments=sign, create=sign > 0)
+
+
+def compute_network_stats() -> Dict[int, Dict]:
+    """
+    Rollup values computed from the ratings and comments tables.
+
+    Returns:
+        Dictionary mapping network ID to a dict of NetworkRatingStats values,
+        for every network
+    """
+    empty = {field: 0 for field in STAT_FIELDS}
+    empty['rating_sum'] = Decimal(0)
+    empty['last_rated_at'] = None
+    expected = {network_id: dict(empty) for network_id in Network.objects.values_list('id', flat=True)}
+
+    ratings = (
+        NetworkRating.objects
+        .filter(network__isnull=False)
+        .order_by()
+        .values('network_id')
+        .annotate(
+            rating_count=Count('id'),
+            rating_sum=Sum('rating'),
+            last_rated_at=Max('created_at'),
+            **{f'count_{star}': Count('id', filter=Q(rating=star)) for star in STARS},
+        )
+    )
+    for row in ratings:
+        network_id = row.pop('network_id')
+        row['rating_sum'] = Decimal(str(row['rating_sum'] or 0)).quantize(Decimal('0.1'))
+        expected.setdefault(network_id, dict(empty)).update(row)
+
+    comments = (
+        Comment.objects
+        .filter(network_rating__network__isnull=False)
+        .order_by()
+        .values('network_rating__network_id')
+        .annotate(total=Count('id'))
+    )
+    for row in comments:
+        expected.setdefault(row['network_rating__network_id'], dict(empty))['comment_count'] = row['total']
+    return expected
+
+
+def rebuild_network_stats(dry_run: bool = False) -> List[Dict]:
+    """
+    Recompute every network's rollup and fix the rows that drifted.
+
+    Args:
+        dry_run: Only report drift, don't write
+
+    Returns:
+        List of drifted rollups as dicts with `network_id` and, per differing
+        field, a (stored, expected) tuple
+    """
+    with transaction.atomic():
+        expected = compute_network_stats()
+        stored = {
+            stats.network_id: stats
+            for stats in NetworkRatingStats.objects.select_for_update()
+        }
+
+        drift = []
+        to_create, to_update = [], []
+        for network_id, values in expected.items():
+            stats = stored.get(network_id)
+            current = {field: getattr(stats, field) for field in STAT_FIELDS} if stats else None
+            differences = {
+                field: (current[field] if current else None, value)
+                for field, value in values.items()
+                if (current[field] if current else _empty_value(field)) != value
+            }
+            if differences:
+                drift.append({'network_id': network_id, **differences})
+            if stats is None:
+                to_create.append(NetworkRatingStats(network_id=network_id, **values))
+            elif differences:
+                for field, value in values.items():
+                    setattr(stats, field, value)
+                to_update.append(stats)
+
+        if not dry_run:
+            NetworkRatingStats.objects.bulk_create(to_create, batch_size=500)
+            NetworkRatingStats.objects.bulk_update(to_update, STAT_FIELDS, batch_size=500)
+    return drift
+
+
+def compute_daily_buckets(since: date = None) -> Dict[tuple, Dict]:
+    """
+    Daily bucket values computed from the ratings table.
+
+    Args:
+        since: Only compute buckets from this day on
+
+    Returns:
+        Dictionary mapping (network ID, day) to a dict of NetworkRatingDay values
+    """
+    ratings = NetworkRating.objects.filter(network__isnull=False).order_by()
+    if since is not None:
+        ratings = ratings.filter(created_at__date__gte=since)
+    rows = (
+        ratings
+        .annotate(day=TruncDate('created_at'))
+        .values('network_id', 'day')
+        .annotate(
+            rating_count=Count('id'),
+            rating_sum=Sum('rating'),
+            **{f'count_{star}': Count('id', filter=Q(rating=star)) for star in STARS},
+        )
+    )
+    expected = {}
+    for row in rows:
+        key = (row.pop('network_id'), row.pop('day'))
+        row['rating_sum'] = Decimal(str(row['rating_sum'] or 0)).quantize(Decimal('0.1'))
+        expected[key] = row
+    return expected
+
+
+def rebuild_daily_buckets(dry_run: bool = False, since: date = None) -> List[Dict]:
+    """
+    Recompute the daily buckets from the ratings and fix the ones that drifted.
+
+    Also backfills the buckets of ratings created before they were maintained.
+
+    Args:
+        dry_run: Only report drift, don't write
+        since: Only rebuild buckets from this day on
+
+    Returns:
+        List of drifted buckets as dicts with `network_id`, `day` and, per
+        differing field, a (stored, expected) tuple
+    """
+    with transaction.atomic():
+        expected = compute_daily_buckets(since)
+        buckets = NetworkRatingDay.objects.select_for_update()
+        if since is not None:
+            buckets = buckets.filter(day__gte=since)
+        stored = {(bucket.network_id, bucket.day): bucket for bucket in buckets}
+
+        drift = []
+        to_create, to_update, to_delete = [], [], []
+        for key in expected.keys() | stored.keys():
+            values = expected.get(key, {field: _empty_value(field) for field in DAY_FIELDS})
+            bucket = stored.get(key)
+            differences = {
+                field: (getattr(bucket, field) if bucket else None, value)
+                for field, value in values.items()
+                if (getattr(bucket, field) if bucket else _empty_value(field)) != value
+            }
+            if differences:
+                drift.append({'network_id': key[0], 'day': key[1], **differences})
+            if key not in expected:
+                to_delete.append(bucket.pk)
+            elif bucket is None:
+                to_create.append(NetworkRatingDay(network_id=key[0], day=key[1], **values))
+            elif differences:
+                for field, value in values.items():
+                    setattr(bucket, field, value)
+                to_update.append(bucket)
+
+        if not dry_run:
+            NetworkRatingDay.objects.filter(pk__in=to_delete).delete()
+            NetworkRatingDay.objects.bulk_create(to_create, batch_size=500)
+            NetworkRatingDay.objects.bulk_update(to_update, DAY_FIELDS, batch_size=500)
+    return drift
+
+
+def compute_user_stats(today: date = None) -> Dict[int, Dict]:
+    """
+    User summary values computed from the ratings table.
+
+    Returns:
+        Dictionary mapping the ID of every user with ratings to a dict of
+        UserRatingStats values
+    """
+    rows = (
+        NetworkRating.objects
+        .order_by()
+        .values('user_id')
+        .annotate(
+            rating_count=Count('id'),
+            rating_sum=Sum('rating'),
+            networks_rated=Count('network_id', distinct=True),
+            last_rated_at=Max('created_at'),
+            **{f'count_{star}': Count('id', filter=Q(rating=star)) for star in STARS},
+        )
+    )
+    expected = {}
+    for row in rows:
+        user_id = row.pop('user_id')
+        row['rating_sum'] = Decimal(str(row['rating_sum'] or 0)).quantize(Decimal('0.1'))
+        row['recent_counts'] = {}
+        expected[user_id] = row
+
+    recent = (
+        NetworkRating.objects
+        .order_by()
+        .annotate(day=TruncDate('created_at'))
+        .filter(day__gte=date.fromisoformat(_recent_since(today)))
+        .values('user_id', 'day')
+        .annotate(total=Count('id'))
+    )
+    for row in recent:
+        expected[row['user_id']]['recent_counts'][row['day'].isoformat()] = row['total']
+    return expected
+
+
+def rebuild_user_stats(dry_run: bool = False) -> List[Dict]:
+    """
+    Recompute every user's summary and fix the ones that drifted.
+
+    Args:
+        dry_run: Only report drift, don't write
+
+    Returns:
+        List of drifted summaries as dicts with `user_id` and, per differing
+        field, a (stored, expected) tuple
+    """
+    with transaction.atomic():
+        expected = compute_user_stats()
+        stored = {stats.user_id: stats for stats in UserRatingStats.objects.select_for_update()}
+        since = _recent_since()
+        for stats in stored.values():
+            # Days that fell out of the window are only pruned on write
+            stats.recent_counts = {day: count for day, count in stats.recent_counts.items() if day >= since}
+
+        drift = []
+        to_create, to_update = [], []
+        for user_id in expected.keys() | stored.keys():
+            values = expected.get(user_id) or {field: _empty_value(field) for field in USER_FIELDS}
+            stats = stored.get(user_id)
+            differences = {
+                field: (getattr(stats, field) if stats else None, value)
+                for field, value in values.items()
+                if (getattr(stats, field) if stats else _empty_value(field)) != value
+            }
+            if differences:
+                drift.append({'user_id': user_id, **differences})
+            if stats is None:
+                to_create.append(UserRatingStats(user_id=user_id, **values))
+            elif differences:
+                for field, value in values.items():
+                    setattr(stats, field, value)
+                to_update.append(stats)
+
+        if not dry_run:
+            UserRatingStats.objects.bulk_create(to_create, batch_size=500)
+            UserRatingStats.objects.bulk_update(to_update, USER_FIELDS, batch_size=500)
+    return drift
+
+
+def _empty_value(field):
+    if field == 'last_rated_at':
+        return None
+    if field == 'recent_counts':
+        return {}
+    return Decimal(0) if field == 'rating_sum' else 0
@@ -0,0 +1,262 @@
+"""
+Full-text search over ratings.
+
+Each rating is indexed by its network's name, its review and its address
+(weighted in that order). The index lives in the database and is kept in
+sync by triggers, so every write path (model saves, `bulk_create`, queryset
+updates and deletes, network renames) updates it in the same transaction:
+
+    PostgreSQL  a `search_document` tsvector column on the ratings table,
+                with a GIN index
+    SQLite      an FTS5 table keyed by rating ID
+
+Both use the 'simple' configuration (lowercased words, no stemming) and
+match every search term as a prefix, so the two backends return the same
+ratings for the same query. Other backends fall back to `icontains`.
+
+The index is created by migrations (core/migrations/0015_rating_search_index.py);
+this module only queries it, reindexes, and on SQLite takes the triggers
+out of the way of `migrate`.
+
+Callers only use `search_ratings`, which filters a ratings queryset and
+annotates a `search_rank` (higher is better) regardless of the backend.
+"""
+import re
+from typing import List
+
+from django.db import connections
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+MAX_TERMS = 8
+
+_TERM = re.compile(r'[^\W_]+')
+
+
+def search_terms(text: str) -> List[str]:
+    """Lowercased words of a search query, at most `MAX_TERMS`"""
+    return _TERM.findall(text.lower())[:MAX_TERMS]
+
+
+class FallbackSearch:
+    """
+    Unindexed substring search, for backends without a full-text index.
+
+    Like the indexed backends, a rating must match every term (anywhere in
+    a word rather than as a prefix); results are not ranked.
+    """
+    vendor = None
+
+    def installed(self, connection) -> bool:
+        return False
+
+    def suspended(self, connection) -> bool:
+        return False
+
+    def rebuild(self, connection):
+        pass
+
+    def suspend(self, connection):
+        pass
+
+    def resume(self, connection):
+        pass
+
+    def search(self, queryset, terms: List[str]):
+        condition = Q()
+        for term in terms:
+            condition &= (
+                Q(review__icontains=term) | Q(network__name__icontains=term) | Q(address__icontains=term)
+            )
+        return queryset.filter(condition).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+class PostgresSearch:
+    """
+    tsvector column with a GIN index, filled by a trigger on insert and update.
+
+    The column, triggers and the `core_networkrating_search_document`
+    function are created by migrations.
+    """
+    vendor = 'postgresql'
+
+    rebuild_sql = [
+        "UPDATE core_networkrating SET search_document = core_networkrating_search_document(review, address, network_id)",
+    ]
+
+    def installed(self, connection) -> bool:
+        with connection.cursor() as cursor:
+            columns = connection.introspection.get_table_description(cursor, 'core_networkrating')
+        return any(column.name == 'search_document' for column in columns)
+
+    def suspended(self, connection) -> bool:
+        return False
+
+    def rebuild(self, connection):
+        _execute(connection, self.rebuild_sql)
+
+    def suspend(self, connection):
+        pass
+
+    def resume(self, connection):
+        # Triggers survive migrations here
+        pass
+
+    def search(self, queryset, terms: List[str]):
+        query = ' & '.join(f'{term}:*' for term in terms)
+        return queryset.filter(RawSQL(
+            "core_networkrating.search_document @@ to_tsquery('simple', %s)", [query],
+            output_field=BooleanField(),
+        )).annotate(search_rank=RawSQL(
+            # float8, so the rank round-trips exactly through pagination cursors
+            "ts_rank(core_networkrating.search_document, to_tsquery('simple', %s))::double precision", [query],
+            output_field=FloatField(),
+        ))
+
+
+class SQLiteSearch:
+    """
+    FTS5 table keyed by rating ID, maintained by triggers on both tables.
+
+    Migrations rebuild SQLite tables to alter them, which fails while a
+    trigger on another table refers to the rebuilt one. The triggers are
+    therefore dropped before `migrate` applies migrations of this app and
+    put back, with a full reindex, once it is done (see core/signals.py).
+    """
+    vendor = 'sqlite'
+
+    trigger_sql = [
+        """
+        CREATE TRIGGER IF NOT EXISTS core_networkrating_fts_insert AFTER INSERT ON core_networkrating BEGIN
+            INSERT INTO core_networkrating_fts (rowid, network_name, review, address)
+            VALUES (new.id, (SELECT name FROM core_network WHERE id = new.network_id), new.review, new.address);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS core_networkrating_fts_update
+        AFTER UPDATE OF review, address, network_id ON core_networkrating BEGIN
+            UPDATE core_networkrating_fts
+            SET network_name = (SELECT name FROM core_network WHERE id = new.network_id),
+                review = new.review,
+                address = new.address
+            WHERE rowid = new.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS core_networkrating_fts_delete AFTER DELETE ON core_networkrating BEGIN
+            DELETE FROM core_networkrating_fts WHERE rowid = old.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS core_network_fts_update
+        AFTER UPDATE OF name ON core_network WHEN old.name IS NOT new.name BEGIN
+            UPDATE core_networkrating_fts SET network_name = new.name
+            WHERE rowid IN (SELECT id FROM core_networkrating WHERE network_id = new.id);
+        END
+        """,
+    ]
+    trigger_names = [
+        'core_network_fts_update',
+        'core_networkrating_fts_delete',
+        'core_networkrating_fts_update',
+        'core_networkrating_fts_insert',
+    ]
+    drop_triggers_sql = [f"DROP TRIGGER IF EXISTS {name}" for name in trigger_names]
+    rebuild_sql = [
+        "DELETE FROM core_networkrating_fts",
+        """
+        INSERT INTO core_networkrating_fts (rowid, network_name, review, address)
+        SELECT rating.id, network.name, rating.review, rating.address
+        FROM core_networkrating rating LEFT JOIN core_network network ON network.id = rating.network_id
+        """,
+    ]
+
+    def installed(self, connection) -> bool:
+        with connection.cursor() as cursor:
+            return 'core_networkrating_fts' in connection.introspection.table_names(cursor)
+
+    def suspended(self, connection) -> bool:
+        """Whether triggers are missing, e.g. after an interrupted `migrate`"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name IN (%s)"
+                % ', '.join(['%s'] * len(self.trigger_names)),
+                self.trigger_names,
+            )
+            return cursor.fetchone()[0] < len(self.trigger_names)
+
+    def rebuild(self, connection):
+        _execute(connection, self.rebuild_sql)
+
+    def suspend(self, connection):
+        _execute(connection, self.drop_triggers_sql)
+
+    def resume(self, connection):
+        _execute(connection, self.trigger_sql)
+        self.rebuild(connection)
+
+    def search(self, queryset, terms: List[str]):
+        query = ' '.join(f'"{term}"*' for term in terms)
+        # A join rather than a correlated subquery: bm25() gathers its term
+        # statistics once per FTS5 cursor, i.e. once per query
+        return queryset.extra(
+            tables=['core_networkrating_fts'],
+            where=[
+                'core_networkrating_fts.rowid = core_networkrating.id',
+                'core_networkrating_fts MATCH %s',
+            ],
+            params=[query],
+        ).annotate(search_rank=RawSQL(
+            # bm25() is lower for better matches; the column weights follow the
+            # A/B/C weights of the PostgreSQL document
+            "-bm25(core_networkrating_fts, 10.0, 4.0, 1.0)", [], output_field=FloatField(),
+        ))
+
+
+def _execute(connection, statements):
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+BACKENDS = {backend.vendor: backend for backend in (PostgresSearch(), SQLiteSearch())}
+
+# Database alias -> backend in use, resolved once per process (and again
+# after `migrate`, which may have installed or removed the index)
+_active = {}
+
+
+def search_backend(connection):
+    """The full-text backend for a database connection"""
+    return BACKENDS.get(connection.vendor, FallbackSearch())
+
+
+def active_backend(connection):
+    """The backend to search with: the full-text one if its index is installed"""
+    if connection.alias not in _active:
+        backend = search_backend(connection)
+        _active[connection.alias] = backend if backend.installed(connection) else FallbackSearch()
+    return _active[connection.alias]
+
+
+def reset_active_backends():
+    _active.clear()
+
+
+def search_ratings(queryset, text: str, using: str = None):
+    """
+    Ratings matching every word of `text` (as a prefix), ranked.
+
+    Args:
+        queryset: NetworkRating queryset
+        text: Search query as typed by the user
+        using: Database alias (defaults to the queryset's)
+
+    Returns:
+        The filtered queryset, annotated with `search_rank` (higher is a
+        better match). A query without any words matches nothing.
+    """
+    terms = search_terms(text)
+    if not terms:
+        return queryset.none()
+    return active_backend(connections[using or queryset.db]).search(queryset, terms)
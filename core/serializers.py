@@ -1,6 +1,13 @@
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db import IntegrityError
+from django.urls import reverse
+from rest_framework.utils.urls import replace_query_param
 from .models import Network, NetworkDevice, NetworkRating, Comment
+from .pagination import CommentPagination, ReplyPagination
+
+DUPLICATE_RATING_MESSAGE = "You have already rated this network. You can edit your existing rating."
 
 class NetworkSerializer(serializers.ModelSerializer):
     class Meta:
@@ -15,6 +22,7 @@ class NetworkDeviceSerializer(serializers.ModelSerializer):
 
 class NetworkRatingSerializer(serializers.ModelSerializer):
     comments = serializers.SerializerMethodField()
+    more_comments = serializers.SerializerMethodField()
     network =serializers.SerializerMethodField()
     device = NetworkDeviceSerializer(read_only=True)
     network_id = serializers.PrimaryKeyRelatedField(
@@ -44,10 +52,11 @@ class NetworkRatingSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = NetworkRating
-        fields = ['id', 'user', 'network', 'device', 'network_id', 'device_id', 'rating', 'address', 'created_at', 'review', 'comments']
+        fields = ['id', 'user', 'network', 'device', 'network_id', 'device_id', 'rating', 'address', 'created_at', 'review', 'location_pending', 'comments', 'more_comments']
         extra_kwargs = {
             'user': {'read_only': True},
             'created_at': {'read_only': True},
+            'location_pending': {'read_only': True},
         }
 
     def validate_rating(self, value):
@@ -68,23 +77,26 @@ class NetworkRatingSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Cannot rate an inactive network")
         return value
 
-    def validate(self, attrs):
-        """Cross-field validation"""
-        # Check if user already rated this network (optional business rule)
-        user = self.context['request'].user if 'request' in self.context else None
-        network = attrs.get('network')
-        
-        if user and network and self.instance is None:  # Only for creation
-            existing_rating = NetworkRating.objects.filter(user=user, network=network).first()
-            if existing_rating:
-                raise serializers.ValidationError("You have already rated this network. You can edit your existing rating.")
-        
-        return attrs
-
     def get_comments(self, obj):
-        comments = obj.comments.filter(parent=None).order_by('-created_at')
+        comments = getattr(obj, 'top_level_comments', None)
+        if comments is None:
+            comments = obj.comments.filter(parent=None).order_by('-created_at')
         return CommentSerializer(comments, many=True, context=self.context).data
 
+    def get_more_comments(self, obj):
+        """Link to the remaining comments when only the newest few are shown"""
+        if not getattr(obj, 'has_more_comments', False):
+            return None
+        last_comment = obj.top_level_comments[-1]
+        cursor = CommentPagination.encode_position(
+            [getattr(last_comment, field.lstrip('-')) for field in CommentPagination.ordering]
+        )
+        url = replace_query_param(
+            reverse('rating_comments', kwargs={'pk': obj.id}), CommentPagination.cursor_query_param, cursor
+        )
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
     def get_network(self, obj):
         network = obj.network
         return NetworkSerializer(network, context=self.context).data if network else None
@@ -92,7 +104,16 @@ class NetworkRatingSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         # Set user from request context
         validated_data['user'] = self.context['request'].user
-        return NetworkRating.objects.create(**validated_data)
+        # One rating per user and network, enforced by rating_user_network_uniq
+        try:
+            return NetworkRating.objects.create(**validated_data)
+        except IntegrityError:
+            network = validated_data.get('network')
+            if network and NetworkRating.objects.filter(user=validated_data['user'], network=network).exists():
+                raise serializers.ValidationError({
+                    api_settings.NON_FIELD_ERRORS_KEY: [DUPLICATE_RATING_MESSAGE],
+                })
+            raise
 
     def update(self, instance, validated_data):
         # Don't allow changing the network or user
@@ -101,8 +122,62 @@ class NetworkRatingSerializer(serializers.ModelSerializer):
         return super().update(instance, validated_data)
 
 
+class NetworkRatingListSerializer(NetworkRatingSerializer):
+    """Ratings without their comment threads, for long lists"""
+
+    class Meta(NetworkRatingSerializer.Meta):
+        fields = [field for field in NetworkRatingSerializer.Meta.fields if field not in ('comments', 'more_comments')]
+
+
+class NetworkRatingBatchItemSerializer(serializers.Serializer):
+    """
+    One rating of a batch upload.
+
+    Only checks the values themselves; references to networks, devices and
+    users and the one-rating-per-network rule are checked for the whole
+    batch at once by `core.ingest.validate_rating_batch`.
+    """
+    network_id = serializers.IntegerField(help_text="ID of the network being rated")
+    device_id = serializers.IntegerField(required=False, allow_null=True, help_text="ID of the device used (optional)")
+    user_id = serializers.IntegerField(
+        required=False,
+        help_text="Author of the rating (staff only; defaults to the uploader)"
+    )
+    rating = serializers.DecimalField(
+        max_digits=3,
+        decimal_places=1,
+        validators=[MinValueValidator(1.0), MaxValueValidator(5.0)],
+        help_text="Rating between 1.0 and 5.0"
+    )
+    review = serializers.CharField(
+        max_length=1000,
+        min_length=10,
+        help_text="Detailed review (minimum 10 characters)"
+    )
+    address = serializers.CharField(max_length=500, required=False, allow_null=True, allow_blank=True)
+    latitude = serializers.DecimalField(
+        max_digits=9, decimal_places=6, required=False, allow_null=True,
+        validators=[MinValueValidator(-90.0), MaxValueValidator(90.0)],
+    )
+    longitude = serializers.DecimalField(
+        max_digits=9, decimal_places=6, required=False, allow_null=True,
+        validators=[MinValueValidator(-180.0), MaxValueValidator(180.0)],
+    )
+
+    def validate_review(self, value):
+        if len(value.strip()) < 10:
+            raise serializers.ValidationError("Review must be at least 10 characters long")
+        return value.strip()
+
+    def validate(self, attrs):
+        if (attrs.get('latitude') is None) != (attrs.get('longitude') is None):
+            raise serializers.ValidationError("Both latitude and longitude must be provided together")
+        return attrs
+
+
 class CommentSerializer(serializers.ModelSerializer):
     replies = serializers.SerializerMethodField()
+    more_replies = serializers.SerializerMethodField()
     num_likes = serializers.SerializerMethodField()
     liked = serializers.SerializerMethodField()
     username = serializers.CharField(source='user.username', read_only=True)
@@ -114,7 +189,7 @@ class CommentSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Comment
-        fields = ['id', 'user', 'username', 'content', 'network_rating', 'created_at', 'updated_at', 'parent', 'num_likes', 'liked', 'replies']
+        fields = ['id', 'user', 'username', 'content', 'network_rating', 'created_at', 'updated_at', 'parent', 'num_likes', 'liked', 'replies', 'more_replies']
         extra_kwargs = {
             'user': {'read_only': True},
             'created_at': {'read_only': True},
@@ -145,16 +220,33 @@ class CommentSerializer(serializers.ModelSerializer):
         return attrs
 
     def get_replies(self, obj):
-        if obj.parent is None:
-            replies = obj.replies.all().order_by('created_at')
+        if obj.parent_id is None:
+            replies = getattr(obj, 'prefetched_replies', None)
+            if replies is None:
+                replies = obj.replies.all().order_by('created_at')
             return CommentSerializer(replies, many=True, context=self.context).data
         return []
 
+    def get_more_replies(self, obj):
+        """Link to the remaining replies when a thread only shows the first few"""
+        if not getattr(obj, 'has_more_replies', False):
+            return None
+        last_reply = obj.prefetched_replies[-1]
+        cursor = ReplyPagination.encode_position([getattr(last_reply, field) for field in ReplyPagination.ordering])
+        url = replace_query_param(
+            reverse('comment_replies', kwargs={'comment_id': obj.id}), ReplyPagination.cursor_query_param, cursor
+        )
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
     def get_num_likes(self, obj):
-        return obj.total_likes
+        return obj.like_count
 
     def get_liked(self, obj):
-        user = self.context.get('request').user if 'request' in self.context else None
+        liked_ids = self.context.get('liked_comment_ids')
+        if liked_ids is not None:
+            return obj.id in liked_ids
+        user = self.context.get('request').user if self.context.get('request') else None
         if user and user.is_authenticated:
             return obj.likes.filter(id=user.id).exists()
         return False
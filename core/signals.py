@@ -0,0 +1,156 @@
+from django.db import connections
+from django.db.models import DEFERRED, Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_delete, pre_migrate
+from django.dispatch import receiver
+
+from core import rollups
+from core.autocomplete import network_autocomplete
+from core.models import Comment, Network, NetworkDevice, NetworkRating
+from core.response_cache import response_cache
+from core.search import reset_active_backends, search_backend
+
+
+def refresh_like_counts(comment_ids):
+    """Recount `like_count` from the through table for the given comments"""
+    likes = (
+        Comment.likes.through.objects
+        .filter(comment_id=OuterRef('pk'))
+        .order_by()
+        .values('comment_id')
+        .annotate(total=Count('*'))
+        .values('total')
+    )
+    Comment.objects.filter(pk__in=comment_ids).update(like_count=Coalesce(Subquery(likes), 0))
+
+
+@receiver(m2m_changed, sender=Comment.likes.through)
+def sync_like_count(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Keep `Comment.like_count` in step with likes changed through the ORM
+    (`comment.likes.add()`, the admin, ...). `Comment.toggle_like` writes the
+    through table directly and maintains the counter itself.
+    """
+    if action == 'pre_clear' and reverse:
+        # The cleared comments can't be recovered after the fact.
+        instance._cleared_comment_ids = list(
+            sender.objects.filter(user_id=instance.pk).values_list('comment_id', flat=True)
+        )
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        comment_ids = [instance.pk]
+    elif action == 'post_clear':
+        comment_ids = getattr(instance, '_cleared_comment_ids', [])
+    else:
+        comment_ids = list(pk_set or [])
+    if comment_ids:
+        refresh_like_counts(comment_ids)
+        response_cache.bump_on_commit('ratings')
+
+
+@receiver(post_save, sender=NetworkRating)
+def update_rating_stats_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        rollups.record_ratings([instance])
+        return
+    loaded = getattr(instance, '_loaded_values', None)
+    if loaded is None or DEFERRED in loaded.values():
+        return
+    if loaded != instance.tracked_values():
+        rollups.record_rating_change(instance, loaded['network_id'], loaded['rating'], loaded['user_id'])
+
+
+@receiver(post_delete, sender=NetworkRating)
+def update_rating_stats_on_delete(sender, instance, **kwargs):
+    rollups.record_ratings([instance], sign=-1)
+
+
+@receiver(post_save, sender=Comment)
+def update_comment_stats_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        rollups.record_comment(instance)
+        return
+    loaded = getattr(instance, '_loaded_network_rating_id', instance.network_rating_id)
+    if loaded != instance.network_rating_id:
+        rollups.record_comment(instance, sign=-1, network_rating_id=loaded)
+        rollups.record_comment(instance)
+
+
+@receiver(pre_delete, sender=Comment)
+def resolve_comment_network(sender, instance, **kwargs):
+    # A cascade from the rating may delete the rating row before its
+    # comments, so look the network up while both still exist.
+    if instance.network_rating_id is not None:
+        instance._network_id = rollups.network_id_of_rating(instance.network_rating_id)
+
+
+@receiver(post_delete, sender=Comment)
+def update_comment_stats_on_delete(sender, instance, **kwargs):
+    network_id = getattr(instance, '_network_id', None)
+    if network_id is not None:
+        rollups.apply_network_delta(network_id, comments=-1, create=False)
+
+
+DATA_SETS_BY_MODEL = {
+    Network: 'networks',
+    NetworkDevice: 'devices',
+    NetworkRating: 'ratings',
+    Comment: 'ratings',
+}
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def bump_data_version(sender, raw=False, **kwargs):
+    """Invalidate cached responses computed from the changed model"""
+    data_set = DATA_SETS_BY_MODEL.get(sender)
+    if data_set is not None and not raw:
+        response_cache.bump_on_commit(data_set)
+
+
+@receiver(post_save, sender=Network)
+@receiver(post_delete, sender=Network)
+def invalidate_network_autocomplete(sender, **kwargs):
+    network_autocomplete.invalidate_on_commit()
+
+
+def migrates_core(plan) -> bool:
+    """
+    Whether a `migrate` run applies or unapplies migrations of this app.
+    `flush` sends post_migrate without a plan; it empties the tables behind
+    the search index's back, so it counts as a change.
+    """
+    return plan is None or any(migration.app_label == 'core' for migration, _ in plan)
+
+
+@receiver(pre_migrate)
+def suspend_search_triggers(sender, using='default', plan=None, **kwargs):
+    """Take the search index triggers out of the way of table rebuilds"""
+    if sender.name != 'core' or not migrates_core(plan):
+        return
+    connection = connections[using]
+    backend = search_backend(connection)
+    if backend.installed(connection):
+        backend.suspend(connection)
+
+
+@receiver(post_migrate)
+def resume_search_triggers(sender, using='default', plan=None, **kwargs):
+    """
+    Put the search index triggers back, reindexing where they were dropped.
+    A `migrate` with nothing to apply to this app leaves the index alone.
+    """
+    if sender.name != 'core':
+        return
+    connection = connections[using]
+    backend = search_backend(connection)
+    if backend.installed(connection) and (migrates_core(plan) or backend.suspended(connection)):
+        backend.resume(connection)
+    reset_active_backends()
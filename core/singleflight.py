@@ -0,0 +1,102 @@
+"""
+Single-flight coordination of expensive computations.
+
+When a popular cache entry goes missing, only one caller per key should
+recompute it; everyone else waits for (or is served around) that result.
+Threads of one process coordinate through an in-process table of in-flight
+keys, and gunicorn workers through a lock entry added atomically to the
+shared Django cache (`cache.add` only succeeds if the key is absent). The
+shared lock expires on its own, so a worker that dies mid-computation
+blocks the key for at most `lock_timeout` seconds.
+"""
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional
+
+from django.core.cache import caches
+
+from core.geoip import MISSING
+
+
+class SingleFlight:
+    """
+    Per-key leader election across threads and processes.
+    """
+    key_prefix = 'single-flight:'
+
+    def __init__(self, lock_timeout: float, poll_interval: float, cache_alias: str = 'default'):
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        self.cache_alias = cache_alias
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, threading.Event] = {}
+
+    @property
+    def shared(self):
+        return caches[self.cache_alias]
+
+    def acquire(self, key: str) -> Optional[str]:
+        """
+        Try to become the one caller computing `key`.
+
+        Returns:
+            A token to pass to `release`, or None if another thread or
+            worker is already computing it
+        """
+        with self._lock:
+            if key in self._inflight:
+                return None
+            self._inflight[key] = threading.Event()
+
+        token = uuid.uuid4().hex
+        if self.shared.add(self.key_prefix + key, token, timeout=max(int(self.lock_timeout), 1)):
+            return token
+        self._finish(key)
+        return None
+
+    def release(self, key: str, token: str):
+        """Give up leadership of `key` and wake up the threads waiting on it"""
+        lock_key = self.key_prefix + key
+        # Don't delete a lock that expired and was taken over by another worker
+        if self.shared.get(lock_key) == token:
+            self.shared.delete(lock_key)
+        self._finish(key)
+
+    def _finish(self, key: str):
+        with self._lock:
+            event = self._inflight.pop(key, None)
+        if event is not None:
+            event.set()
+
+    def wait(self, key: str, timeout: float, fetch: Callable):
+        """
+        Wait up to `timeout` seconds for the leader's result to appear.
+
+        Threads of this process are woken as soon as their leader finishes;
+        a leader in another worker is polled for every `poll_interval`.
+
+        Args:
+            key: The key being computed
+            timeout: Longest time to wait, in seconds
+            fetch: Returns the result, or MISSING while it isn't there
+
+        Returns:
+            The result, or MISSING if it didn't appear in time
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            value = fetch()
+            if value is not MISSING:
+                return value
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return MISSING
+            with self._lock:
+                event = self._inflight.get(key)
+            if event is not None:
+                event.wait(remaining)
+                # The local leader is done; if it left no result (it failed,
+                # or the result isn't cacheable) there is nothing to wait for.
+                return fetch()
+            time.sleep(min(self.poll_interval, remaining))
@@ -0,0 +1,120 @@
+"""
+Single-statement rating statistics over arbitrary sets of ratings.
+
+The network rollups (core/rollups.py) and daily buckets (core/timeseries.py)
+answer "all ratings of a network" and whole-day windows. Figures over any
+other subset — ratings near a point, the last 7 days up to now — still have
+to be aggregated from the ratings themselves. Every such figure (average,
+total, star histogram, 7- and 30-day windows and the two halves of the trend
+window) is a filtered aggregate over the same rows, so they are computed
+together with conditional aggregation (`COUNT(...) FILTER (WHERE ...)`, or
+the CASE equivalent on backends without FILTER) in one SQL statement. The
+multi-network variant groups by network to do the same for any number of
+networks in one round trip.
+"""
+from datetime import timedelta
+from typing import Dict, Iterable, Optional
+
+from django.db.models import Avg, Count, Q
+from django.utils import timezone
+
+from core.models import NetworkRating
+
+STARS = range(1, 6)
+WINDOWS = (7, 30)
+
+
+def stats_aggregates(now=None, trend_days: int = 30) -> Dict:
+    """
+    Aggregate expressions for one pass over a network's ratings.
+
+    Args:
+        now: Reference time for the windows (defaults to now)
+        trend_days: Length of the trend window, split into two halves
+
+    Returns:
+        Dictionary of aggregate expressions, for `aggregate()` or `annotate()`
+    """
+    now = now or timezone.now()
+    trend_start = now - timedelta(days=trend_days)
+    trend_mid = trend_start + timedelta(days=trend_days // 2)
+
+    aggregates = {
+        'total_ratings': Count('id'),
+        'average_rating': Avg('rating'),
+        'trend_count': Count('id', filter=Q(created_at__gte=trend_start)),
+        'first_half_avg': Avg('rating', filter=Q(created_at__gte=trend_start, created_at__lt=trend_mid)),
+        'second_half_avg': Avg('rating', filter=Q(created_at__gte=trend_mid)),
+    }
+    for star in STARS:
+        aggregates[f'count_{star}'] = Count('id', filter=Q(rating=star))
+    for days in WINDOWS:
+        since = now - timedelta(days=days)
+        aggregates[f'last_{days}_count'] = Count('id', filter=Q(created_at__gte=since))
+        aggregates[f'last_{days}_avg'] = Avg('rating', filter=Q(created_at__gte=since))
+    return aggregates
+
+
+def _clean(row: Dict) -> Dict:
+    """Turn a raw aggregate row into plain ints and floats, 0.0 for empty averages"""
+    stats = {}
+    for key, value in row.items():
+        if key.endswith('_avg') or key == 'average_rating':
+            stats[key] = float(value) if value is not None else 0.0
+        else:
+            stats[key] = value or 0
+    stats['rating_distribution'] = {str(star): stats.pop(f'count_{star}') for star in STARS}
+    return stats
+
+
+def empty_network_stats() -> Dict:
+    """Statistics of a network without ratings"""
+    return _clean({key: None for key in stats_aggregates()})
+
+
+def aggregate_networks_stats(network_ids: Optional[Iterable[int]] = None, ratings=None, now=None,
+                             trend_days: int = 30) -> Dict[int, Dict]:
+    """
+    Statistics for several networks in a single grouped query.
+
+    Args:
+        network_ids: IDs of the networks, or None for every network that
+            has ratings in `ratings`
+        ratings: NetworkRating queryset to aggregate (defaults to all
+            ratings), e.g. the ratings near a point
+        now: Reference time for the windows (defaults to now)
+        trend_days: Length of the trend window
+
+    Returns:
+        Dictionary mapping network ID to its statistics (every requested
+        network, when `network_ids` is given): total_ratings,
+        average_rating, rating_distribution, last_7_count, last_7_avg,
+        last_30_count, last_30_avg, trend_count, first_half_avg and
+        second_half_avg
+    """
+    ratings = NetworkRating.objects.all() if ratings is None else ratings
+    if network_ids is None:
+        stats = {}
+        ratings = ratings.filter(network__isnull=False)
+    else:
+        network_ids = list(network_ids)
+        stats = {network_id: empty_network_stats() for network_id in network_ids}
+        if not network_ids:
+            return stats
+        ratings = ratings.filter(network_id__in=network_ids)
+
+    rows = ratings.order_by().values('network_id').annotate(**stats_aggregates(now, trend_days))
+    for row in rows:
+        network_id = row.pop('network_id')
+        stats[network_id] = _clean(row)
+    return stats
+
+
+def aggregate_network_stats(network_id: int, ratings=None, now=None, trend_days: int = 30) -> Dict:
+    """
+    Statistics for one network in a single query.
+
+    See `aggregate_networks_stats` for the arguments and keys returned.
+    """
+    ratings = NetworkRating.objects.all() if ratings is None else ratings
+    return _clean(ratings.filter(network_id=network_id).aggregate(**stats_aggregates(now, trend_days)))
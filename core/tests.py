@@ -1,3 +1,1735 @@
-from django.test import TestCase
+import base64
+import io
+import ipaddress
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from geopy.distance import geodesic, great_circle
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient
+from rest_framework.utils.urls import replace_query_param
+
+from core import geohash as geo
+from core import geoip, ingest, ipdb, rollups
+from core.autocomplete import NetworkAutocomplete, NetworkIndex
+from core.distance import EARTH_RADIUS_KM, filter_within_radius, haversine_km, within_radius
+from core.enrichment import enqueue_location_enrichment, enrich_rating_location, flush_location_enrichment
+from core.fastserializers import FastSerializer, device_rows, network_rows
+from core.geoip import MISSING, CircuitBreaker, GeolocationUnavailable, location_cache
+from core.importer import RatingImporter
+from core.models import (
+    Comment, Network, NetworkDevice, NetworkRating, NetworkRatingDay, NetworkRatingStats, UserRatingStats,
+)
+from core.pagination import KeysetPagination
+from core.queryplans import HOT_QUERIES, check_query_plans
+from core.querysets import prefetch_ratings, prepare_ratings_queryset, ratings_serializer_context
+from core.response_cache import DATA_SETS, ResponseCache, response_cache
+from core.search import FallbackSearch, PostgresSearch, SQLiteSearch, active_backend, search_backend, search_ratings
+from core.serializers import (
+    NetworkDeviceSerializer, NetworkRatingListSerializer, NetworkRatingSerializer, NetworkSerializer,
+)
+from core.singleflight import SingleFlight
+from core.stats import aggregate_network_stats, aggregate_networks_stats, empty_network_stats
+from core.threads import build_comment_threads
+from core.utils import (
+    calculate_network_average_rating, calculate_network_trend, fetch_location_from_ipstack, filter_nearby,
+    get_location_based_network_rankings, get_network_performance_insights, get_user_rating_summary,
+)
+
+LAGOS = {'city': 'Lagos', 'country_name': 'Nigeria', 'latitude': 6.5244, 'longitude': 3.3792}
+
+
+class StubIPStack(BaseHTTPRequestHandler):
+    """
+    Stand-in for the ipstack API. The server's `responses` list is consumed
+    one entry per request: a (status, payload) pair, or a number of seconds
+    to stall before answering.
+    """
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        response = self.server.responses.pop(0) if self.server.responses else (200, LAGOS)
+        if isinstance(response, (int, float)):
+            time.sleep(response)
+            response = (200, LAGOS)
+        status, payload = response
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(IPSTACK_MAX_RETRIES=0, IPSTACK_CONNECT_TIMEOUT=1, IPSTACK_READ_TIMEOUT=0.5)
+class IPStackClientTests(SimpleTestCase):
+    """ipstack calls against a local stub server"""
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubIPStack)
+        self.server.requests = []
+        self.server.responses = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        environ = mock.patch.dict(os.environ, {'IPSTACK_BASE_URL': f'http://127.0.0.1:{self.server.server_port}'})
+        environ.start()
+        self.addCleanup(environ.stop)
+        # The pooled session is built from the settings on first use
+        geoip._session = None
+        self.addCleanup(setattr, geoip, '_session', None)
+        breaker = mock.patch.object(geoip, 'ipstack_breaker', CircuitBreaker(failure_threshold=2, reset_timeout=60))
+        self.breaker = breaker.start()
+        self.addCleanup(breaker.stop)
+        utils_breaker = mock.patch('core.utils.ipstack_breaker', self.breaker)
+        utils_breaker.start()
+        self.addCleanup(utils_breaker.stop)
+
+    def test_returns_the_payload(self):
+        self.assertEqual(fetch_location_from_ipstack('102.89.0.1'), LAGOS)
+        self.assertEqual(self.server.requests[0].split('?')[0], '/102.89.0.1')
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_reuses_the_pooled_session(self):
+        fetch_location_from_ipstack('102.89.0.1')
+        session = geoip._session
+        fetch_location_from_ipstack('102.89.0.2')
+        self.assertIs(geoip._session, session)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_slow_provider_times_out(self):
+        self.server.responses = [2]
+        start = time.monotonic()
+        self.assertIsNone(fetch_location_from_ipstack('102.89.0.1'))
+        self.assertLess(time.monotonic() - start, 1.5)
+        self.assertEqual(self.breaker.failures, 1)
+
+    def test_api_errors_count_as_failures(self):
+        self.server.responses = [(200, {'success': False, 'error': {'code': 104}})]
+        self.assertIsNone(fetch_location_from_ipstack('102.89.0.1'))
+        self.assertEqual(self.breaker.failures, 1)
+
+    def test_circuit_opens_after_repeated_failures(self):
+        self.server.responses = [(503, {}), (503, {})]
+        self.assertIsNone(fetch_location_from_ipstack('102.89.0.1'))
+        self.assertIsNone(fetch_location_from_ipstack('102.89.0.1'))
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+        with self.assertRaises(GeolocationUnavailable):
+            fetch_location_from_ipstack('102.89.0.1')
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_half_open_trial_closes_the_circuit(self):
+        self.server.responses = [(503, {}), (503, {})]
+        fetch_location_from_ipstack('102.89.0.1')
+        fetch_location_from_ipstack('102.89.0.1')
+        self.breaker.opened_at -= self.breaker.reset_timeout
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertEqual(fetch_location_from_ipstack('102.89.0.1'), LAGOS)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_unexpected_error_releases_the_half_open_trial(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.opened_at -= self.breaker.reset_timeout
+
+        with mock.patch.object(geoip.requests.Session, 'get', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                fetch_location_from_ipstack('102.89.0.1')
+        self.assertFalse(self.breaker._trial_in_flight)
+
+        self.breaker.opened_at -= self.breaker.reset_timeout
+        self.assertEqual(fetch_location_from_ipstack('102.89.0.1'), LAGOS)
+
+
+class LocalDatabaseTests(SimpleTestCase):
+    """Opening the offline IP database"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.reset()
+        self.addCleanup(self.reset)
+
+    def reset(self):
+        if ipdb._database is not None:
+            ipdb._database.close()
+        ipdb._database = None
+        ipdb._unavailable_path = None
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def test_opens_a_built_database(self):
+        path = self.path('ranges.ipdb')
+        ipdb.build_database([(int(ipaddress.IPv4Address('102.89.0.0')), int(ipaddress.IPv4Address('102.89.255.255')),
+                              'Lagos', 'Nigeria', 6.5244, 3.3792)], path)
+        with override_settings(IP_GEOLOCATION_DB_PATH=path):
+            database = ipdb.get_local_database()
+            self.assertEqual(database.lookup('102.89.1.1')['city'], 'Lagos')
+            self.assertIs(ipdb.get_local_database(), database)
+
+    def test_missing_file_is_reported_once(self):
+        with override_settings(IP_GEOLOCATION_DB_PATH=self.path('missing.ipdb')):
+            with self.assertLogs('core.ipdb', 'WARNING') as logs:
+                self.assertIsNone(ipdb.get_local_database())
+            with mock.patch('core.ipdb.IPDatabase') as opened:
+                self.assertIsNone(ipdb.get_local_database())
+                self.assertIsNone(ipdb.get_local_database())
+            opened.assert_not_called()
+        self.assertEqual(len(logs.records), 1)
+
+    def test_empty_file_is_treated_as_missing(self):
+        path = self.path('empty.ipdb')
+        open(path, 'wb').close()
+        with override_settings(IP_GEOLOCATION_DB_PATH=path):
+            with self.assertLogs('core.ipdb', 'ERROR'):
+                self.assertIsNone(ipdb.get_local_database())
+            self.assertIsNone(ipdb.get_local_database())
+
+
+@override_settings(
+    IP_GEOLOCATION_BACKEND='ipstack',
+    LOCATION_ENRICHMENT_SYNC=False,
+    LOCATION_ENRICHMENT_MAX_ATTEMPTS=3,
+    LOCATION_ENRICHMENT_RETRY_BACKOFF=0,
+)
+class LocationEnrichmentTests(TransactionTestCase):
+    """Background location lookups for new ratings"""
+
+    def setUp(self):
+        cache.clear()
+        location_cache.clear()
+        self.addCleanup(location_cache.clear)
+        user = get_user_model().objects.create(username='rater')
+        network = Network.objects.create(name='MTN', image='uploads/mtn.png', status=True, slug='mtn')
+        self.rating = NetworkRating.objects.create(
+            user=user, network=network, rating=Decimal('4'), review='Good coverage', location_pending=True,
+        )
+
+    def fetch(self, *payloads):
+        fetch = mock.patch('core.utils.fetch_location_from_ipstack', side_effect=payloads)
+        self.addCleanup(fetch.stop)
+        return fetch.start()
+
+    def test_queued_enrichment_fills_in_the_location(self):
+        self.fetch(LAGOS)
+        with transaction.atomic():
+            enqueue_location_enrichment(self.rating.id, '102.89.0.1', 'Yaba')
+        self.assertTrue(flush_location_enrichment(timeout=10))
+
+        self.rating.refresh_from_db()
+        self.assertFalse(self.rating.location_pending)
+        self.assertEqual(self.rating.address, 'Yaba, Lagos, Nigeria')
+        self.assertEqual(self.rating.latitude, Decimal('6.524400'))
+        self.assertEqual(self.rating.longitude, Decimal('3.379200'))
+        self.assertIsNotNone(self.rating.geohash)
+
+    def test_retries_reach_the_provider_past_the_negative_cache(self):
+        fetch = self.fetch(None, None, LAGOS)
+        self.assertTrue(enrich_rating_location(self.rating.id, '102.89.0.1', 'Yaba'))
+        self.assertEqual(fetch.call_count, 3)
+        # The successful lookup replaces the negative entry
+        self.assertEqual(location_cache.get('102.89.0.1'), LAGOS)
+
+    def test_exhausted_attempts_clear_the_pending_marker(self):
+        fetch = self.fetch(None, None, None)
+        self.assertFalse(enrich_rating_location(self.rating.id, '102.89.0.1'))
+        self.assertEqual(fetch.call_count, 3)
+
+        self.rating.refresh_from_db()
+        self.assertFalse(self.rating.location_pending)
+        self.assertIsNone(self.rating.latitude)
+
+    def test_address_without_a_user_address(self):
+        self.fetch(LAGOS)
+        self.assertTrue(enrich_rating_location(self.rating.id, '102.89.0.1'))
+        self.rating.refresh_from_db()
+        self.assertEqual(self.rating.address, 'Lagos, Nigeria')
+
+    def test_worker_failures_are_logged(self):
+        with mock.patch('core.enrichment.enrich_rating_location', side_effect=RuntimeError('boom')), \
+                self.assertLogs('core.enrichment', 'ERROR') as logs:
+            with transaction.atomic():
+                enqueue_location_enrichment(self.rating.id, '102.89.0.1')
+            self.assertTrue(flush_location_enrichment(timeout=10))
+        self.assertIn(f'rating {self.rating.id}', logs.output[0])
+        self.assertIn('RuntimeError: boom', logs.output[0])
+
+    def test_new_ratings_keep_the_client_ip_while_pending(self):
+        client = APIClient()
+        client.force_authenticate(self.rating.user)
+        network = Network.objects.create(name='Glo', image='uploads/glo.png', status=True, slug='glo')
+        for ip, kept in (('102.89.0.1', '102.89.0.1'), ('not-an-ip', None)):
+            with self.subTest(ip=ip), mock.patch('core.views.enqueue_location_enrichment'):
+                response = client.post('/api/network/ratings/', {
+                    'network_id': network.id, 'rating': '4.0', 'review': 'Good coverage in Yaba',
+                }, format='json', REMOTE_ADDR=ip)
+                self.assertEqual(response.status_code, 201, response.content)
+                rating = NetworkRating.objects.get(pk=response.json()['id'])
+                self.assertEqual((rating.location_pending, rating.client_ip), (True, kept))
+                rating.delete()
+
+    def test_sweep_retries_lost_lookups(self):
+        self.fetch(LAGOS)
+        user = self.rating.user
+        old = timezone.now() - timedelta(hours=1)
+        lost = NetworkRating.objects.create(
+            user=user, network=Network.objects.create(name='Glo', image='uploads/glo.png', status=True, slug='glo'),
+            rating=Decimal('3'), review='Good coverage', address='Yaba', location_pending=True, client_ip='102.89.0.1',
+        )
+        NetworkRating.objects.filter(pk__in=[self.rating.pk, lost.pk]).update(created_at=old)
+        recent = NetworkRating.objects.create(
+            user=user, network=Network.objects.create(name='Airtel', image='uploads/airtel.png', status=True, slug='airtel'),
+            rating=Decimal('3'), review='Good coverage', location_pending=True, client_ip='102.89.0.2',
+        )
+
+        call_command('enrich_pending_locations', stdout=io.StringIO())
+
+        lost.refresh_from_db()
+        self.assertEqual((lost.location_pending, lost.client_ip, lost.address), (False, None, 'Yaba, Lagos, Nigeria'))
+        self.assertEqual(lost.latitude, Decimal('6.524400'))
+        # No IP to look up: it stops pending
+        self.rating.refresh_from_db()
+        self.assertFalse(self.rating.location_pending)
+        self.assertIsNone(self.rating.latitude)
+        # Its lookup may still be queued
+        recent.refresh_from_db()
+        self.assertTrue(recent.location_pending)
+
+
+class QueryCountTests(TestCase):
+    """
+    Read endpoints run a fixed number of queries however many ratings,
+    comments, replies and likes are on the page. Cached endpoints include
+    one query for the data versions.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.users = [User.objects.create(username=f'user{index}') for index in range(8)]
+        cls.network = Network.objects.create(name='MTN', image='uploads/mtn.png', status=True, slug='mtn')
+        device = NetworkDevice.objects.create(name='Pixel 7', slug='pixel-7')
+        for index in range(8):
+            rating = NetworkRating.objects.create(
+                user=cls.users[index], network=cls.network, device=device if index % 2 else None,
+                rating=Decimal(1 + index % 5), review='Coverage is solid downtown', address='Yaba, Lagos',
+                latitude=Decimal('6.5244'), longitude=Decimal('3.3792'),
+            )
+            for number in range(3):
+                comment = Comment.objects.create(user=cls.users[number], content='Same here', network_rating=rating)
+                comment.likes.add(*cls.users[:2])
+                for reply in range(4):
+                    reply = Comment.objects.create(
+                        user=cls.users[reply], content='Agreed', network_rating=rating, parent=comment
+                    )
+                    reply.likes.add(cls.users[0])
+        cls.rating = rating
+        cls.comment = comment
+
+    def setUp(self):
+        cache.clear()
+        # Version counters are created on first use
+        response_cache.versions(DATA_SETS)
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+        location = mock.patch('core.views.get_location_data', return_value=('Lagos, Nigeria', 3.3792, 6.5244))
+        location.start()
+        self.addCleanup(location.stop)
+
+    def assertQueries(self, count, url):
+        with self.assertNumQueries(count):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_rating_list(self):
+        data = self.assertQueries(4, '/api/network/ratings/?nearby=false')
+        self.assertEqual(len(data['results']), 8)
+
+    def test_nearby_rating_list(self):
+        data = self.assertQueries(4, '/api/network/ratings/')
+        self.assertEqual(len(data['results']), 8)
+
+    def test_rating_detail(self):
+        data = self.assertQueries(3, f'/api/network/ratings/{self.rating.id}')
+        self.assertEqual(len(data['comments']), 3)
+
+    def test_comment_replies(self):
+        data = self.assertQueries(3, f'/api/network/comments/{self.comment.id}/replies/')
+        self.assertEqual(len(data['results']), 4)
+
+    def test_profile(self):
+        self.assertQueries(3, '/api/accounts/profile/')
+
+    def test_profile_with_comments(self):
+        data = self.assertQueries(5, '/api/accounts/profile/?comments=true')
+        self.assertEqual(len(data['ratings'][0]['comments']), 3)
+
+    def test_statistics_detail(self):
+        data = self.assertQueries(5, f'/api/network/statistics/{self.network.id}/')
+        self.assertEqual(len(data['statistics']['recent_reviews']), 5)
+
+    def test_recommendations(self):
+        self.assertQueries(5, '/api/network/recommendations/')
+
+
+class KeysetPaginationTests(TestCase):
+    """Cursor pages of the rating list"""
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        network = Network.objects.create(name='MTN', image='uploads/mtn.png', status=True, slug='mtn')
+        cls.ratings = [
+            NetworkRating.objects.create(
+                user=User.objects.create(username=f'user{index}'), network=network,
+                rating=Decimal('3'), review='Coverage review',
+            )
+            for index in range(12)
+        ]
+        # Two runs of rows sharing a created_at, split across page boundaries
+        now = timezone.now()
+        NetworkRating.objects.filter(id__in=[r.id for r in cls.ratings[:7]]).update(created_at=now)
+        NetworkRating.objects.filter(id__in=[r.id for r in cls.ratings[7:]]).update(created_at=now - timedelta(hours=1))
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def walk(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            page = response.json()
+            ids.extend(rating['id'] for rating in page['results'])
+            url = page['next']
+        return ids
+
+    @staticmethod
+    def decode(url):
+        token = url.split('cursor=')[1].split('&')[0]
+        return json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+
+    def test_round_trip_with_ties_on_created_at(self):
+        expected = list(NetworkRating.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        for page_size in (1, 3, 5, 12, 50):
+            with self.subTest(page_size=page_size):
+                self.assertEqual(self.walk(f'/api/network/ratings/?nearby=false&page_size={page_size}'), expected)
+
+    def test_rows_added_between_pages_are_not_repeated(self):
+        page = self.client.get('/api/network/ratings/?nearby=false&page_size=5').json()
+        NetworkRating.objects.create(
+            user=get_user_model().objects.create(username='late'), rating=Decimal('4'), review='Late review',
+        )
+        cache.clear()
+        rest = self.walk(page['next'])
+        ids = [rating['id'] for rating in page['results']] + rest
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(set(ids), {rating.id for rating in self.ratings})
+
+    def test_invalid_or_tampered_cursors(self):
+        page = self.client.get('/api/network/ratings/?nearby=false&page_size=5').json()
+        created_at, rating_id = self.decode(page['next'])
+        tokens = [
+            '!!!',
+            'bm90IGpzb24',
+            KeysetPagination.encode_position({'id': rating_id}),
+            KeysetPagination.encode_position([created_at]),
+            KeysetPagination.encode_position([created_at, rating_id, 1]),
+            KeysetPagination.encode_position(['yesterday', rating_id]),
+            KeysetPagination.encode_position([created_at, 'seven']),
+            KeysetPagination.encode_position([[created_at], rating_id]),
+        ]
+        for token in tokens:
+            with self.subTest(token=token):
+                response = self.client.get(f'/api/network/ratings/?nearby=false&cursor={token}')
+                self.assertEqual(response.status_code, 404, response.content)
+
+
+class CommentLikeTests(TransactionTestCase):
+    """Comment.toggle_like"""
+
+    def setUp(self):
+        User = get_user_model()
+        self.users = [User.objects.create(username=f'user{index}') for index in range(6)]
+        rating = NetworkRating.objects.create(user=self.users[0], rating=Decimal('4'), review='Coverage review')
+        self.comment = Comment.objects.create(user=self.users[0], content='Same here', network_rating=rating)
+
+    def assertCountMatchesLikes(self):
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.like_count, self.comment.likes.count())
+        return self.comment.like_count
+
+    def test_like_then_unlike(self):
+        self.assertEqual(self.comment.toggle_like(self.users[1]), (True, 1))
+        self.assertEqual(self.comment.toggle_like(self.users[2]), (True, 2))
+        self.assertEqual(self.comment.toggle_like(self.users[1]), (False, 1))
+        self.assertEqual(self.comment.toggle_like(self.users[2]), (False, 0))
+        self.assertEqual(self.assertCountMatchesLikes(), 0)
+
+    def test_stale_instances_keep_the_count_exact(self):
+        first = Comment.objects.get(pk=self.comment.pk)
+        second = Comment.objects.get(pk=self.comment.pk)
+        self.assertEqual(first.toggle_like(self.users[1]), (True, 1))
+        self.assertEqual(second.toggle_like(self.users[1]), (False, 0))
+        self.assertEqual(second.toggle_like(self.users[1]), (True, 1))
+        self.assertEqual(first.toggle_like(self.users[2]), (True, 2))
+        self.assertEqual(self.assertCountMatchesLikes(), 2)
+
+    def test_after_likes_added_through_the_orm(self):
+        self.comment.likes.add(*self.users[:3])
+        self.assertEqual(self.comment.toggle_like(self.users[0]), (False, 2))
+        self.assertEqual(self.comment.toggle_like(self.users[4]), (True, 3))
+        self.assertEqual(self.assertCountMatchesLikes(), 3)
+
+    def test_random_toggles_never_go_negative(self):
+        rng = random.Random(5)
+        for _ in range(60):
+            _, like_count = self.comment.toggle_like(rng.choice(self.users))
+            self.assertGreaterEqual(like_count, 0)
+            self.assertEqual(self.assertCountMatchesLikes(), like_count)
+
+    @skipUnless(connection.features.has_select_for_update, "Needs row locks")
+    def test_concurrent_toggles(self):
+        # Every user toggles an even number of times from several threads at
+        # once, so every like is undone again.
+        toggles = [user for user in self.users for _ in range(4)]
+        random.Random(9).shuffle(toggles)
+        barrier = threading.Barrier(len(toggles))
+        errors = []
+
+        def toggle(user):
+            try:
+                barrier.wait()
+                Comment.objects.get(pk=self.comment.pk).toggle_like(user)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=toggle, args=(user,)) for user in toggles]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(self.assertCountMatchesLikes(), 0)
+
+
+class CommentThreadCapTests(TestCase):
+    """Rating responses show the newest few comments; the rest are paged in"""
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create(username='rater')
+        network = Network.objects.create(name='MTN', image='uploads/mtn.png', status=True, slug='mtn')
+        cls.rating = NetworkRating.objects.create(user=cls.user, network=network, rating=Decimal('4'), review='Coverage review')
+        now = timezone.now()
+        cls.comments = []
+        for index in range(5):
+            comment = Comment.objects.create(user=cls.user, content=f'Comment {index}', network_rating=cls.rating)
+            for reply in range(2):
+                Comment.objects.create(user=cls.user, content='Agreed', network_rating=cls.rating, parent=comment)
+            cls.comments.append(comment)
+        # Two comments at the same time, to exercise the tie on created_at
+        for index, comment in enumerate(cls.comments):
+            Comment.objects.filter(pk=comment.pk).update(created_at=now - timedelta(minutes=min(index, 3)))
+        cls.newest_first = [comment.pk for comment in sorted(
+            Comment.objects.filter(parent=None), key=lambda c: (c.created_at, c.id), reverse=True,
+        )]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    @override_settings(COMMENT_PREVIEW=2)
+    def test_threads_are_capped_per_rating(self):
+        threads = build_comment_threads([self.rating.id], replies_limit=1)
+        self.assertEqual([comment.pk for comment in threads[self.rating.id]], self.newest_first[:3])
+        self.assertTrue(all(len(comment.prefetched_replies) == 1 for comment in threads[self.rating.id]))
+
+        with self.assertNumQueries(3):
+            data = self.client.get(f'/api/network/ratings/{self.rating.id}').json()
+        self.assertEqual([comment['id'] for comment in data['comments']], self.newest_first[:2])
+        self.assertTrue(data['more_comments'])
+
+        # The rest, page by page, from the link
+        seen = [comment['id'] for comment in data['comments']]
+        url = replace_query_param(data['more_comments'], 'page_size', 2)
+        while url:
+            page = self.client.get(url).json()
+            self.assertTrue(all(len(comment['replies']) == 2 for comment in page['results']))
+            seen += [comment['id'] for comment in page['results']]
+            url = page['next']
+        self.assertEqual(seen, self.newest_first)
+
+    @override_settings(COMMENT_PREVIEW=2)
+    def test_serializers_agree_on_the_link(self):
+        ratings = prefetch_ratings(prepare_ratings_queryset(NetworkRating.objects.all()))
+        context = ratings_serializer_context(None, ratings)
+        self.assertEqual(
+            FastSerializer(context).ratings(ratings), NetworkRatingSerializer(ratings, many=True, context=context).data,
+        )
+
+    def test_all_comments_within_the_preview(self):
+        data = self.client.get(f'/api/network/ratings/{self.rating.id}').json()
+        self.assertEqual(len(data['comments']), 5)
+        self.assertIsNone(data['more_comments'])
+
+    def test_unknown_rating(self):
+        self.assertEqual(self.client.get('/api/network/ratings/999/comments/').status_code, 404)
+
+
+class NearbyFilterTests(TestCase):
+    """filter_nearby"""
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(7)
+        User = get_user_model()
+        users = User.objects.bulk_create([User(username=f'user{index}') for index in range(600)])
+        network = Network.objects.create(name='MTN', image='uploads/mtn.png', status=True, slug='mtn')
+        ratings = []
+        for user in users:
+            rating = NetworkRating(
+                user=user, network=network, rating=Decimal('3'), review='Coverage review',
+                latitude=Decimal(f'{LAGOS["latitude"] + rng.uniform(-0.2, 0.2):.6f}'),
+                longitude=Decimal(f'{LAGOS["longitude"] + rng.uniform(-0.2, 0.2):.6f}'),
+            )
+            rating.geohash = rating.compute_geohash()
+            ratings.append(rating)
+        cls.ratings = NetworkRating.objects.bulk_create(ratings)
+
+    def test_matches_haversine_in_one_query_without_an_id_list(self):
+        latitudes = [rating.latitude for rating in self.ratings]
+        longitudes = [rating.longitude for rating in self.ratings]
+        for radius in (3, 8, 20):
+            with self.subTest(radius=radius):
+                distances = haversine_km(LAGOS['latitude'], LAGOS['longitude'], latitudes, longitudes)
+                expected = {rating.id for rating, distance in zip(self.ratings, distances) if distance <= radius}
+                with CaptureQueriesContext(connection) as queries:
+                    found = set(filter_nearby(
+                        NetworkRating.objects.all(), LAGOS['latitude'], LAGOS['longitude'], radius,
+                    ).values_list('id', flat=True))
+                self.assertEqual(found, expected)
+                self.assertTrue(expected)
+                self.assertEqual(len(queries), 1)
+                self.assertNotIn(' IN (', queries[0]['sql'])
+
+    def test_across_the_antimeridian(self):
+        user = get_user_model().objects.create(username='fiji')
+        east, west = [
+            NetworkRating.objects.create(
+                user=user, rating=Decimal('4'), review='Coverage review',
+                latitude=Decimal('-17.713400'), longitude=Decimal(longitude),
+            )
+            for longitude in ('179.990000', '-179.990000')
+        ]
+        found = set(filter_nearby(NetworkRating.objects.all(), -17.7134, 179.999, 5).values_list('id', flat=True))
+        self.assertEqual(found, {east.id, west.id})
+
+
+class GeohashCoverTests(SimpleTestCase):
+    """Geohash neighbours and radius covers"""
+
+    def assertCovered(self, latitude, longitude, radius_km, samples=400):
+        cells = geo.covering_cells(latitude, longitude, radius_km)
+        self.assertIsNotNone(cells)
+        rng = random.Random(11)
+        origin = (latitude, longitude)
+        for _ in range(samples):
+            distance = radius_km * rng.random() ** 0.5
+            point = geodesic(kilometers=distance).destination(origin, rng.uniform(0, 360))
+            cell = geo.encode(point.latitude, point.longitude, len(cells[0]))
+            self.assertIn(cell, cells, (point.latitude, point.longitude))
+
+    def test_encode_lies_inside_decoded_cell(self):
+        min_lat, max_lat, min_lon, max_lon = geo.decode_cell(geo.encode(LAGOS['latitude'], LAGOS['longitude'], 7))
+        self.assertTrue(min_lat <= LAGOS['latitude'] < max_lat)
+        self.assertTrue(min_lon <= LAGOS['longitude'] < max_lon)
+
+    def test_neighbours_of_an_interior_cell(self):
+        cell = geo.encode(LAGOS['latitude'], LAGOS['longitude'], 6)
+        cells = geo.neighbours(cell)
+        self.assertEqual(len(set(cells)), 9)
+        self.assertEqual(cells[4], cell)
+
+    def test_neighbours_reach_across_cell_edges(self):
+        cell = geo.encode(LAGOS['latitude'], LAGOS['longitude'], 5)
+        min_lat, max_lat, min_lon, max_lon = geo.decode_cell(cell)
+        lat_step, lon_step = max_lat - min_lat, max_lon - min_lon
+        cells = geo.neighbours(cell)
+        for latitude in (min_lat - lat_step / 2, (min_lat + max_lat) / 2, max_lat + lat_step / 2):
+            for longitude in (min_lon - lon_step / 2, (min_lon + max_lon) / 2, max_lon + lon_step / 2):
+                self.assertIn(geo.encode(latitude, longitude, 5), cells)
+
+    def test_neighbours_wrap_around_the_antimeridian(self):
+        east = geo.encode(0.5, 179.99, 4)
+        west = geo.encode(0.5, -179.99, 4)
+        self.assertIn(west, geo.neighbours(east))
+        self.assertIn(east, geo.neighbours(west))
+
+    def test_neighbours_are_clipped_at_the_poles(self):
+        cells = geo.neighbours(geo.encode(89.99, 10.0, 3))
+        self.assertEqual(len(cells), len(set(cells)))
+        self.assertEqual(len(cells), 6)
+
+    def test_cover_contains_every_point_within_the_radius(self):
+        cell = geo.encode(LAGOS['latitude'], LAGOS['longitude'], 5)
+        min_lat, _, min_lon, _ = geo.decode_cell(cell)
+        origins = [
+            (LAGOS['latitude'], LAGOS['longitude']),
+            (min_lat, min_lon),
+            (min_lat - 1e-9, min_lon - 1e-9),
+            (-17.7134, 179.999),
+            (-17.7134, -179.999),
+            (64.8, -179.95),
+        ]
+        for latitude, longitude in origins:
+            for radius in (1, 5, 25, 150):
+                with self.subTest(latitude=latitude, longitude=longitude, radius=radius):
+                    self.assertCovered(latitude, longitude, radius)
+
+    def test_cover_is_skipped_for_huge_radii(self):
+        self.assertIsNone(geo.covering_cells(LAGOS['latitude'], LAGOS['longitude'], 10000))
+
+
+class DistanceEngineTests(SimpleTestCase):
+    """Vectorized haversine and radius masks against the scalar geopy solvers"""
+
+    def setUp(self):
+        rng = random.Random(3)
+        self.origin = (LAGOS['latitude'], LAGOS['longitude'])
+        self.points = [
+            geodesic(kilometers=rng.uniform(0, 40)).destination(self.origin, rng.uniform(0, 360))
+            for _ in range(500)
+        ]
+        # Points straddling the radius, where haversine and geodesic disagree
+        self.points += [
+            geodesic(kilometers=10 + offset).destination(self.origin, bearing)
+            for offset in (-0.05, -0.01, 0, 0.01, 0.05) for bearing in range(0, 360, 15)
+        ]
+        self.latitudes = [point.latitude for point in self.points]
+        self.longitudes = [point.longitude for point in self.points]
+
+    def test_haversine_matches_great_circle(self):
+        distances = haversine_km(*self.origin, self.latitudes, self.longitudes)
+        expected = [great_circle(self.origin, (point.latitude, point.longitude), radius=EARTH_RADIUS_KM).km
+                    for point in self.points]
+        self.assertEqual(distances.shape, (len(self.points),))
+        for distance, reference in zip(distances, expected):
+            self.assertAlmostEqual(distance, reference, places=6)
+
+    def test_haversine_accepts_decimals(self):
+        distances = haversine_km(Decimal('6.5244'), Decimal('3.3792'), [Decimal('6.5244')], [Decimal('3.3792')])
+        self.assertEqual(list(distances), [0.0])
+
+    def test_within_radius_matches_geodesic(self):
+        mask = within_radius(*self.origin, self.latitudes, self.longitudes, 10)
+        expected = [geodesic(self.origin, (point.latitude, point.longitude)).km <= 10 for point in self.points]
+        self.assertEqual(list(mask), expected)
+
+    def test_filter_within_radius_keeps_order(self):
+        items = [mock.Mock(latitude=point.latitude, longitude=point.longitude) for point in self.points]
+        kept = filter_within_radius(*self.origin, items, 10)
+        self.assertEqual(kept, [item for item in items
+                                if geodesic(self.origin, (item.latitude, item.longitude)).km <= 10])
+        self.assertEqual(filter_within_radius(*self.origin, [], 10), [])
+
+
+class NetworkIndexTests(SimpleTestCase):
+    """Ranking of NetworkIndex.search"""
+
+    def setUp(self):
+        names = [
+            ('MTN', 'mtn', True), ('MTN Business', 'mtn-business', True), ('Airtel', 'airtel', True),
+            ('Glo Mobile', 'glo', True), ('9mobile', '9mobile', True), ('Smile Communications', 'smile', True),
+            ('Spectranet', 'spectranet', True), ('Airtel Legacy', 'airtel-legacy', False),
+            ('Télécom Ouest', 'telecom-ouest', True),
+        ]
+        networks = [
+            {'id': index, 'name': name, 'slug': slug, 'status': status}
+            for index, (name, slug, status) in enumerate(names, 1)
+        ]
+        self.index = NetworkIndex(networks, version=(1,))
+
+    def names(self, query, limit=10):
+        return [network['name'] for network in self.index.search(query, limit)]
+
+    def test_exact_then_name_prefix_then_word_prefix(self):
+        self.assertEqual(self.names('mtn'), ['MTN', 'MTN Business'])
+        self.assertEqual(self.names('mob'), ['Glo Mobile'])
+        self.assertEqual(self.names('busi'), ['MTN Business'])
+
+    def test_every_query_word_must_match_for_a_prefix_hit(self):
+        # MTN still comes in on trigram similarity, below the prefix hit
+        self.assertEqual(self.names('mtn bus'), ['MTN Business', 'MTN'])
+
+    def test_prefix_matches_slugs(self):
+        self.assertEqual(self.names('legacy'), ['Airtel Legacy'])
+
+    def test_trigram_matches_inside_words_and_typos(self):
+        self.assertEqual(self.names('spectrnet'), ['Spectranet'])
+        self.assertEqual(self.names('airtle'), ['Airtel'])
+        self.assertEqual(self.names('zzzz'), [])
+
+    def test_inactive_networks_rank_last(self):
+        self.assertEqual(self.names('airtel'), ['Airtel', 'Airtel Legacy'])
+        self.assertEqual(self.names('')[-1], 'Airtel Legacy')
+
+    def test_accents_and_case_are_ignored(self):
+        self.assertEqual(self.names('TELECOM'), ['Télécom Ouest'])
+        self.assertEqual(self.names('télé'), ['Télécom Ouest'])
+
+    def test_empty_query_lists_everything_by_name(self):
+        self.assertEqual(self.names('', limit=3), ['9mobile', 'Airtel', 'Glo Mobile'])
+        self.assertEqual(len(self.names('   ')), 9)
+
+
+class NetworkAutocompleteTests(TestCase):
+    """Rebuilding the autocomplete index when networks change"""
+
+    def setUp(self):
+        self.network = Network.objects.create(name='MTN', image='uploads/mtn.png', status=True, slug='mtn')
+        self.autocomplete = NetworkAutocomplete(refresh_interval=60)
+        self.clock = 1000.0
+        monotonic = mock.patch('core.autocomplete.time.monotonic', side_effect=lambda: self.clock)
+        monotonic.start()
+        self.addCleanup(monotonic.stop)
+
+    def names(self, query):
+        return [network['name'] for network in self.autocomplete.search(query)]
+
+    def test_changes_from_another_worker_are_seen_through_the_data_version(self):
+        self.assertEqual(self.names('mt'), ['MTN'])
+        # Another worker renames the network: no signal fires in this process
+        Network.objects.filter(pk=self.network.pk).update(name='MTN Nigeria')
+        response_cache.bump('networks')
+
+        self.assertEqual(self.names('mt'), ['MTN'])
+        self.clock += 61
+        self.assertEqual(self.names('mt'), ['MTN Nigeria'])
+
+    def test_unchanged_version_keeps_the_index(self):
+        index = self.autocomplete.index()
+        self.clock += 61
+        with self.assertNumQueries(1):
+            self.assertIs(self.autocomplete.index(), index)
+
+    def test_local_invalidation(self):
+        self.assertEqual(self.names('glo'), [])
+        self.autocomplete.invalidate()
+        Network.objects.create(name='Glo', image='uploads/glo.png', status=True, slug='glo')
+        self.assertEqual(self.names('glo'), ['Glo'])
+
+
+class RatingRollupTests(TestCase):
+    """Rollups of ratings that are not attached to a network"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username='rater')
+        self.network = Network.objects.create(name='MTN', image='uploads/mtn.png', status=True, slug='mtn')
+
+    def assertNoDrift(self):
+        self.assertEqual(rollups.rebuild_network_stats(dry_run=True), [])
+        self.assertEqual(rollups.rebuild_daily_buckets(dry_run=True), [])
+        self.assertEqual(rollups.rebuild_user_stats(dry_run=True), [])
+
+    def test_rating_without_a_network(self):
+        rating = NetworkRating.objects.create(user=self.user, rating=Decimal('3'), review='No network picked')
+        Comment.objects.create(user=self.user, content='Which network?', network_rating=rating)
+
+        self.assertFalse(NetworkRatingStats.objects.exists())
+        summary = UserRatingStats.objects.get(user=self.user)
+        self.assertEqual((summary.rating_count, summary.networks_rated), (1, 0))
+        self.assertNoDrift()
+
+        rating.delete()
+        self.assertEqual(UserRatingStats.objects.get(user=self.user).rating_count, 0)
+        self.assertNoDrift()
+
+    def test_network_set_later(self):
+        rating = NetworkRating.objects.create(user=self.user, rating=Decimal('4'), review='No network picked')
+        Comment.objects.create(user=self.user, content='Which network?', network_rating=rating)
+
+        rating.network = self.network
+        rating.save()
+        stats = NetworkRatingStats.objects.get(network=self.network)
+        self.assertEqual((stats.rating_count, stats.count_4, stats.comment_count), (1, 1, 1))
+        self.assertNoDrift()
+
+        rating.network = None
+        rating.save()
+        stats.refresh_from_db()
+        self.assertEqual((stats.rating_count, stats.comment_count), (0, 0))
+        self.assertNoDrift()
+
+    def test_rebuild_skips_ratings_without_a_network(self):
+        NetworkRating.objects.create(user=self.user, rating=Decimal('5'), review='No network picked')
+        NetworkRatingStats.objects.all().delete()
+
+        rollups.rebuild_network_stats()
+        rollups.rebuild_daily_buckets()
+        self.assertEqual(list(NetworkRatingStats.objects.values_list('network_id', 'rating_count')), [(self.network.id, 0)])
+        self.assertNoDrift()
+
+
+class NetworkStatisticsHelperTests(TestCase):
+    """Statistics helpers read the rollup and the daily buckets"""
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.network = Network.objects.create(name='MTN', image='uploads/mtn.png', status=True, slug='mtn')
+        now = timezone.now()
+        for index, (stars, age) in enumerate([(5, 0), (4, 3), (2, 20), (1, 45)]):
+            rating = NetworkRating.objects.create(
+                user=User.objects.create(username=f'user{index}'), network=cls.network,
+                rating=Decimal(stars), review='Coverage review',
+            )
+            NetworkRating.objects.filter(pk=rating.pk).update(created_at=now - timedelta(days=age))
+        rollups.rebuild_network_stats()
+        rollups.rebuild_daily_buckets()
+
+    def test_average_rating(self):
+        with self.assertNumQueries(2):
+            stats = calculate_network_average_rating(self.network.id)
+        self.assertEqual(stats, {
+            'average_rating': 3.0,
+            'total_ratings': 4,
+            'rating_distribution': {'1': 1, '2': 1, '3': 0, '4': 1, '5': 1},
+            'recent_average': 3.67,
+        })
+
+    def test_average_rating_without_ratings(self):
+        network = Network.objects.create(name='Glo', image='uploads/glo.png', status=True, slug='glo')
+        with self.assertNumQueries(1):
+            self.assertEqual(calculate_network_average_rating(network.id)['total_ratings'], 0)
+
+    def test_insights_share_the_trend_and_windows(self):
+        insights = get_network_performance_insights(self.network.id)
+        self.assertEqual(insights['trend_analysis'], calculate_network_trend(self.network.id, 30))
+        self.assertEqual(insights['trend_analysis']['recent_ratings_count'], 3)
+        self.assertEqual(insights['recent_activity'], 2)
+        self.assertEqual(insights['recent_average'], calculate_network_average_rating(self.network.id)['recent_average'])
+
+
+class StatisticsEngineTests(TestCase):
+    """Conditional-aggregation statistics over subsets of ratings"""
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.mtn = Network.objects.create(name='MTN', image='uploads/mtn.png', status=True, slug='mtn')
+        cls.glo = Network.objects.create(name='Glo', image='uploads/glo.png', status=True, slug='glo')
+        now = timezone.now()
+        # (network, stars, age in days, near Lagos)
+        rows = [
+            (cls.mtn, 5, 1, True), (cls.mtn, 4, 10, True), (cls.mtn, 2, 20, True), (cls.mtn, 1, 60, False),
+            (cls.glo, 3, 2, True), (cls.glo, 4, 40, True), (cls.glo, 5, 3, False),
+        ]
+        for index, (network, stars, age, near) in enumerate(rows):
+            point = {'latitude': Decimal('6.5244'), 'longitude': Decimal('3.3792')} if near else {}
+            rating = NetworkRating.objects.create(
+                user=User.objects.create(username=f'user{index}'), network=network,
+                rating=Decimal(stars), review='Coverage review', **point,
+            )
+            NetworkRating.objects.filter(pk=rating.pk).update(created_at=now - timedelta(days=age))
+        NetworkRating.objects.create(
+            user=User.objects.create(username='unattached'), network=None, rating=Decimal('1'), review='Coverage review',
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_every_network_in_one_query(self):
+        with self.assertNumQueries(1):
+            stats = aggregate_networks_stats()
+        self.assertEqual(set(stats), {self.mtn.id, self.glo.id})
+        mtn = stats[self.mtn.id]
+        self.assertEqual(
+            (mtn['total_ratings'], mtn['average_rating'], mtn['last_7_count'], mtn['last_30_count'], mtn['trend_count']),
+            (4, 3.0, 1, 3, 3),
+        )
+        self.assertEqual(mtn['rating_distribution'], {'1': 1, '2': 1, '3': 0, '4': 1, '5': 1})
+        self.assertEqual((mtn['first_half_avg'], mtn['second_half_avg']), (2.0, 4.5))
+        self.assertEqual(aggregate_network_stats(self.glo.id), stats[self.glo.id])
+
+    def test_subset_and_requested_networks(self):
+        other = Network.objects.create(name='Airtel', image='uploads/airtel.png', status=True, slug='airtel')
+        nearby = NetworkRating.objects.filter(latitude__isnull=False)
+        stats = aggregate_networks_stats([self.mtn.id, other.id], ratings=nearby)
+        self.assertEqual(stats[self.mtn.id]['total_ratings'], 3)
+        self.assertEqual(stats[other.id], empty_network_stats())
+
+    def test_statistics_report_recent_activity(self):
+        networks = {
+            network['id']: network for network in self.client.get('/api/network/statistics/').json()['networks']
+        }
+        mtn = networks[self.mtn.id]
+        self.assertEqual((mtn['total_reviews'], mtn['reviews_last_7_days'], mtn['reviews_last_30_days']), (4, 1, 3))
+        self.assertEqual(mtn['recent_average'], 3.7)
+
+    @mock.patch('core.views.get_location_data', return_value=('Lagos, Nigeria', 3.3792, 6.5244))
+    def test_recommendations_aggregate_the_nearby_ratings(self, _):
+        data = self.client.get('/api/network/recommendations/?radius=5').json()
+        recommendations = data['recommendations']
+        self.assertEqual([item['network']['id'] for item in recommendations], [self.mtn.id, self.glo.id])
+        self.assertEqual([item['review_count'] for item in recommendations], [3, 2])
+        self.assertEqual([item['average_rating'] for item in recommendations], [3.7, 3.5])
+        self.assertEqual([review['rating'] for review in recommendations[0]['recent_reviews']], ['2.0', '4.0', '5.0'])
+        self.assertEqual(recommendations[0]['network']['image'], '/media/uploads/mtn.png')
+
+        data = self.client.get('/api/network/recommendations/?radius=5&min_reviews=3').json()
+        self.assertEqual([item['network']['id'] for item in data['recommendations']], [self.mtn.id])
+
+    def test_location_rankings(self):
+        rankings = get_location_based_network_rankings(6.5244, 3.3792, 5)
+        self.assertEqual(
+            [(ranking['slug'], ranking['average_rating'], ranking['total_ratings']) for ranking in rankings],
+            [('mtn', 3.67, 3), ('glo', 3.5, 2)],
+        )
+
+
+class UserRatingSummaryTests(TestCase):
+    """get_user_rating_summary"""
+
+    def test_favorite_rating_is_the_exact_value(self):
+        user = get_user_model().objects.create(username='rater')
+        for index, stars in enumerate(('3.5', '4.0', '3.5', '4.0', '1.5')):
+            network = Network.objects.create(name=f'Network {index}', image='uploads/network.png', status=True, slug=f'network-{index}')
+            NetworkRating.objects.create(user=user, network=network, rating=Decimal(stars), review='Coverage review')
+
+        summary = get_user_rating_summary(user.id)
+        self.assertEqual(summary, {
+            'total_ratings': 5,
+            'average_rating_given': 3.3,
+            'networks_rated': 5,
+            'recent_activity': 5,
+            'favorite_rating': '3.5',
+        })
+
+    def test_without_ratings(self):
+        user = get_user_model().objects.create(username='rater')
+        self.assertIsNone(get_user_rating_summary(user.id)['favorite_rating'])
+
+
+class DataVersionTests(TestCase):
+    """Version counters of the response cache"""
+
+    def test_bump_moves_only_the_bumped_data_set(self):
+        ratings, networks = response_cache.versions(('ratings', 'networks'))
+        response_cache.bump('ratings')
+        response_cache.bump('ratings')
+        self.assertEqual(response_cache.versions(('ratings', 'networks')), (ratings + 2, networks))
+
+    def test_versions_outlive_the_cache(self):
+        response_cache.bump('ratings')
+        versions, last_modified = response_cache.stamps(DATA_SETS)
+        cache.clear()
+        self.assertEqual(response_cache.stamps(DATA_SETS), (versions, last_modified))
+
+    def test_bump_creates_a_missing_counter(self):
+        start = time.time_ns()
+        response_cache.bump('devices')
+        self.assertGreater(response_cache.versions(('devices',))[0], start)
+
+
+class SingleFlightTests(SimpleTestCase):
+    """Single-flight recomputation of missing response cache entries"""
+
+    def setUp(self):
+        cache.clear()
+        self.flights = SingleFlight(lock_timeout=30, poll_interval=0.01)
+        self.responses = ResponseCache(ttl=60, stale_ttl=600, wait_timeout=2, flights=self.flights)
+        stamps = mock.patch.object(self.responses, 'stamps', return_value=((1,), 0.0))
+        stamps.start()
+        self.addCleanup(stamps.stop)
+
+    def run_concurrently(self, count, target):
+        barrier = threading.Barrier(count)
+        results = [None] * count
+
+        def run(index):
+            barrier.wait()
+            results[index] = target()
+
+        threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_misses_compute_once(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return {'answer': 42}
+
+        results = self.run_concurrently(
+            12, lambda: self.responses.get_or_compute('answer', {}, ('ratings',), compute),
+        )
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'answer': 42}] * 12)
+        stats = self.responses.stats()
+        self.assertEqual((stats['misses'], stats['coalesced']), (1, 11))
+
+    def test_waiters_compute_themselves_after_the_timeout(self):
+        self.responses.wait_timeout = 0.1
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            if len(calls) == 1:
+                release.wait(5)
+            return len(calls)
+
+        leader = threading.Thread(target=self.responses.get_or_compute, args=('slow', {}, ('ratings',), compute))
+        leader.start()
+        while not calls:
+            time.sleep(0.01)
+        started = time.monotonic()
+        self.assertEqual(self.responses.get_or_compute('slow', {}, ('ratings',), compute), 2)
+        self.assertLess(time.monotonic() - started, 2)
+        release.set()
+        leader.join()
+        self.assertEqual(len(calls), 2)
+
+    def test_waiters_get_the_previous_result_while_refreshing(self):
+        self.responses.get_or_compute('answer', {}, ('ratings',), lambda: 'old')
+        self.responses.stamps.return_value = ((2,), 0.0)
+        key, _ = self.responses.make_keys('answer', {}, (2,))
+        token = self.flights.acquire(key)
+        try:
+            self.assertEqual(self.responses.get_or_compute('answer', {}, ('ratings',), lambda: 'new'), 'old')
+        finally:
+            self.flights.release(key, token)
+        self.assertEqual(self.responses.get_or_compute('answer', {}, ('ratings',), lambda: 'new'), 'new')
+
+    def test_waiters_stop_when_the_local_leader_fails(self):
+        token = self.flights.acquire('key')
+        timer = threading.Timer(0.05, self.flights.release, args=('key', token))
+        timer.start()
+        started = time.monotonic()
+        self.assertIs(self.flights.wait('key', 5, lambda: MISSING), MISSING)
+        self.assertLess(time.monotonic() - started, 2)
+        timer.join()
+
+    def test_leader_in_another_worker(self):
+        other_worker = SingleFlight(lock_timeout=30, poll_interval=0.01)
+        token = other_worker.acquire('key')
+        self.assertIsNotNone(token)
+        self.assertIsNone(self.flights.acquire('key'))
+
+        started = time.monotonic()
+        self.assertIs(self.flights.wait('key', 0.1, lambda: MISSING), MISSING)
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+
+        result = []
+        threading.Timer(0.05, result.append, args=('done',)).start()
+        self.assertEqual(self.flights.wait('key', 2, lambda: result[0] if result else MISSING), 'done')
+
+        other_worker.release('key', token)
+        self.assertIsNotNone(self.flights.acquire('key'))
+
+    def test_release_keeps_a_lock_taken_over_after_expiry(self):
+        token = self.flights.acquire('key')
+        cache.set(SingleFlight.key_prefix + 'key', 'other-worker')
+        self.flights.release('key', token)
+        self.assertEqual(cache.get(SingleFlight.key_prefix + 'key'), 'other-worker')
+
+
+class ConditionalGetTests(TestCase):
+    """ETag and Last-Modified of cached, polled endpoints"""
+
+    url = '/api/network/statistics/'
+
+    def setUp(self):
+        cache.clear()
+        Network.objects.create(name='MTN', image='uploads/mtn.png', status=True, slug='mtn')
+        self.client = APIClient()
+
+    def test_unchanged_data_is_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        response_cache.bump('ratings')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_stale_body_keeps_its_validators(self):
+        first = self.client.get(self.url)
+        response_cache.bump('ratings')
+
+        # Another worker is recomputing the entry, so the previous one is served
+        with mock.patch.object(response_cache.flights, 'acquire', return_value=None):
+            stale = self.client.get(self.url)
+            self.assertEqual(stale.json(), first.json())
+            self.assertEqual(stale['ETag'], first['ETag'])
+            self.assertEqual(stale['Last-Modified'], first['Last-Modified'])
+            revalidated = self.client.get(self.url, HTTP_IF_NONE_MATCH=stale['ETag'])
+            self.assertEqual(revalidated.status_code, 200)
+
+        fresh = self.client.get(self.url, HTTP_IF_NONE_MATCH=stale['ETag'])
+        self.assertEqual(fresh.status_code, 200)
+        self.assertNotEqual(fresh['ETag'], stale['ETag'])
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=fresh['ETag']).status_code, 304)
+
+
+class SearchTests:
+    """
+    Search behaviour shared by every backend. Subclasses pick the backend;
+    `ranked` says whether it orders results by relevance.
+    """
+    ranked = True
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.mtn = Network.objects.create(name='MTN Nigeria', image='uploads/mtn.png', status=True, slug='mtn')
+        cls.glo = Network.objects.create(name='Glo', image='uploads/glo.png', status=True, slug='glo')
+        reviews = [
+            (cls.mtn, 'Fast downloads but calls drop', 'Yaba, Lagos'),
+            (cls.mtn, 'Signal is weak indoors', 'Ikeja, Lagos'),
+            (cls.glo, 'Cheap data, slow downloads', 'Wuse, Abuja'),
+            (cls.glo, 'Great coverage around MTN headquarters', 'Ikoyi, Lagos'),
+        ]
+        cls.ratings = [
+            NetworkRating.objects.create(
+                user=User.objects.create(username=f'user{index}'), network=network,
+                rating=Decimal('3'), review=review, address=address,
+            )
+            for index, (network, review, address) in enumerate(reviews)
+        ]
+
+    def search(self, text):
+        return set(search_ratings(NetworkRating.objects.all(), text).values_list('id', flat=True))
+
+    def ids(self, *indexes):
+        return {self.ratings[index].id for index in indexes}
+
+    def test_matches_review_network_and_address(self):
+        self.assertEqual(self.search('indoors'), self.ids(1))
+        self.assertEqual(self.search('glo'), self.ids(2, 3))
+        self.assertEqual(self.search('abuja'), self.ids(2))
+
+    def test_matches_prefixes_case_insensitively(self):
+        self.assertEqual(self.search('DOWNLOAD'), self.ids(0, 2))
+
+    def test_every_term_must_match(self):
+        self.assertEqual(self.search('downloads lagos'), self.ids(0))
+        self.assertEqual(self.search('downloads kano'), set())
+
+    def test_query_without_words_matches_nothing(self):
+        self.assertEqual(self.search(' ?! '), set())
+
+    def test_index_follows_writes(self):
+        rating = self.ratings[1]
+        rating.review = 'Signal is great outdoors'
+        rating.save()
+        self.assertEqual(self.search('outdoors'), self.ids(1))
+        self.assertEqual(self.search('indoors'), set())
+
+        Network.objects.filter(pk=self.glo.pk).update(name='Globacom')
+        self.assertEqual(self.search('globacom'), self.ids(2, 3))
+
+        self.ratings[2].delete()
+        self.assertEqual(self.search('globacom'), self.ids(3))
+
+    def test_network_name_ranks_first(self):
+        if not self.ranked:
+            self.skipTest("results are not ranked")
+        ranked = search_ratings(NetworkRating.objects.all(), 'mtn').order_by('-search_rank')
+        self.assertEqual(self.search('mtn'), self.ids(0, 1, 3))
+        self.assertEqual(ranked.last().id, self.ratings[3].id)
+
+
+@skipUnless(connection.vendor == 'sqlite', "SQLite only")
+class SQLiteSearchTests(SearchTests, TestCase):
+    """FTS5 index"""
+
+    def test_backend(self):
+        self.assertIsInstance(active_backend(connection), SQLiteSearch)
+
+
+@skipUnless(connection.vendor == 'postgresql', "PostgreSQL only")
+class PostgresSearchTests(SearchTests, TestCase):
+    """tsvector column"""
+
+    def test_backend(self):
+        self.assertIsInstance(active_backend(connection), PostgresSearch)
+
+
+class FallbackSearchTests(SearchTests, TestCase):
+    """Unindexed search"""
+    ranked = False
+
+    def setUp(self):
+        backend = mock.patch('core.search.active_backend', return_value=FallbackSearch())
+        backend.start()
+        self.addCleanup(backend.stop)
+
+
+class QueryPlanTests(TestCase):
+    """The hot rating queries are served by an index"""
+
+    def test_hot_queries_use_an_index(self):
+        try:
+            results = check_query_plans(connection.alias)
+        except NotImplementedError as e:
+            self.skipTest(str(e))
+        self.assertEqual(len(results), len(HOT_QUERIES))
+        for result in results:
+            with self.subTest(result['name']):
+                self.assertEqual(result['full_scans'], [], result['plan'])
+
+
+class RollupBackfillMigrationTests(TransactionTestCase):
+    """Migrations 0012 and later backfill the rollups of existing ratings"""
+
+    def tearDown(self):
+        call_command('migrate', verbosity=0)
+
+    def migrate_to(self, migration):
+        """Migrate core back to `migration` and return its historical apps"""
+        call_command('migrate', 'core', migration.split('_')[0], verbosity=0)
+        return MigrationExecutor(connection).loader.project_state(('core', migration)).apps
+
+    def test_stats_skip_ratings_without_a_network(self):
+        apps = self.migrate_to('0011_comment_like_count')
+        User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+        Network, NetworkRating, Comment = (apps.get_model('core', name) for name in ('Network', 'NetworkRating', 'Comment'))
+        user = User.objects.create(username='rater')
+        network = Network.objects.create(name='MTN', image='uploads/mtn.png', status=True, slug='mtn')
+        rated = NetworkRating.objects.create(user=user, network=network, rating=Decimal('4'), review='Review')
+        orphan = NetworkRating.objects.create(user=user, network=None, rating=Decimal('2'), review='Review')
+        for rating in (rated, orphan):
+            Comment.objects.create(user=user, content='Same here', network_rating=rating)
+
+        call_command('migrate', 'core', '0012', verbosity=0)
+
+        stats = NetworkRatingStats.objects.get(network=network.pk)
+        self.assertEqual((stats.rating_count, stats.count_4, stats.comment_count), (1, 1, 1))
+
+    def test_daily_buckets_skip_ratings_without_a_network(self):
+        apps = self.migrate_to('0012_networkratingstats')
+        User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+        Network, NetworkRating = (apps.get_model('core', name) for name in ('Network', 'NetworkRating'))
+        user = User.objects.create(username='rater')
+        network = Network.objects.create(name='MTN', image='uploads/mtn.png', status=True, slug='mtn')
+        NetworkRating.objects.create(user=user, network=network, rating=Decimal('4'), review='Review')
+        NetworkRating.objects.create(user=user, network=None, rating=Decimal('2'), review='Review')
+
+        call_command('migrate', 'core', '0013', verbosity=0)
+
+        self.assertEqual(
+            list(NetworkRatingDay.objects.values_list('network_id', 'rating_count', 'count_4')), [(network.pk, 1, 1)],
+        )
+
+
+@skipUnless(connection.vendor in ('sqlite', 'postgresql'), "No full-text index on this backend")
+class SearchIndexMigrationTests(TransactionTestCase):
+    """Migration 0015 indexes existing ratings; `rebuild_search_index` restores the index"""
+
+    def tearDown(self):
+        call_command('migrate', verbosity=0)
+
+    def search(self, text):
+        return list(search_ratings(NetworkRating.objects.all(), text).values_list('id', flat=True))
+
+    def test_install_and_uninstall(self):
+        call_command('migrate', 'core', '0014', verbosity=0)
+        apps = MigrationExecutor(connection).loader.project_state(('core', '0014_userratingstats')).apps
+        self.assertFalse(search_backend(connection).installed(connection))
+        User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+        Network = apps.get_model('core', 'Network')
+        network = Network.objects.create(name='MTN Nigeria', image='uploads/mtn.png', status=True, slug='mtn')
+        rating = apps.get_model('core', 'NetworkRating').objects.create(
+            user=User.objects.create(username='rater'), network=network, rating=Decimal('4'),
+            review='Signal is weak indoors', address='Yaba, Lagos',
+        )
+
+        call_command('migrate', verbosity=0)
+        backend = search_backend(connection)
+        self.assertTrue(backend.installed(connection))
+        self.assertFalse(backend.suspended(connection))
+        self.assertIsInstance(active_backend(connection), type(backend))
+        for text in ('mtn', 'indoors', 'yaba'):
+            self.assertEqual(self.search(text), [rating.pk])
+
+        call_command('migrate', 'core', '0014', verbosity=0)
+        self.assertFalse(search_backend(connection).installed(connection))
+
+    def test_rebuild_command_puts_back_suspended_triggers(self):
+        backend = search_backend(connection)
+        backend.suspend(connection)
+        rating = NetworkRating.objects.create(
+            user=get_user_model().objects.create(username='rater'), rating=Decimal('4'), review='Weak indoors',
+        )
+
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        self.assertFalse(backend.suspended(connection))
+        self.assertEqual(self.search('indoors'), [rating.pk])
+        rating.review = 'Strong outdoors'
+        rating.save()
+        self.assertEqual(self.search('outdoors'), [rating.pk])
+
+
+class DuplicateRatingMigrationTests(TransactionTestCase):
+    """Migration 0016 keeps one rating per user and network"""
+
+    def tearDown(self):
+        call_command('migrate', verbosity=0)
+
+    def test_keeps_the_newest_rating_and_its_siblings_comments(self):
+        call_command('migrate', 'core', '0015', verbosity=0)
+        apps = MigrationExecutor(connection).loader.project_state(('core', '0015_rating_search_index')).apps
+        User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+        Network = apps.get_model('core', 'Network')
+        NetworkRating = apps.get_model('core', 'NetworkRating')
+        Comment = apps.get_model('core', 'Comment')
+
+        user = User.objects.create(username='rater')
+        other = User.objects.create(username='other')
+        network = Network.objects.create(name='MTN', image='uploads/mtn.png', status=True, slug='mtn')
+        now = timezone.now()
+        ratings = [
+            NetworkRating.objects.create(user=user, network=network, rating=stars, review='Review', created_at=now)
+            for stars in (Decimal('2'), Decimal('5'), Decimal('3'))
+        ]
+        for age, rating in zip((3, 1, 2), ratings):
+            NetworkRating.objects.filter(pk=rating.pk).update(created_at=now - timedelta(days=age))
+        NetworkRating.objects.create(user=other, network=network, rating=Decimal('4'), review='Review')
+        for rating in ratings:
+            Comment.objects.create(user=other, content='Same here', network_rating=rating)
+
+        call_command('migrate', 'core', '0016', verbosity=0)
+
+        kept = ratings[1]
+        self.assertEqual(
+            list(NetworkRating.objects.filter(user=user.pk).values_list('id', flat=True)), [kept.pk],
+        )
+        self.assertEqual(Comment.objects.filter(network_rating=kept.pk).count(), 3)
+
+        call_command('migrate', verbosity=0)
+        self.assertEqual(rollups.rebuild_network_stats(dry_run=True), [])
+        self.assertEqual(rollups.rebuild_daily_buckets(dry_run=True), [])
+        # Only the summaries of users with duplicates are recomputed; the
+        # other rating was written without signals
+        drifted_users = [drift['user_id'] for drift in rollups.rebuild_user_stats(dry_run=True)]
+        self.assertEqual(drifted_users, [other.pk])
+        stats = NetworkRatingStats.objects.get(network=network.pk)
+        self.assertEqual((stats.rating_count, stats.count_5, stats.comment_count), (2, 1, 3))
+
+
+class RatingBatchTests(TestCase):
+    """POST /ratings/batch/"""
+
+    url = '/api/network/ratings/batch/'
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.user = User.objects.create(username='partner')
+        cls.networks = [
+            Network.objects.create(name=f'Network {index}', image='uploads/network.png', status=True, slug=f'network-{index}')
+            for index in range(3)
+        ]
+        cls.device = NetworkDevice.objects.create(name='Pixel 7', slug='pixel-7')
+        NetworkRating.objects.create(user=cls.user, network=cls.networks[0], rating=Decimal('3'), review='Rated before')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_mixed_batch(self):
+        items = [
+            {'network_id': self.networks[1].id, 'rating': '4.0', 'review': 'Good coverage in Yaba',
+             'device_id': self.device.id, 'latitude': '6.5244', 'longitude': '3.3792'},
+            {'network_id': self.networks[0].id, 'rating': '5.0', 'review': 'Rated this one already'},
+            {'network_id': self.networks[1].id, 'rating': '2.0', 'review': 'Second rating in the batch'},
+            {'network_id': 999, 'rating': '2.0', 'review': 'Unknown network here'},
+            {'network_id': self.networks[2].id, 'rating': '3.0', 'review': 'Unknown device here', 'device_id': 999},
+            {'network_id': self.networks[2].id, 'rating': '7.0', 'review': 'Out of range'},
+            {'network_id': self.networks[2].id, 'rating': '1.0', 'review': 'Weak signal at home'},
+        ]
+        response = self.client.post(self.url, {'ratings': items}, format='json')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['created'], data['failed']), (2, 5))
+        self.assertEqual(
+            [result['status'] for result in data['results']],
+            ['created', 'error', 'error', 'error', 'error', 'error', 'created'],
+        )
+        results = data['results']
+        self.assertIn('non_field_errors', results[1]['errors'])
+        self.assertIn('non_field_errors', results[2]['errors'])
+        self.assertIn('network_id', results[3]['errors'])
+        self.assertIn('device_id', results[4]['errors'])
+        self.assertIn('rating', results[5]['errors'])
+
+        rating = NetworkRating.objects.get(pk=results[0]['id'])
+        self.assertEqual((rating.device_id, rating.user_id, rating.location_pending), (self.device.id, self.user.id, False))
+        self.assertIsNotNone(rating.geohash)
+
+        self.assertEqual(rollups.rebuild_network_stats(dry_run=True), [])
+        self.assertEqual(rollups.rebuild_daily_buckets(dry_run=True), [])
+        self.assertEqual(rollups.rebuild_user_stats(dry_run=True), [])
+        self.assertEqual(UserRatingStats.objects.get(user=self.user).rating_count, 3)
+
+    def test_conflicting_chunk_is_retried_one_rating_at_a_time(self):
+        items = [
+            {'network_id': network.id, 'rating': '4.0', 'review': 'Decent coverage'} for network in self.networks[1:]
+        ]
+        # A rating stored concurrently, after the batch was validated
+        validate = ingest.validate_rating_batch
+
+        def validate_then_race(*args, **kwargs):
+            result = validate(*args, **kwargs)
+            NetworkRating.objects.create(user=self.user, network=self.networks[2], rating=Decimal('2'), review='Stored meanwhile')
+            return result
+
+        with mock.patch('core.ingest.validate_rating_batch', validate_then_race):
+            data = self.client.post(self.url, {'ratings': items}, format='json').json()
+        self.assertEqual([result['status'] for result in data['results']], ['created', 'error'])
+        self.assertEqual(rollups.rebuild_network_stats(dry_run=True), [])
+        self.assertEqual(rollups.rebuild_user_stats(dry_run=True), [])
+
+    def test_only_staff_rate_for_others(self):
+        other = get_user_model().objects.create(username='other')
+        item = {'network_id': self.networks[1].id, 'rating': '4.0', 'review': 'On behalf of', 'user_id': other.id}
+        data = self.client.post(self.url, {'ratings': [item]}, format='json').json()
+        self.assertIn('user_id', data['results'][0]['errors'])
+
+    def test_rejects_malformed_batches(self):
+        self.assertEqual(self.client.post(self.url, {'ratings': []}, format='json').status_code, 400)
+        with override_settings(RATING_BATCH_MAX_ITEMS=1):
+            items = [{'network_id': self.networks[1].id, 'rating': '4.0', 'review': 'Too many'}] * 2
+            self.assertEqual(self.client.post(self.url, {'ratings': items}, format='json').status_code, 400)
+
+
+class RatingExportTests(TestCase):
+    """GET /ratings/export/"""
+
+    url = '/api/network/ratings/export/'
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.staff = User.objects.create(username='staff', is_staff=True)
+        network = Network.objects.create(name='MTN', image='uploads/mtn.png', status=True, slug='mtn')
+        for index in range(3):
+            NetworkRating.objects.create(
+                user=User.objects.create(username=f'user{index}'), network=network,
+                rating=Decimal(index + 1), review='Coverage review',
+            )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def export(self, query):
+        response = self.client.get(self.url + query)
+        return response, b''.join(response.streaming_content).decode() if response.streaming else None
+
+    def test_ndjson(self):
+        response, body = self.export('')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([row['rating'] for row in rows], ['1.0', '2.0', '3.0'])
+
+    def test_csv_with_output_or_format(self):
+        for query in ('?output=csv', '?format=csv'):
+            with self.subTest(query):
+                response, body = self.export(query)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+                self.assertEqual(len(body.splitlines()), 4)
+
+    def test_unknown_format(self):
+        response, _ = self.export('?format=xml')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'Invalid parameters')
+
+    def test_staff_only(self):
+        self.client.force_authenticate(get_user_model().objects.create(username='member'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+class RatingImportTests(TestCase):
+    """manage.py import_ratings"""
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.users = [User.objects.create(username=f'user{index}') for index in range(3)]
+        cls.networks = [
+            Network.objects.create(name=f'Network {index}', image='uploads/network.png', status=True, slug=f'network-{index}')
+            for index in range(2)
+        ]
+
+    def import_file(self, records, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'ratings.jsonl')
+            with open(path, 'w') as source:
+                source.writelines(json.dumps(record) + '\n' for record in records)
+            errors = os.path.join(directory, 'errors.jsonl')
+            call_command('import_ratings', path, errors=errors, stdout=io.StringIO(), **options)
+            with open(errors) as rejected:
+                return [json.loads(line) for line in rejected]
+
+    def test_keeps_historical_timestamps(self):
+        records = [{
+            'username': 'user0', 'network': 'Network 0', 'rating': '4.0', 'review': 'Good coverage in Yaba',
+            'created_at': '2023-01-02T10:00:00+00:00',
+            'comments': [{
+                'username': 'user1', 'content': 'Agreed', 'created_at': '2023-01-03T10:00:00+00:00',
+                'replies': [{'username': 'user2', 'content': 'Not here', 'created_at': '2023-01-04T10:00:00+00:00'}],
+            }],
+        }]
+        self.assertEqual(self.import_file(records), [])
+
+        rating = NetworkRating.objects.get(user=self.users[0])
+        self.assertEqual(rating.created_at.isoformat(), '2023-01-02T10:00:00+00:00')
+        self.assertEqual(
+            [(comment.created_at.isoformat(), comment.updated_at.isoformat())
+             for comment in Comment.objects.filter(network_rating=rating).order_by('id')],
+            [('2023-01-03T10:00:00+00:00',) * 2, ('2023-01-04T10:00:00+00:00',) * 2],
+        )
+        # auto_now fields still apply to later writes
+        self.assertGreater(Comment.objects.create(network_rating=rating, user=self.users[0], content='New').created_at,
+                           rating.created_at + timedelta(days=365))
+        self.assertEqual(rollups.rebuild_network_stats(dry_run=True), [])
+        self.assertEqual(rollups.rebuild_daily_buckets(dry_run=True), [])
+        self.assertEqual(rollups.rebuild_user_stats(dry_run=True), [])
+
+    def test_rating_stored_meanwhile_is_rejected(self):
+        records = [
+            {'username': f'user{index}', 'network': 'Network 1', 'rating': '3.0', 'review': 'Imported coverage review',
+             'comments': [{'username': 'user2', 'content': 'Same here'}]}
+            for index in range(2)
+        ]
+        # A rating stored concurrently, after the chunk was validated
+        validate = RatingImporter.validate
+
+        def validate_then_race(importer, chunk):
+            result = validate(importer, chunk)
+            NetworkRating.objects.create(user=self.users[1], network=self.networks[1], rating=Decimal('2'), review='Stored meanwhile')
+            return result
+
+        with mock.patch.object(RatingImporter, 'validate', validate_then_race):
+            errors = self.import_file(records)
+        self.assertEqual([error['record'] for error in errors], [2])
+        self.assertEqual(Comment.objects.count(), 1)
+        self.assertEqual(rollups.rebuild_network_stats(dry_run=True), [])
+        self.assertEqual(rollups.rebuild_user_stats(dry_run=True), [])
+
+
+class FastSerializerTests(TestCase):
+    """FastSerializer against the DRF serializers it stands in for"""
+
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        cls.users = [User.objects.create(username=f'user{index}') for index in range(3)]
+        cls.networks = [
+            Network.objects.create(name='MTN', image='uploads/mtn.png', status=True, slug='mtn'),
+            Network.objects.create(name='Glo', image='uploads/glo logo.png', status=False, slug='glo'),
+        ]
+        device = NetworkDevice.objects.create(name='Pixel 7', slug='pixel-7')
+        full = NetworkRating.objects.create(
+            user=cls.users[0], network=cls.networks[0], device=device, rating=Decimal('4.5'),
+            review='Good coverage in Yaba', address='Yaba, Lagos',
+        )
+        NetworkRating.objects.create(user=cls.users[1], network=cls.networks[1], rating=Decimal('3'), review='No device or address given')
+        for index in range(2):
+            comment = Comment.objects.create(network_rating=full, user=cls.users[index], content=f'Comment {index}')
+            comment.likes.add(cls.users[2])
+            # More replies than the preview shows, so `more_replies` is set on the first comment
+            for reply in range(settings.COMMENT_REPLIES_PREVIEW + 1 - index * 2):
+                Comment.objects.create(network_rating=full, user=cls.users[2], parent=comment, content=f'Reply {reply}')
+            Comment.objects.filter(pk=comment.pk).update(like_count=1)
+
+    def request(self, user=None):
+        request = Request(RequestFactory().get('/api/network/ratings/', HTTP_HOST='testserver'))
+        request.user = user or AnonymousUser()
+        return request
+
+    def assertSameJSON(self, actual, expected):
+        self.assertEqual(JSONRenderer().render(actual), JSONRenderer().render(expected))
+
+    def test_ratings_with_comments(self):
+        for user in (None, self.users[2]):
+            with self.subTest(user=user):
+                ratings = prefetch_ratings(prepare_ratings_queryset(NetworkRating.objects.order_by('id')))
+                context = ratings_serializer_context(self.request(user), ratings)
+                expected = NetworkRatingSerializer(ratings, many=True, context=context).data
+                actual = FastSerializer(context).ratings(ratings)
+                self.assertSameJSON(actual, expected)
+
+                full, bare = actual
+                self.assertIsNone(bare['device'])
+                self.assertIsNone(bare['address'])
+                self.assertEqual(full['network']['image'], 'http://testserver/media/uploads/mtn.png')
+                self.assertEqual(len(full['comments']), 2)
+                self.assertTrue(any(comment['more_replies'] for comment in full['comments']))
+                self.assertEqual(all(comment['liked'] for comment in full['comments']), user is not None)
+
+    def test_ratings_without_comments(self):
+        ratings = prefetch_ratings(prepare_ratings_queryset(NetworkRating.objects.order_by('id')))
+        context = ratings_serializer_context(self.request(), ratings)
+        self.assertSameJSON(
+            FastSerializer(context).ratings(ratings, comments=False),
+            NetworkRatingListSerializer(ratings, many=True, context=context).data,
+        )
+
+    def test_unprepared_rating(self):
+        # Without prefetched threads or a liked set, comments are queried per rating
+        rating = NetworkRating.objects.get(user=self.users[0])
+        context = {'request': self.request(self.users[2])}
+        self.assertSameJSON(FastSerializer(context).rating(rating), NetworkRatingSerializer(rating, context=context).data)
+
+    def test_networks_and_devices(self):
+        networks = Network.objects.order_by('id')
+        for context in ({'request': self.request()}, {}):
+            with self.subTest(request='request' in context):
+                self.assertSameJSON(
+                    FastSerializer(context).networks(network_rows(networks)),
+                    NetworkSerializer(networks, many=True, context=context).data,
+                )
+        devices = NetworkDevice.objects.all()
+        self.assertSameJSON(FastSerializer().devices(device_rows(devices)), NetworkDeviceSerializer(devices, many=True).data)
@@ -0,0 +1,156 @@
+"""
+Comment thread assembly for ratings.
+
+All comments shown under a set of ratings are fetched in a single query and
+assembled into parent/reply trees in memory. Both levels are capped in SQL
+with window functions: a DENSE_RANK() over the threads of each rating keeps
+its newest few top-level comments (with their replies), and a ROW_NUMBER()
+over the replies of each comment keeps its first few replies. A rating with
+thousands of comments, or a comment with thousands of replies, only ever
+contributes a few rows; the rest are paged in through the comments and
+replies endpoints.
+"""
+from collections import defaultdict
+from typing import Dict, Iterable, List
+
+from django.conf import settings
+from django.db.models import Case, F, IntegerField, Q, Value, When, Window
+from django.db.models.functions import Coalesce, DenseRank, RowNumber
+
+from core.models import Comment
+
+COMMENT_ORDERING = ('-created_at', '-id')
+REPLY_ORDERING = ('created_at', 'id')
+
+
+def comments_queryset():
+    """Comments with their author, ready for CommentSerializer"""
+    return Comment.objects.select_related('user')
+
+
+def _ranked_replies(queryset, replies_limit: int):
+    """
+    Annotate `reply_position`, the position of each reply among its
+    comment's (0 for top-level comments), and keep one reply beyond the cap
+    so callers can tell whether more exist.
+    """
+    return (
+        queryset
+        .annotate(
+            reply_rank=Window(
+                RowNumber(),
+                partition_by=[F('parent_id')],
+                order_by=[F(field).asc() for field in REPLY_ORDERING],
+            ),
+        )
+        .annotate(
+            reply_position=Case(
+                When(parent__isnull=True, then=Value(0)),
+                default=F('reply_rank'),
+                output_field=IntegerField(),
+            ),
+        )
+        .filter(reply_position__lte=replies_limit + 1)
+    )
+
+
+def _attach_replies(top_level: List[Comment], replies: Dict[int, List[Comment]], replies_limit: int):
+    for comment in top_level:
+        comment_replies = sorted(replies.get(comment.id, []), key=lambda c: (c.created_at, c.id))
+        comment.has_more_replies = len(comment_replies) > replies_limit
+        comment.prefetched_replies = comment_replies[:replies_limit]
+
+
+def build_comment_threads(rating_ids: Iterable[int], replies_limit: int = None,
+                          comments_limit: int = None) -> Dict[int, List[Comment]]:
+    """
+    Fetch and assemble the comment threads of several ratings in one query.
+
+    Top-level comments are ordered newest first and carry the first
+    `replies_limit` replies (oldest first) in `prefetched_replies`, plus
+    `has_more_replies` when some were left out. Each rating keeps its
+    newest `comments_limit` top-level comments; one more is returned when
+    some were left out.
+
+    Args:
+        rating_ids: IDs of the ratings to build threads for
+        replies_limit: Maximum replies per comment (defaults to COMMENT_REPLIES_PREVIEW)
+        comments_limit: Maximum top-level comments per rating (defaults to COMMENT_PREVIEW)
+
+    Returns:
+        Dictionary mapping rating ID to its list of top-level comments,
+        at most `comments_limit + 1` long
+    """
+    rating_ids = list(rating_ids)
+    if replies_limit is None:
+        replies_limit = settings.COMMENT_REPLIES_PREVIEW
+    if comments_limit is None:
+        comments_limit = settings.COMMENT_PREVIEW
+    if not rating_ids:
+        return {}
+
+    # A comment and its replies share a thread number: the position of the
+    # top-level comment among its rating's, newest first. One thread and one
+    # reply beyond the caps tell us whether more exist.
+    comments = _ranked_replies(
+        comments_queryset()
+        .filter(Q(network_rating_id__in=rating_ids) | Q(parent__network_rating_id__in=rating_ids))
+        .annotate(
+            thread_number=Window(
+                DenseRank(),
+                partition_by=[Coalesce(F('parent__network_rating_id'), F('network_rating_id'))],
+                order_by=[
+                    Coalesce(F('parent__created_at'), F('created_at')).desc(),
+                    Coalesce(F('parent_id'), F('id')).desc(),
+                ],
+            ),
+        ),
+        replies_limit,
+    ).filter(thread_number__lte=comments_limit + 1)
+
+    top_level = []
+    replies = defaultdict(list)
+    for comment in comments:
+        if comment.parent_id is None:
+            top_level.append(comment)
+        else:
+            replies[comment.parent_id].append(comment)
+
+    threads = defaultdict(list)
+    top_level.sort(key=lambda c: (c.created_at, c.id), reverse=True)
+    _attach_replies(top_level, replies, replies_limit)
+    for comment in top_level:
+        threads[comment.network_rating_id].append(comment)
+    return threads
+
+
+def attach_comment_threads(ratings, replies_limit: int = None, comments_limit: int = None):
+    """
+    Set `top_level_comments` on every rating from `build_comment_threads`,
+    plus `has_more_comments` when some were left out.
+    """
+    if comments_limit is None:
+        comments_limit = settings.COMMENT_PREVIEW
+    threads = build_comment_threads([rating.id for rating in ratings], replies_limit, comments_limit)
+    for rating in ratings:
+        thread = threads.get(rating.id, [])
+        rating.has_more_comments = len(thread) > comments_limit
+        rating.top_level_comments = thread[:comments_limit]
+    return ratings
+
+
+def attach_replies(comments, replies_limit: int = None):
+    """
+    Load the first `replies_limit` replies of already-fetched top-level
+    comments in one query, as `build_comment_threads` sets them.
+    """
+    comments = list(comments)
+    if replies_limit is None:
+        replies_limit = settings.COMMENT_REPLIES_PREVIEW
+    if not comments:
+        return comments
+    replies = defaultdict(list)
+    for reply in _ranked_replies(comments_queryset().filter(parent_id__in=[c.id for c in comments]), replies_limit):
+        replies[reply.parent_id].append(reply)
+    _attach_replies(comments, replies, replies_limit)
+    return comments
@@ -0,0 +1,180 @@
+"""
+Rating time series and windowed averages from the daily buckets.
+
+Every query here reads `NetworkRatingDay` rows rather than ratings, so a
+window of a year costs at most 366 small rows per network whatever the
+number of ratings. Windows are whole days in the current time zone and end
+with (and include) the reference day.
+"""
+from collections import OrderedDict
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from core.models import NetworkRatingDay
+
+GRANULARITIES = ('day', 'week', 'month')
+STARS = range(1, 6)
+DEFAULT_WINDOWS = (7, 30, 365)
+
+
+def window_start(days: int, today: date = None) -> date:
+    """First day of the `days`-day window ending on `today`"""
+    today = today or timezone.localdate()
+    return today - timedelta(days=days - 1)
+
+
+def period_start(day: date, granularity: str) -> date:
+    """First day of the day/week/month containing `day` (weeks start on Monday)"""
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def _next_period(start: date, granularity: str) -> date:
+    if granularity == 'week':
+        return start + timedelta(days=7)
+    if granularity == 'month':
+        return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+def _average(total: Decimal, count: int) -> Optional[float]:
+    return round(float(total) / count, 2) if count else None
+
+
+def window_averages(network_id: int, windows: Iterable[int] = DEFAULT_WINDOWS, today: date = None) -> Dict[str, Dict]:
+    """
+    Rating count and average over several trailing windows, in one query.
+
+    Args:
+        network_id: ID of the network
+        windows: Window lengths in days
+        today: Last day of every window (defaults to today)
+
+    Returns:
+        Dictionary mapping the window length (as a string) to a dict with
+        `total_ratings` and `average_rating` (None without ratings)
+    """
+    windows = sorted(set(windows))
+    if not windows:
+        return {}
+    aggregates = {}
+    for days in windows:
+        since = Q(day__gte=window_start(days, today))
+        aggregates[f'count_{days}'] = Sum('rating_count', filter=since)
+        aggregates[f'sum_{days}'] = Sum('rating_sum', filter=since)
+    row = NetworkRatingDay.objects.filter(
+        network_id=network_id,
+        day__gte=window_start(windows[-1], today),
+        day__lte=today or timezone.localdate(),
+    ).aggregate(**aggregates)
+
+    averages = {}
+    for days in windows:
+        count = row[f'count_{days}'] or 0
+        averages[str(days)] = {
+            'total_ratings': count,
+            'average_rating': _average(row[f'sum_{days}'] or 0, count),
+        }
+    return averages
+
+
+def window_trend(network_id: int, days: int = 30, today: date = None) -> Dict:
+    """
+    Rating count and the averages of both halves of a trailing window, in one query.
+
+    Returns:
+        Dictionary with `total_ratings`, `first_half_avg` and `second_half_avg`
+        (0.0 for a half without ratings)
+    """
+    today = today or timezone.localdate()
+    start = window_start(days, today)
+    second_half = Q(day__gte=start + timedelta(days=days // 2))
+    row = NetworkRatingDay.objects.filter(network_id=network_id, day__gte=start, day__lte=today).aggregate(
+        total_ratings=Sum('rating_count'),
+        first_count=Sum('rating_count', filter=~second_half),
+        first_sum=Sum('rating_sum', filter=~second_half),
+        second_count=Sum('rating_count', filter=second_half),
+        second_sum=Sum('rating_sum', filter=second_half),
+    )
+    return {
+        'total_ratings': row['total_ratings'] or 0,
+        'first_half_avg': _average(row['first_sum'] or 0, row['first_count'] or 0) or 0.0,
+        'second_half_avg': _average(row['second_sum'] or 0, row['second_count'] or 0) or 0.0,
+    }
+
+
+def rating_series(network_id: int, start: date, end: date, granularity: str = 'day',
+                  moving_average: int = None) -> List[Dict]:
+    """
+    Ratings of a network per day, week or month, from one bucket query.
+
+    Periods without ratings are included with zero counts. Weeks and months
+    are cut to the requested range, so the first and last points may cover
+    partial periods.
+
+    Args:
+        network_id: ID of the network
+        start: First day of the series
+        end: Last day of the series
+        granularity: 'day', 'week' or 'month'
+        moving_average: If given, add the trailing average over this many
+            days, ending on the last day of each period
+
+    Returns:
+        List of points with `period` (first day), `total_reviews`,
+        `average_rating` (None without ratings), `rating_distribution` and,
+        if requested, `moving_average`
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+
+    fetch_from = start - timedelta(days=moving_average - 1) if moving_average else start
+    days = {
+        bucket['day']: bucket
+        for bucket in NetworkRatingDay.objects.filter(
+            network_id=network_id, day__gte=fetch_from, day__lte=end,
+        ).values('day', 'rating_count', 'rating_sum', *(f'count_{star}' for star in STARS))
+    }
+
+    points = OrderedDict()
+    period = period_start(start, granularity)
+    while period <= end:
+        points[period] = {
+            'period': max(period, start).isoformat(),
+            'total_reviews': 0,
+            'rating_sum': Decimal(0),
+            'rating_distribution': {str(star): 0 for star in STARS},
+            'last_day': min(_next_period(period, granularity) - timedelta(days=1), end),
+        }
+        period = _next_period(period, granularity)
+
+    for day, bucket in days.items():
+        if day < start:
+            continue
+        point = points[period_start(day, granularity)]
+        point['total_reviews'] += bucket['rating_count']
+        point['rating_sum'] += bucket['rating_sum']
+        for star in STARS:
+            point['rating_distribution'][str(star)] += bucket[f'count_{star}']
+
+    series = []
+    for point in points.values():
+        last_day = point.pop('last_day')
+        rating_sum = point.pop('rating_sum')
+        point['average_rating'] = _average(rating_sum, point['total_reviews'])
+        if moving_average:
+            window = [days.get(last_day - timedelta(days=offset)) for offset in range(moving_average)]
+            window = [bucket for bucket in window if bucket]
+            point['moving_average'] = _average(
+                sum((bucket['rating_sum'] for bucket in window), Decimal(0)),
+                sum(bucket['rating_count'] for bucket in window),
+            )
+        series.append(point)
+    return series
@@ -7,16 +7,24 @@ app_name = 'core'
 urlpatterns = [
     path('ratings/', views.NetworkRatingListCreate.as_view(), name="network_rating_list_create"),
     path('ratings/<int:pk>', views.NetworkRatingDetail.as_view(), name="network_rating_detail"),
+    path('ratings/batch/', views.NetworkRatingBatchView.as_view(), name="network_rating_batch"),
+    path('ratings/export/', views.NetworkRatingExportView.as_view(), name="network_rating_export"),
+    path('ratings/<int:pk>/comments/', views.RatingCommentsView.as_view(), name='rating_comments'),
 
     path('comments/', views.CommentView.as_view(), name='add_comment'),
     path('comments/<int:comment_id>/', views.CommentView.as_view(), name='comment-detail'),
     path('comments/<int:comment_id>/like/', views.CommentView.as_view(), name='like_comment'),
+    path('comments/<int:comment_id>/replies/', views.CommentRepliesView.as_view(), name='comment_replies'),
 
     path("devices/", views.DevicesView.as_view(), name="device_view"),
     path("isp-providers/", views.NetworkView.as_view(), name="networks_list_view"),
+    path("isp-providers/autocomplete/", views.NetworkAutocompleteView.as_view(), name="network_autocomplete"),
     
     # New endpoints for statistics and recommendations
     path("statistics/", views.NetworkStatisticsView.as_view(), name="network_statistics"),
     path("statistics/<int:network_id>/", views.NetworkDetailStatsView.as_view(), name="network_detail_stats"),
+    path("statistics/<int:network_id>/series/", views.NetworkRatingSeriesView.as_view(), name="network_rating_series"),
     path("recommendations/", views.LocationBasedRecommendationsView.as_view(), name="location_recommendations"),
+
+    path("cache-stats/", views.CacheStatsView.as_view(), name="cache_stats"),
 ]
\ No newline at end of file
@@ -1,11 +1,20 @@
 import requests
 import os
 from dotenv import load_dotenv
-from geopy.distance import geodesic
-from django.db.models import Avg, Count, Q
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Avg, Count, F, FloatField, Min, Q
+from django.db.models.functions import Cast, Coalesce, NullIf
 from django.utils import timezone
 from datetime import timedelta
-from .models import NetworkRating, Network
+from .models import NetworkRating, NetworkRatingStats, Network, UserRatingStats
+from . import geohash as geo
+from .geoip import GeolocationUnavailable, get_http_session, get_request_timeout, ipstack_breaker, location_cache
+from .ipdb import get_local_database
+from .response_cache import response_cache
+from .stats import aggregate_networks_stats
+from .timeseries import window_averages, window_trend
+from .distance import filter_within_radius, haversine_expression
 from typing import List, Dict, Optional
 
 load_dotenv()
@@ -19,50 +28,164 @@ def get_client_ip(request):
     return ip
 
 
-def get_location_from_ip(ip_address):
+GEOLOCATION_BACKENDS = ('ipstack', 'local', 'local-then-ipstack')
+
+
+def get_location_from_ip(ip_address, refresh=False):
+    """
+    Look up the location of an IP address with the configured backend.
+
+    Args:
+        ip_address: IP address to look up
+        refresh: Skip cached ipstack outcomes and ask the provider again, as
+            a retry after a failed lookup must
+    """
+    backend = settings.IP_GEOLOCATION_BACKEND
+    if backend not in GEOLOCATION_BACKENDS:
+        raise ImproperlyConfigured(
+            f"IP_GEOLOCATION_BACKEND must be one of {', '.join(GEOLOCATION_BACKENDS)}, not {backend!r}"
+        )
+
+    if backend != 'ipstack':
+        database = get_local_database()
+        location = database.lookup(ip_address) if database else None
+        if location or backend == 'local':
+            return location
+
+    if refresh:
+        return location_cache.refresh(ip_address, fetch_location_from_ipstack)
+    return location_cache.get_or_fetch(ip_address, fetch_location_from_ipstack)
+
+
+def fetch_location_from_ipstack(ip_address):
+    if not ipstack_breaker.allow_request():
+        raise GeolocationUnavailable("ipstack circuit is open")
+
     API_KEY = os.getenv("IPKEY")
     BASE_URL = os.getenv("IPSTACK_BASE_URL", "https://api.ipstack.com")  # Default value if not set
     url = f'{BASE_URL}/{ip_address}?access_key={API_KEY}'
+    succeeded = False
     try:
-        response = requests.get(url)
+        response = get_http_session().get(url, timeout=get_request_timeout())
         response.raise_for_status()  # Raises an HTTPError if the HTTP request returned an unsuccessful status code
-        return response.json()
+        data = response.json()
+        if isinstance(data, dict) and data.get('success') is False:
+            # ipstack reports API errors (bad key, quota exceeded) with a 200
+            print(f"Error fetching location data: {data.get('error')}")
+        else:
+            succeeded = True
+            return data
     except requests.RequestException as e:
         # Handle network-related errors here
         print(f"Error fetching location data: {e}")
     except ValueError:
         # Handle JSON decoding error
         print("Error decoding the response JSON")
+    finally:
+        # Whatever happened (including unexpected errors), settle the call so
+        # a half-open trial never stays in flight
+        if succeeded:
+            ipstack_breaker.record_success()
+        else:
+            ipstack_breaker.record_failure()
     return None
 
+def location_from_payload(location):
+    if location and "city" in location and "country_name" in location:
+        addy = f"{location['city']}, {location['country_name']}"
+        longitude = location['longitude']
+        latitude = location['latitude']
+        return addy, longitude, latitude
+    return None
+
+
 def get_location_data(request):
     ip = get_client_ip(request)
     if ip:
-        location = get_location_from_ip(ip)
-        if location and "city" in location and "country_name" in location:
-            addy = f"{location['city']}, {location['country_name']}"
-            longitude = location['longitude']
-            latitude = location['latitude']
-            return addy, longitude, latitude
+        return location_from_payload(get_location_from_ip(ip))
     return None
 
 
 # MEASURE DISTANCE
+
+# Spherical boxes and cells are widened slightly so ellipsoidal (geodesic)
+# distances just inside the radius are never pruned by the SQL prefilter.
+PREFILTER_RADIUS_MARGIN = 1.01
+
+
+def prefilter_nearby(queryset, latitude: float, longitude: float, radius_km: float):
+    """
+    Restrict a NetworkRating queryset to candidates around a point using SQL only.
+
+    Combines a geohash cell cover (range scans on the indexed geohash column)
+    with a latitude/longitude bounding box. Every rating within `radius_km` is
+    kept, plus some just outside it; callers still need an exact distance check.
+
+    Args:
+        queryset: NetworkRating queryset to restrict
+        latitude: Centre latitude
+        longitude: Centre longitude
+        radius_km: Search radius in kilometers
+
+    Returns:
+        Filtered queryset
+    """
+    latitude = float(latitude)
+    longitude = float(longitude)
+    search_radius = float(radius_km) * PREFILTER_RADIUS_MARGIN
+
+    queryset = queryset.filter(latitude__isnull=False, longitude__isnull=False)
+
+    cells = geo.covering_cells(latitude, longitude, search_radius)
+    if cells:
+        cell_filter = Q()
+        for cell in cells:
+            cell_filter |= Q(geohash__gte=cell, geohash__lt=geo.prefix_upper_bound(cell))
+        queryset = queryset.filter(cell_filter)
+
+    min_lat, max_lat, lon_range = geo.bounding_box(latitude, longitude, search_radius)
+    queryset = queryset.filter(latitude__gte=min_lat, latitude__lte=max_lat)
+    if lon_range:
+        queryset = queryset.filter(longitude__gte=lon_range[0], longitude__lte=lon_range[1])
+    return queryset
+
+
+def filter_nearby(queryset, latitude: float, longitude: float, radius_km: float):
+    """
+    Restrict a NetworkRating queryset to ratings within `radius_km` of a point.
+
+    The distance check runs in the database, on the candidates kept by
+    `prefilter_nearby`, so no rows are read here and the query carries no
+    list of IDs; the result is still a lazy queryset, so further filters,
+    ordering and pagination compose with it. Distances are haversine
+    distances on the mean-radius sphere, within 0.56% of the geodesic ones
+    `get_nearby_ratings` uses.
+
+    Args:
+        queryset: NetworkRating queryset to restrict
+        latitude: Centre latitude
+        longitude: Centre longitude
+        radius_km: Search radius in kilometers
+
+    Returns:
+        Filtered queryset
+    """
+    return (
+        prefilter_nearby(queryset, latitude, longitude, radius_km)
+        .alias(distance_km=haversine_expression(latitude, longitude))
+        .filter(distance_km__lte=float(radius_km))
+    )
+
+
 def get_nearby_ratings(user_latitude, user_longitude, radius_km=5):
-    nearby_ratings = []
-    all_ratings =  NetworkRating.objects.filter(
-            latitude__isnull=False,
-            longitude__isnull=False
+    candidates = prefilter_nearby(
+            NetworkRating.objects.select_related('network'),
+            user_latitude,
+            user_longitude,
+            radius_km
         ).order_by("rating")
 
-    for rating in all_ratings:
-        rating_location = (rating.latitude, rating.longitude)
-        user_location = (user_latitude, user_longitude)
-        distance = geodesic(rating_location, user_location).km
-        if distance <= radius_km:
-            nearby_ratings.append(rating)
-
-    return nearby_ratings
+    return filter_within_radius(user_latitude, user_longitude, candidates, radius_km)
 
 
 # RATING CALCULATION UTILITIES
@@ -77,9 +200,18 @@ def calculate_network_average_rating(network_id: int) -> Dict[str, float]:
     Returns:
         Dictionary with rating statistics
     """
-    ratings = NetworkRating.objects.filter(network_id=network_id)
-    
-    if not ratings.exists():
+    stats = NetworkRatingStats.objects.filter(network_id=network_id).first()
+    if stats is None or not stats.rating_count:
+        return _average_rating_summary(stats, None)
+    return _average_rating_summary(stats, window_averages(network_id, (30,))['30'])
+
+
+def _average_rating_summary(stats: Optional[NetworkRatingStats], recent: Optional[Dict]) -> Dict:
+    """
+    Format a network's rollup, and its `window_averages` entry for the last
+    30 days, as `calculate_network_average_rating` reports them
+    """
+    if stats is None or not stats.rating_count:
         return {
             'average_rating': 0.0,
             'total_ratings': 0,
@@ -87,28 +219,11 @@ def calculate_network_average_rating(network_id: int) -> Dict[str, float]:
             'recent_average': 0.0
         }
     
-    # Calculate basic stats
-    stats = ratings.aggregate(
-        avg_rating=Avg('rating'),
-        total_ratings=Count('id')
-    )
-    
-    # Rating distribution
-    rating_distribution = {}
-    for i in range(1, 6):
-        count = ratings.filter(rating=i).count()
-        rating_distribution[str(i)] = count
-    
-    # Recent average (last 30 days)
-    thirty_days_ago = timezone.now() - timedelta(days=30)
-    recent_ratings = ratings.filter(created_at__gte=thirty_days_ago)
-    recent_avg = recent_ratings.aggregate(avg_rating=Avg('rating'))['avg_rating'] or 0.0
-    
     return {
-        'average_rating': round(stats['avg_rating'], 2) if stats['avg_rating'] else 0.0,
-        'total_ratings': stats['total_ratings'],
-        'rating_distribution': rating_distribution,
-        'recent_average': round(recent_avg, 2)
+        'average_rating': round(stats.average_rating, 2),
+        'total_ratings': stats.rating_count,
+        'rating_distribution': stats.rating_distribution,
+        'recent_average': round(recent['average_rating'] or 0.0, 2)
     }
 
 
@@ -123,25 +238,30 @@ def get_top_rated_networks(limit: int = 10, min_ratings: int = 5) -> List[Dict]:
     Returns:
         List of network dictionaries with rating info
     """
-    networks = Network.objects.filter(
-        status=True
-    ).annotate(
-        avg_rating=Avg('networkrating__rating'),
-        total_ratings=Count('networkrating')
-    ).filter(
-        total_ratings__gte=min_ratings
-    ).order_by('-avg_rating')[:limit]
-    
-    return [
-        {
-            'id': network.id,
-            'name': network.name,
-            'slug': network.slug,
-            'average_rating': round(network.avg_rating, 2) if network.avg_rating else 0.0,
-            'total_ratings': network.total_ratings
-        }
-        for network in networks
-    ]
+    def compute():
+        networks = Network.objects.filter(
+            status=True
+        ).annotate(
+            avg_rating=Cast('rating_stats__rating_sum', FloatField()) / NullIf(F('rating_stats__rating_count'), 0),
+            total_ratings=Coalesce(F('rating_stats__rating_count'), 0)
+        ).filter(
+            total_ratings__gte=min_ratings
+        ).order_by(F('avg_rating').desc(nulls_last=True))[:limit]
+
+        return [
+            {
+                'id': network.id,
+                'name': network.name,
+                'slug': network.slug,
+                'average_rating': round(network.avg_rating, 2) if network.avg_rating else 0.0,
+                'total_ratings': network.total_ratings
+            }
+            for network in networks
+        ]
+
+    return response_cache.get_or_compute(
+        'top-rated-networks', {'limit': limit, 'min_ratings': min_ratings}, ('networks', 'ratings'), compute
+    )
 
 
 def get_location_based_network_rankings(latitude: float, longitude: float, 
@@ -157,39 +277,24 @@ def get_location_based_network_rankings(latitude: float, longitude: float,
     Returns:
         List of networks ranked by average rating in the area
     """
-    nearby_ratings = get_nearby_ratings(latitude, longitude, radius_km)
-    
-    if not nearby_ratings:
-        return []
-    
-    # Group ratings by network
-    network_stats = {}
-    for rating in nearby_ratings:
-        if rating.network:
-            net_id = rating.network.id
-            if net_id not in network_stats:
-                network_stats[net_id] = {
-                    'network': rating.network,
-                    'ratings': [],
-                    'total_rating': 0
-                }
-            network_stats[net_id]['ratings'].append(rating.rating)
-            network_stats[net_id]['total_rating'] += float(rating.rating)
+    # Count and average the nearby ratings of every network in one query
+    network_stats = aggregate_networks_stats(
+        ratings=filter_nearby(NetworkRating.objects.all(), latitude, longitude, radius_km)
+    )
+    networks = Network.objects.in_bulk(list(network_stats)) if network_stats else {}
     
-    # Calculate averages and sort
     rankings = []
     for net_id, stats in network_stats.items():
-        avg_rating = stats['total_rating'] / len(stats['ratings'])
         rankings.append({
-            'id': stats['network'].id,
-            'name': stats['network'].name,
-            'slug': stats['network'].slug,
-            'average_rating': round(avg_rating, 2),
-            'total_ratings': len(stats['ratings']),
+            'id': net_id,
+            'name': networks[net_id].name,
+            'slug': networks[net_id].slug,
+            'average_rating': round(stats['average_rating'], 2),
+            'total_ratings': stats['total_ratings'],
             'location_based': True
         })
     
-    return sorted(rankings, key=lambda x: x['average_rating'], reverse=True)
+    return sorted(rankings, key=lambda x: (-x['average_rating'], x['id']))
 
 
 def get_user_rating_summary(user_id: int) -> Dict:
@@ -202,9 +307,9 @@ def get_user_rating_summary(user_id: int) -> Dict:
     Returns:
         Dictionary with user rating statistics
     """
-    ratings = NetworkRating.objects.filter(user_id=user_id)
+    stats = UserRatingStats.objects.filter(user_id=user_id).first()
     
-    if not ratings.exists():
+    if stats is None or not stats.rating_count:
         return {
             'total_ratings': 0,
             'average_rating_given': 0.0,
@@ -213,30 +318,25 @@ def get_user_rating_summary(user_id: int) -> Dict:
             'favorite_rating': None
         }
     
-    stats = ratings.aggregate(
-        total_ratings=Count('id'),
-        avg_rating_given=Avg('rating'),
-        networks_rated=Count('network', distinct=True)
+    # Most frequently given rating, by exact value (ties go to the value
+    # given first)
+    favorite = (
+        NetworkRating.objects
+        .filter(user_id=user_id)
+        .order_by()
+        .values('rating')
+        .annotate(total=Count('id'), first_id=Min('id'))
+        .order_by('-total', 'first_id')
+        .values_list('rating', flat=True)
+        .first()
     )
     
-    # Recent activity (last 7 days)
-    seven_days_ago = timezone.now() - timedelta(days=7)
-    recent_activity = ratings.filter(created_at__gte=seven_days_ago).count()
-    
-    # Most frequently given rating
-    rating_counts = {}
-    for rating in ratings:
-        r = str(rating.rating)
-        rating_counts[r] = rating_counts.get(r, 0) + 1
-    
-    favorite_rating = max(rating_counts.items(), key=lambda x: x[1])[0] if rating_counts else None
-    
     return {
-        'total_ratings': stats['total_ratings'],
-        'average_rating_given': round(stats['avg_rating_given'], 2) if stats['avg_rating_given'] else 0.0,
-        'networks_rated': stats['networks_rated'],
-        'recent_activity': recent_activity,
-        'favorite_rating': favorite_rating
+        'total_ratings': stats.rating_count,
+        'average_rating_given': round(stats.average_rating, 2),
+        'networks_rated': stats.networks_rated,
+        'recent_activity': stats.recent_activity(),
+        'favorite_rating': str(favorite) if favorite is not None else None
     }
 
 
@@ -251,15 +351,18 @@ def calculate_network_trend(network_id: int, days: int = 30) -> Dict:
     Returns:
         Dictionary with trend information
     """
-    end_date = timezone.now()
-    start_date = end_date - timedelta(days=days)
-    
-    ratings = NetworkRating.objects.filter(
-        network_id=network_id,
-        created_at__gte=start_date
-    ).order_by('created_at')
-    
-    if not ratings.exists():
+    # Summed from the daily buckets: the window is the last `days` whole days
+    trend = window_trend(network_id, days)
+    return _trend_summary({
+        'trend_count': trend['total_ratings'],
+        'first_half_avg': trend['first_half_avg'],
+        'second_half_avg': trend['second_half_avg'],
+    }, days)
+
+
+def _trend_summary(stats: Dict, days: int) -> Dict:
+    """Format `window_trend` output as `calculate_network_trend` reports it"""
+    if not stats['trend_count']:
         return {
             'trend': 'no_data',
             'change': 0.0,
@@ -267,14 +370,9 @@ def calculate_network_trend(network_id: int, days: int = 30) -> Dict:
             'period_days': days
         }
     
-    # Split into two halves
-    mid_point = start_date + timedelta(days=days//2)
-    
-    first_half = ratings.filter(created_at__lt=mid_point)
-    second_half = ratings.filter(created_at__gte=mid_point)
-    
-    first_avg = first_half.aggregate(avg=Avg('rating'))['avg'] or 0.0
-    second_avg = second_half.aggregate(avg=Avg('rating'))['avg'] or 0.0
+    # Compare the two halves of the window
+    first_avg = stats['first_half_avg']
+    second_avg = stats['second_half_avg']
     
     change = second_avg - first_avg
     
@@ -288,7 +386,7 @@ def calculate_network_trend(network_id: int, days: int = 30) -> Dict:
     return {
         'trend': trend,
         'change': round(change, 2),
-        'recent_ratings_count': ratings.count(),
+        'recent_ratings_count': stats['trend_count'],
         'period_days': days,
         'first_half_avg': round(first_avg, 2),
         'second_half_avg': round(second_avg, 2)
@@ -305,8 +403,12 @@ def get_network_performance_insights(network_id: int) -> Dict:
     Returns:
         Dictionary with comprehensive insights
     """
-    basic_stats = calculate_network_average_rating(network_id)
-    trend = calculate_network_trend(network_id)
+    # Totals and histogram from the rollup; windows and trend from the
+    # daily buckets, like calculate_network_trend
+    stats = NetworkRatingStats.objects.filter(network_id=network_id).first()
+    windows = window_averages(network_id, (7, 30))
+    basic_stats = _average_rating_summary(stats, windows['30'])
+    trend = calculate_network_trend(network_id, 30)
     
     ratings = NetworkRating.objects.filter(network_id=network_id)
     
@@ -319,9 +421,7 @@ def get_network_performance_insights(network_id: int) -> Dict:
     ).order_by('-avg_rating')
     
     # Time-based analysis
-    recent_ratings = ratings.filter(
-        created_at__gte=timezone.now() - timedelta(days=7)
-    ).count()
+    recent_ratings = windows['7']['total_ratings']
     
     return {
         **basic_stats,
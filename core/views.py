@@ -2,24 +2,48 @@ from rest_framework import viewsets
 from rest_framework.response import Response
 from geopy.geocoders import Nominatim
 from core.models import Comment, Network, NetworkDevice, NetworkRating
+from core.pagination import CommentPagination, KeysetPagination, ReplyPagination, SearchRankPagination
+from core.rollups import stats_for
+from core.stats import aggregate_networks_stats
+from core.timeseries import GRANULARITIES, rating_series, window_averages, window_start
+from core.search import search_ratings
+from core.querysets import (
+    comments_serializer_context, first_per_network, prefetch_ratings, prepare_ratings_queryset, ratings_serializer_context,
+)
+from core.threads import attach_replies, comments_queryset
 from core.serializers import  CommentSerializer, NetworkDeviceSerializer, NetworkRatingSerializer, NetworkSerializer
 from django.contrib.gis.measure import Distance
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.exceptions import NotFound
 from rest_framework_simplejwt.authentication import JWTAuthentication
-from rest_framework.permissions import AllowAny, IsAuthenticated
-from django.db import models
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from django.db.models import Avg, Count
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from datetime import date, timedelta
 
-from core.utils import get_location_data, get_nearby_ratings
+from core.geoip import ipstack_breaker, location_cache
+from core.autocomplete import network_autocomplete
+from core.conditional import conditional_get
+from core.response_cache import cache_response, response_cache
+from core.enrichment import enqueue_location_enrichment, storable_ip
+from core.fastserializers import FastSerializer, device_rows, network_rows
+from core.export import FORMATS as EXPORT_FORMATS, export_lines, parse_since
+from core.ingest import ingest_rating_batch
+from core.utils import filter_nearby, get_client_ip, get_location_data
 
 class NetworkRatingListCreate(APIView):
     serializer_class = NetworkRatingSerializer
+    pagination_class = KeysetPagination
 
     """
     List all network ratings, or create a new network rating.
     """
+    # Nearby results (the default) depend on the client's location
+    @conditional_get(data_sets=('networks', 'devices', 'ratings'), per_user=True, per_client_ip=True)
     def get(self, request):
         try:
             # Get query parameters for filtering
@@ -41,32 +65,22 @@ class NetworkRatingListCreate(APIView):
             if min_rating:
                 ratings = ratings.filter(rating__gte=float(min_rating))
             if search:
-                ratings = ratings.filter(
-                    models.Q(review__icontains=search) |
-                    models.Q(network__name__icontains=search) |
-                    models.Q(address__icontains=search)
-                )
+                ratings = search_ratings(ratings, search)
             
             # Location-based filtering
             if nearby:
                 loca_data = get_location_data(request)
                 if loca_data:
                     _, longitude, latitude = loca_data
-                    ratings_list = list(ratings)
-                    nearby_ratings = get_nearby_ratings(latitude, longitude, radius)
-                    # Filter to only include nearby ratings
-                    ratings = [r for r in ratings_list if r in nearby_ratings]
-                else:
-                    ratings = ratings.all()
-            else:
-                ratings = ratings.all()
-            
-            # Order by creation date (newest first)
-            if hasattr(ratings, 'order_by'):
-                ratings = ratings.order_by('-created_at')
+                    ratings = filter_nearby(ratings, latitude, longitude, radius)
             
-            serializer = NetworkRatingSerializer(ratings, many=True, context={"request": request})
-            return Response(serializer.data)
+            # Newest first (best match first when searching), one page at a time
+            paginator = SearchRankPagination() if search else self.pagination_class()
+            page = prefetch_ratings(paginator.paginate_queryset(prepare_ratings_queryset(ratings), request, view=self))
+            data = FastSerializer(ratings_serializer_context(request, page)).ratings(page)
+            return paginator.get_paginated_response(data)
+        except NotFound:
+            raise
         except Exception as e:
             return Response(
                 {"error": "An error occurred while fetching ratings", "details": str(e)}, 
@@ -85,20 +99,113 @@ class NetworkRatingListCreate(APIView):
 
         serializer = NetworkRatingSerializer(data=request.data, context={"request": request})
         if serializer.is_valid():
-            address = serializer.validated_data.get("address")
-            loca_data = get_location_data(request)
-            if loca_data:
-                addy, longitude, latitude = loca_data
-                address = f"{address}, {addy}"
-                serializer.validated_data["latitude"] = latitude
-                serializer.validated_data["longitude"] = longitude
-                serializer.validated_data["address"] = address
-            serializer.save(user=request.user)
+            # Geolocation runs in the background so the write never waits on ipstack
+            ip = get_client_ip(request)
+            rating = serializer.save(user=request.user, location_pending=bool(ip), client_ip=storable_ip(ip))
+            if ip:
+                enqueue_location_enrichment(rating.id, ip, serializer.validated_data.get("address"))
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
 
+class NetworkRatingBatchView(APIView):
+    """
+    Create up to RATING_BATCH_MAX_ITEMS ratings in one request.
+
+    Body: `{"ratings": [...]}`, each item shaped like a single rating post
+    (plus optional `latitude`/`longitude`, and `user_id` for staff). Items
+    are validated and created independently; the response lists the outcome
+    of every item in order.
+    """
+    authentication_classes = (JWTAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request):
+        items = request.data.get('ratings') if isinstance(request.data, dict) else None
+        if not isinstance(items, list) or not items:
+            return Response(
+                {"error": "Invalid parameters", "details": "ratings must be a non-empty list"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(items) > settings.RATING_BATCH_MAX_ITEMS:
+            return Response(
+                {"error": "Invalid parameters",
+                 "details": f"at most {settings.RATING_BATCH_MAX_ITEMS} ratings per batch"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            results = ingest_rating_batch(
+                items, request.user,
+                chunk_size=settings.RATING_BATCH_CHUNK_SIZE,
+                allow_other_users=request.user.is_staff,
+            )
+        except Exception as e:
+            return Response(
+                {"error": "An error occurred while creating ratings", "details": str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        created = sum(1 for result in results if result['status'] == 'created')
+        return Response({
+            'created': created,
+            'failed': len(results) - created,
+            'results': results,
+        })
+
+
+class NetworkRatingExportView(APIView):
+    """
+    Stream every rating as NDJSON or CSV (staff only).
+
+    Query parameters:
+        output: 'ndjson' (default) or 'csv'; `format` is accepted as well
+        since: ISO date or datetime; only ratings created from then on
+        network_id: Only ratings of this network
+        cursor: ID of the last rating already received, to resume an
+            interrupted export (rows are sent in ID order)
+        limit: Maximum number of ratings
+
+    Rows are encoded as they are read from the database, so the response
+    starts at once and memory use doesn't grow with the table.
+    """
+    authentication_classes = (JWTAuthentication,)
+    permission_classes = (IsAdminUser,)
+
+    def perform_content_negotiation(self, request, force=False):
+        # DRF reads `?format=` as a renderer override and answers 404 when
+        # no renderer has that name (e.g. csv); here it names the export
+        # format, and only error responses go through a renderer.
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request):
+        output = request.query_params.get('output') or request.query_params.get('format') or 'ndjson'
+        try:
+            since = parse_since(request.query_params.get('since'))
+            network_id = request.query_params.get('network_id')
+            network_id = int(network_id) if network_id else None
+            cursor = request.query_params.get('cursor')
+            cursor = int(cursor) if cursor else None
+            limit = request.query_params.get('limit')
+            limit = int(limit) if limit else None
+            if limit is not None and limit < 1:
+                raise ValueError("limit must be positive")
+            lines = export_lines(
+                output, since=since, network_id=network_id, cursor=cursor, limit=limit,
+                chunk_size=settings.RATING_EXPORT_CHUNK_SIZE,
+            )
+        except ValueError as e:
+            return Response(
+                {"error": "Invalid parameters", "details": str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        response = StreamingHttpResponse(lines, content_type=f'{EXPORT_FORMATS[output]}; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="ratings.{output}"'
+        response['Cache-Control'] = 'no-store'
+        return response
+
+
 class NetworkRatingDetail(APIView):
     serializer_class = NetworkRatingSerializer
     authentication_classes = (JWTAuthentication,)
@@ -106,22 +213,22 @@ class NetworkRatingDetail(APIView):
     """
     Retrieve, update, or delete a network rating instance.
     """
-    def get_object(self, pk):
+    def get_object(self, pk, queryset=None):
         try:
-            return NetworkRating.objects.get(pk=pk)
+            return (queryset if queryset is not None else NetworkRating.objects).get(pk=pk)
         except NetworkRating.DoesNotExist:
             return None
 
     def get(self, request, pk, format=None):
         try:
-            rating = self.get_object(pk)
+            rating = self.get_object(pk, prepare_ratings_queryset(NetworkRating.objects.all()))
             if rating is None:
                 return Response(
                     {"error": "Rating not found"}, 
                     status=status.HTTP_404_NOT_FOUND
                 )
-            serializer = NetworkRatingSerializer(rating)
-            return Response(serializer.data)
+            prefetch_ratings([rating])
+            return Response(FastSerializer(ratings_serializer_context(request, [rating])).rating(rating))
         except Exception as e:
             return Response(
                 {"error": "An error occurred while fetching the rating", "details": str(e)}, 
@@ -199,17 +306,12 @@ class CommentView(APIView):
 
     def patch(self, request, comment_id, format=None):
         try:
-            comment = Comment.objects.get(pk=comment_id)
-            if request.user in comment.likes.all():
-                comment.likes.remove(request.user)
-                liked = False
-            else:
-                comment.likes.add(request.user)
-                liked = True
+            comment = Comment.objects.only('id').get(pk=comment_id)
+            liked, total_likes = comment.toggle_like(request.user)
             return Response({
                 'status': 'like status changed',
                 'liked': liked,
-                'total_likes': comment.likes.count()
+                'total_likes': total_likes
             }, status=status.HTTP_200_OK)
         except Comment.DoesNotExist:
             return Response(
@@ -250,14 +352,76 @@ class CommentView(APIView):
             )
 
 
+class RatingCommentsView(APIView):
+    """
+    Page through the top-level comments of a rating, newest first, each with
+    the first few of its replies.
+
+    Rating responses only carry the newest few comments; their
+    `more_comments` link points here.
+    """
+    pagination_class = CommentPagination
+
+    def get(self, request, pk):
+        try:
+            if not NetworkRating.objects.filter(pk=pk).exists():
+                return Response(
+                    {"error": "Rating not found"}, 
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            comments = comments_queryset().filter(network_rating_id=pk, parent__isnull=True)
+            paginator = self.pagination_class()
+            page = attach_replies(paginator.paginate_queryset(comments, request, view=self))
+            shown = [comment.id for comment in page] + [reply.id for comment in page for reply in comment.prefetched_replies]
+            context = comments_serializer_context(request, shown)
+            return paginator.get_paginated_response(FastSerializer(context).comments(page))
+        except NotFound:
+            raise
+        except Exception as e:
+            return Response(
+                {"error": "An error occurred while fetching comments", "details": str(e)}, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class CommentRepliesView(APIView):
+    """
+    Page through the replies of a comment, oldest first.
+
+    Threads embedded in rating responses only carry the first few replies of
+    each comment; their `more_replies` link points here.
+    """
+    pagination_class = ReplyPagination
+
+    def get(self, request, comment_id):
+        try:
+            if not Comment.objects.filter(pk=comment_id).exists():
+                return Response(
+                    {"error": "Comment not found"}, 
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            replies = comments_queryset().filter(parent_id=comment_id)
+            paginator = self.pagination_class()
+            page = paginator.paginate_queryset(replies, request, view=self)
+            context = comments_serializer_context(request, [reply.id for reply in page])
+            return paginator.get_paginated_response(FastSerializer(context).comments(page))
+        except NotFound:
+            raise
+        except Exception as e:
+            return Response(
+                {"error": "An error occurred while fetching replies", "details": str(e)}, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
 class DevicesView(APIView):
     serializer_class = NetworkDeviceSerializer
 
+    @cache_response('devices', data_sets=('devices',))
     def get(self, request):
         try:
             devices = NetworkDevice.objects.all()
-            serializer = NetworkDeviceSerializer(devices, many=True)
-            return Response(serializer.data)
+            return Response(FastSerializer().devices(device_rows(devices)))
         except Exception as e:
             return Response(
                 {"error": "An error occurred while fetching devices", "details": str(e)}, 
@@ -267,6 +431,8 @@ class DevicesView(APIView):
 class NetworkView(APIView):
     serializer_class = NetworkSerializer
 
+    @conditional_get(data_sets=('networks',))
+    @cache_response('isp-providers', data_sets=('networks',))
     def get(self, request):
         try:
             search = request.GET.get('search')
@@ -281,8 +447,7 @@ class NetworkView(APIView):
                 networks = networks.filter(name__icontains=search)
             
             networks = networks.order_by('name')
-            serializer = NetworkSerializer(networks, many=True, context={"request": request})
-            return Response(serializer.data)
+            return Response(FastSerializer({"request": request}).networks(network_rows(networks)))
         except Exception as e:
             return Response(
                 {"error": "An error occurred while fetching networks", "details": str(e)}, 
@@ -290,34 +455,77 @@ class NetworkView(APIView):
             )
 
 
+class NetworkAutocompleteView(APIView):
+    """
+    Networks whose name or slug matches what was typed so far, for the ISP
+    picker. Served from an in-process index, without database queries.
+
+    Query parameters:
+        q: Text typed so far
+        limit: Maximum number of matches (default NETWORK_AUTOCOMPLETE_LIMIT)
+    """
+
+    def get(self, request):
+        try:
+            limit = int(request.GET.get('limit', settings.NETWORK_AUTOCOMPLETE_LIMIT))
+        except ValueError as e:
+            return Response(
+                {"error": "Invalid parameters", "details": str(e)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        limit = max(1, min(limit, settings.NETWORK_AUTOCOMPLETE_MAX_LIMIT))
+
+        try:
+            matches = network_autocomplete.search(request.GET.get('q', ''), limit)
+            return Response([
+                {**network, 'image': request.build_absolute_uri(network['image']) if network['image'] else None}
+                for network in matches
+            ])
+        except Exception as e:
+            return Response(
+                {"error": "An error occurred while searching networks", "details": str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
 class NetworkStatisticsView(APIView):
     """
     Get aggregated statistics for networks including average ratings and review counts.
     """
     
+    @conditional_get(data_sets=('networks', 'ratings'))
+    @cache_response('statistics', data_sets=('networks', 'ratings'))
     def get(self, request):
         try:
-            # Get statistics for all networks
-            networks_stats = Network.objects.annotate(
-                avg_rating=Avg('networkrating__rating'),
-                review_count=Count('networkrating'),
-                total_comments=Count('networkrating__comments')
-            ).values(
+            # Get statistics for all networks from their rollups
+            networks_stats = Network.objects.values(
                 'id', 'name', 'slug', 'status',
-                'avg_rating', 'review_count', 'total_comments'
+                'rating_stats__rating_count', 'rating_stats__rating_sum', 'rating_stats__comment_count'
+            )
+            
+            # Recent activity of every network, from one grouped query over
+            # the last 30 days of ratings
+            recent_stats = aggregate_networks_stats(
+                ratings=NetworkRating.objects.filter(created_at__gte=timezone.now() - timedelta(days=30))
             )
             
             # Format the response
             formatted_stats = []
             for network in networks_stats:
+                review_count = network['rating_stats__rating_count'] or 0
+                avg_rating = float(network['rating_stats__rating_sum']) / review_count if review_count else 0
+                recent = recent_stats.get(network['id'])
                 formatted_stats.append({
                     'id': network['id'],
                     'name': network['name'],
                     'slug': network['slug'],
                     'status': network['status'],
-                    'average_rating': round(network['avg_rating'], 1) if network['avg_rating'] else 0,
-                    'total_reviews': network['review_count'],
-                    'total_comments': network['total_comments'],
+                    'average_rating': round(avg_rating, 1) if avg_rating else 0,
+                    'total_reviews': review_count,
+                    'total_comments': network['rating_stats__comment_count'] or 0,
+                    'reviews_last_7_days': recent['last_7_count'] if recent else 0,
+                    'reviews_last_30_days': recent['last_30_count'] if recent else 0,
+                    'recent_average': round(recent['last_30_avg'], 1) if recent else 0,
                 })
             
             return Response({
@@ -336,12 +544,15 @@ class NetworkDetailStatsView(APIView):
     Get detailed statistics for a specific network including rating distribution.
     """
     
+    # The recent reviews carry the requesting user's "liked" flags
+    @cache_response('statistics-detail', data_sets=('networks', 'devices', 'ratings'), per_user=True)
     def get(self, request, network_id):
         try:
-            network = Network.objects.get(id=network_id)
+            network = Network.objects.select_related('rating_stats').get(id=network_id)
             ratings = NetworkRating.objects.filter(network=network)
+            stats = stats_for(network)
             
-            if not ratings.exists():
+            if not stats.rating_count:
                 return Response({
                     'network': {
                         'id': network.id,
@@ -356,21 +567,9 @@ class NetworkDetailStatsView(APIView):
                     }
                 })
             
-            # Calculate statistics
-            stats = ratings.aggregate(
-                avg_rating=Avg('rating'),
-                total_reviews=Count('id')
-            )
-            
-            # Rating distribution
-            rating_distribution = {}
-            for i in range(1, 6):
-                count = ratings.filter(rating=i).count()
-                rating_distribution[str(i)] = count
-            
             # Get recent reviews (last 5)
-            recent_reviews = ratings.order_by('-created_at')[:5]
-            recent_serialized = NetworkRatingSerializer(recent_reviews, many=True, context={"request": request}).data
+            recent_reviews = prefetch_ratings(prepare_ratings_queryset(ratings.order_by('-created_at')[:5]))
+            recent_serialized = FastSerializer(ratings_serializer_context(request, recent_reviews)).ratings(recent_reviews)
             
             return Response({
                 'network': {
@@ -379,9 +578,9 @@ class NetworkDetailStatsView(APIView):
                     'slug': network.slug
                 },
                 'statistics': {
-                    'total_reviews': stats['total_reviews'],
-                    'average_rating': round(stats['avg_rating'], 1) if stats['avg_rating'] else 0,
-                    'rating_distribution': rating_distribution,
+                    'total_reviews': stats.rating_count,
+                    'average_rating': round(stats.average_rating, 1) if stats.average_rating else 0,
+                    'rating_distribution': stats.rating_distribution,
                     'recent_reviews': recent_serialized
                 }
             })
@@ -397,6 +596,70 @@ class NetworkDetailStatsView(APIView):
             )
 
 
+class NetworkRatingSeriesView(APIView):
+    """
+    Get a network's ratings over time, per day, week or month.
+
+    Query parameters:
+        granularity: day, week or month (default day)
+        days: Length of the series ending today (default 90), or
+        start, end: Explicit range as YYYY-MM-DD
+        moving_average: Add the trailing average over this many days to every point
+    """
+    max_days = 3660
+    max_moving_average = 365
+
+    @cache_response('statistics-series', data_sets=('networks', 'ratings'))
+    def get(self, request, network_id):
+        try:
+            network = Network.objects.get(id=network_id)
+
+            granularity = request.GET.get('granularity', 'day')
+            if granularity not in GRANULARITIES:
+                raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+            end = date.fromisoformat(request.GET['end']) if request.GET.get('end') else timezone.localdate()
+            if request.GET.get('start'):
+                start = date.fromisoformat(request.GET['start'])
+            else:
+                start = window_start(int(request.GET.get('days', 90)), end)
+            moving_average = int(request.GET['moving_average']) if request.GET.get('moving_average') else None
+
+            if start > end or (end - start).days >= self.max_days:
+                raise ValueError(f"The range must be between 1 and {self.max_days} days")
+            if moving_average is not None and not 1 <= moving_average <= self.max_moving_average:
+                raise ValueError(f"moving_average must be between 1 and {self.max_moving_average}")
+        except Network.DoesNotExist:
+            return Response(
+                {"error": "Network not found"}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+        except ValueError as e:
+            return Response(
+                {"error": "Invalid parameters", "details": str(e)}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            return Response({
+                'network': {
+                    'id': network.id,
+                    'name': network.name,
+                    'slug': network.slug
+                },
+                'granularity': granularity,
+                'start': start.isoformat(),
+                'end': end.isoformat(),
+                'moving_average': moving_average,
+                'points': rating_series(network.id, start, end, granularity, moving_average),
+                'windows': window_averages(network.id, today=end),
+            })
+        except Exception as e:
+            return Response(
+                {"error": "An error occurred while fetching the rating series", "details": str(e)}, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
 class LocationBasedRecommendationsView(APIView):
     """
     Get network recommendations based on user's location.
@@ -415,58 +678,86 @@ class LocationBasedRecommendationsView(APIView):
                 )
             
             address, longitude, latitude = loca_data
-            
-            # Get nearby ratings
-            nearby_ratings = get_nearby_ratings(latitude, longitude, radius)
-            
-            if not nearby_ratings:
-                return Response({
-                    'location': {'address': address, 'latitude': latitude, 'longitude': longitude},
-                    'recommendations': [],
-                    'message': f'No ratings found within {radius}km of your location'
-                })
-            
-            # Group by network and calculate stats
-            network_stats = {}
-            for rating in nearby_ratings:
-                if rating.network:
-                    net_id = rating.network.id
-                    if net_id not in network_stats:
-                        network_stats[net_id] = {
-                            'network': rating.network,
-                            'ratings': [],
-                            'total_rating': 0,
-                            'count': 0
-                        }
-                    network_stats[net_id]['ratings'].append(rating)
-                    network_stats[net_id]['total_rating'] += float(rating.rating)
-                    network_stats[net_id]['count'] += 1
-            
-            # Calculate averages and filter by minimum reviews
-            recommendations = []
-            for net_id, stats in network_stats.items():
-                if stats['count'] >= min_reviews:
-                    avg_rating = stats['total_rating'] / stats['count']
-                    recommendations.append({
-                        'network': NetworkSerializer(stats['network']).data,
-                        'average_rating': round(avg_rating, 1),
-                        'review_count': stats['count'],
-                        'recent_reviews': NetworkRatingSerializer(
-                            stats['ratings'][:3], many=True, context={"request": request}
-                        ).data
-                    })
-            
-            # Sort by average rating (descending)
-            recommendations.sort(key=lambda x: x['average_rating'], reverse=True)
-            
-            return Response({
-                'location': {'address': address, 'latitude': latitude, 'longitude': longitude},
-                'search_radius_km': radius,
-                'recommendations': recommendations[:10]  # Top 10 recommendations
-            })
+
+            # Cached per location and parameters; the recent reviews carry
+            # the requesting user's "liked" flags.
+            params = {
+                'address': address, 'latitude': latitude, 'longitude': longitude,
+                'radius': radius, 'min_reviews': min_reviews,
+                'user': request.user.pk if request.user.is_authenticated else '',
+                'host': request.build_absolute_uri('/'),
+            }
+            data = response_cache.get_or_compute(
+                'recommendations', params, ('networks', 'devices', 'ratings'),
+                lambda: self.recommendations(request, address, latitude, longitude, radius, min_reviews),
+            )
+            return Response(data)
             
         except Exception as e:
             return Response(
                 {"error": "An error occurred while generating recommendations", "details": str(e)}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
\ No newline at end of file
+            )
+
+    def recommendations(self, request, address, latitude, longitude, radius, min_reviews):
+        # Count and average the nearby ratings of every network in one query
+        nearby_ratings = filter_nearby(NetworkRating.objects.all(), latitude, longitude, radius)
+        network_stats = aggregate_networks_stats(ratings=nearby_ratings)
+        
+        if not network_stats:
+            return {
+                'location': {'address': address, 'latitude': latitude, 'longitude': longitude},
+                'recommendations': [],
+                'message': f'No ratings found within {radius}km of your location'
+            }
+        
+        # Filter by minimum reviews, sort by average rating (descending) and
+        # keep the top 10
+        ranked = sorted(
+            (
+                (net_id, stats) for net_id, stats in network_stats.items()
+                if stats['total_ratings'] >= min_reviews
+            ),
+            key=lambda item: (-round(item[1]['average_rating'], 1), item[0])
+        )[:10]
+        
+        # The first 3 nearby reviews (lowest rated first) of every network
+        # shown, with their comment threads, all at once
+        shown = prefetch_ratings(first_per_network(
+            prepare_ratings_queryset(nearby_ratings), [net_id for net_id, _ in ranked], 3, ('rating', 'id'),
+        ))
+        reviews = {}
+        for rating in shown:
+            reviews.setdefault(rating.network_id, []).append(rating)
+        
+        serializer = FastSerializer(ratings_serializer_context(request, shown))
+        recommendations = [
+            {
+                'network': FastSerializer().network(reviews[net_id][0].network),
+                'average_rating': round(stats['average_rating'], 1),
+                'review_count': stats['total_ratings'],
+                'recent_reviews': serializer.ratings(reviews[net_id]),
+            }
+            for net_id, stats in ranked
+        ]
+        
+        return {
+            'location': {'address': address, 'latitude': latitude, 'longitude': longitude},
+            'search_radius_km': radius,
+            'recommendations': recommendations
+        }
+
+
+class CacheStatsView(APIView):
+    """
+    Hit/miss counters of this worker's caches (staff only).
+    """
+    authentication_classes = (JWTAuthentication,)
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response({
+            'ip_location': location_cache.stats(),
+            'ipstack_circuit': ipstack_breaker.state,
+            'responses': response_cache.stats(),
+        })
@@ -101,6 +101,31 @@ else:
         "default": dj_database_url.config(default=DATABASE_URL, conn_max_age=1800),
     }
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# The default of 300 entries is far below what the IP location and response
+# caches hold; past MAX_ENTRIES a third of the entries is culled, including
+# single-flight locks.
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 100000))
+
+if ENV == 'LOCAL':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': CACHE_MAX_ENTRIES},
+        }
+    }
+else:
+    # Shared by every gunicorn worker; created by `manage.py createcachetable`.
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'radeur_cache',
+            'OPTIONS': {'MAX_ENTRIES': CACHE_MAX_ENTRIES},
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -196,3 +221,71 @@ REST_FRAMEWORK = {
 }
 
 CSRF_TRUSTED_ORIGINS = ['https://radeur.up.railway.app', "http://127.0.0.1:7000", "http://localhost:8000" ]
+
+
+# IP geolocation
+# One of "ipstack", "local" (offline database only) or "local-then-ipstack".
+IP_GEOLOCATION_BACKEND = os.getenv("IP_GEOLOCATION_BACKEND", "ipstack")
+# Built from a CSV of IP ranges with `manage.py build_ipdb`.
+IP_GEOLOCATION_DB_PATH = os.getenv("IP_GEOLOCATION_DB_PATH", str(BASE_DIR / "data" / "ip-locations.ipdb"))
+
+IP_LOCATION_CACHE_TTL = int(os.getenv("IP_LOCATION_CACHE_TTL", 60 * 60 * 24))
+IP_LOCATION_NEGATIVE_CACHE_TTL = int(os.getenv("IP_LOCATION_NEGATIVE_CACHE_TTL", 60 * 5))
+IP_LOCATION_LOCAL_CACHE_SIZE = int(os.getenv("IP_LOCATION_LOCAL_CACHE_SIZE", 10000))
+
+IPSTACK_CONNECT_TIMEOUT = float(os.getenv("IPSTACK_CONNECT_TIMEOUT", 2))
+IPSTACK_READ_TIMEOUT = float(os.getenv("IPSTACK_READ_TIMEOUT", 3))
+IPSTACK_MAX_RETRIES = int(os.getenv("IPSTACK_MAX_RETRIES", 2))
+IPSTACK_RETRY_BACKOFF = float(os.getenv("IPSTACK_RETRY_BACKOFF", 0.2))
+IPSTACK_POOL_SIZE = int(os.getenv("IPSTACK_POOL_SIZE", 10))
+IPSTACK_BREAKER_THRESHOLD = int(os.getenv("IPSTACK_BREAKER_THRESHOLD", 5))
+IPSTACK_BREAKER_RESET_TIMEOUT = float(os.getenv("IPSTACK_BREAKER_RESET_TIMEOUT", 30))
+
+# Location lookups for new ratings run on a background thread pool; set
+# LOCATION_ENRICHMENT_SYNC to run them inline (e.g. in tests).
+LOCATION_ENRICHMENT_SYNC = os.getenv("LOCATION_ENRICHMENT_SYNC", "false").lower() == "true"
+LOCATION_ENRICHMENT_WORKERS = int(os.getenv("LOCATION_ENRICHMENT_WORKERS", 4))
+LOCATION_ENRICHMENT_MAX_ATTEMPTS = int(os.getenv("LOCATION_ENRICHMENT_MAX_ATTEMPTS", 3))
+LOCATION_ENRICHMENT_RETRY_BACKOFF = float(os.getenv("LOCATION_ENRICHMENT_RETRY_BACKOFF", 1.0))
+# Ratings still pending this many seconds after creation lost their queued
+# lookup; `manage.py enrich_pending_locations` (e.g. from cron) retries them.
+LOCATION_ENRICHMENT_STALE_AFTER = int(os.getenv("LOCATION_ENRICHMENT_STALE_AFTER", 600))
+
+# Comment threads embedded in rating responses show this many comments per
+# rating and replies per comment; the rest are paged in from
+# /ratings/<id>/comments/ and /comments/<id>/replies/.
+COMMENT_PREVIEW = int(os.getenv("COMMENT_PREVIEW", 10))
+COMMENT_PAGE_SIZE = int(os.getenv("COMMENT_PAGE_SIZE", 20))
+COMMENT_REPLIES_PREVIEW = int(os.getenv("COMMENT_REPLIES_PREVIEW", 3))
+COMMENT_REPLIES_PAGE_SIZE = int(os.getenv("COMMENT_REPLIES_PAGE_SIZE", 20))
+
+# Responses of the statistics and catalog endpoints are cached until the data
+# they are computed from changes (see core/response_cache.py).
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_ALIAS = os.getenv("RESPONSE_CACHE_ALIAS", "default")
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", 60 * 10))
+# When an entry is being recomputed, other requests get the previous result
+# for the same parameters (kept for RESPONSE_CACHE_STALE_TTL), or wait up to
+# RESPONSE_CACHE_WAIT_TIMEOUT seconds for the new one.
+RESPONSE_CACHE_STALE_TTL = int(os.getenv("RESPONSE_CACHE_STALE_TTL", 60 * 60 * 24))
+RESPONSE_CACHE_WAIT_TIMEOUT = float(os.getenv("RESPONSE_CACHE_WAIT_TIMEOUT", 5))
+RESPONSE_CACHE_LOCK_TIMEOUT = float(os.getenv("RESPONSE_CACHE_LOCK_TIMEOUT", 30))
+RESPONSE_CACHE_POLL_INTERVAL = float(os.getenv("RESPONSE_CACHE_POLL_INTERVAL", 0.05))
+
+# Network autocomplete is served from an in-process index; workers check
+# whether networks changed elsewhere at most this often (in seconds).
+NETWORK_AUTOCOMPLETE_REFRESH_INTERVAL = float(os.getenv("NETWORK_AUTOCOMPLETE_REFRESH_INTERVAL", 30))
+NETWORK_AUTOCOMPLETE_LIMIT = int(os.getenv("NETWORK_AUTOCOMPLETE_LIMIT", 10))
+NETWORK_AUTOCOMPLETE_MAX_LIMIT = int(os.getenv("NETWORK_AUTOCOMPLETE_MAX_LIMIT", 50))
+
+# Batch rating uploads (POST /ratings/batch/): maximum ratings per request,
+# and ratings inserted per transaction.
+RATING_BATCH_MAX_ITEMS = int(os.getenv("RATING_BATCH_MAX_ITEMS", 1000))
+RATING_BATCH_CHUNK_SIZE = int(os.getenv("RATING_BATCH_CHUNK_SIZE", 500))
+
+# Rating exports (GET /ratings/export/): rows fetched from the database at a
+# time while streaming.
+RATING_EXPORT_CHUNK_SIZE = int(os.getenv("RATING_EXPORT_CHUNK_SIZE", 2000))
+
+# Records validated and inserted per transaction by `manage.py import_ratings`.
+RATING_IMPORT_BATCH_SIZE = int(os.getenv("RATING_IMPORT_BATCH_SIZE", 2000))
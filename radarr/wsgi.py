@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'radarr.settings')
 
 application = get_wsgi_application()
+
+# Build the network autocomplete index before the first request
+from core.autocomplete import network_autocomplete  # noqa: E402
+
+network_autocomplete.warm()